@@ -0,0 +1,188 @@
+"""Асинхронные представления чтения для запуска под ASGI.
+
+Синхронный воркер gunicorn занят запросом целиком, пока медленный клиент
+дописывает запрос или читает ответ и пока формируется PDF. Здесь GET списка
+и страницы рецептов, тегов и ингредиентов выполняется в цикле событий:
+аутентификация, права и фильтры - те же методы вьюсета (в потоке
+запроса), выборка - через async ORM (acount, aget, async for),
+сериализация и рендер - в цикле. Остальные методы и курсорная пагинация
+передаются синхронному вьюсету.
+
+Потоковые ответы синхронных действий формируются по частям в пуле
+из ASYNC_RENDER_WORKERS потоков, а не в потоке запроса: PDF списка
+покупок - по страницам, готовый PDF читается из файла.
+
+Маршруты подключаются в api.urls при ASYNC_VIEWS=True.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import InvalidPage
+from django.db import close_old_connections
+from django.http import Http404, StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from recipes.models import TableVersion
+
+from .caching import VersionedCacheMixin
+
+render_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_RENDER_WORKERS, thread_name_prefix='render')
+
+
+def next_chunk(iterator, done):
+    """next() в потоке пула; соединения с базой, открытые частью ответа
+    (например, сохранение готового PDF), закрываются как после запроса:
+    потоки пула запросов не обслуживают и сами их не закроют."""
+    try:
+        return next(iterator, done)
+    finally:
+        close_old_connections()
+
+
+async def iterate_in_executor(iterator, executor):
+    """Асинхронный итератор по синхронному: next() - в пуле потоков."""
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        chunk = await loop.run_in_executor(executor, next_chunk, iterator,
+                                           done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def async_view(viewset, actions, **initkwargs):
+    """Представление маршрута вьюсета, аргументы - как у as_view()."""
+    read = actions.get('get', '')
+    # Как у роутера: параметры @action (права, рендереры) - в initkwargs.
+    initkwargs.update(getattr(getattr(viewset, read, None), 'kwargs', {}))
+    sync_view = viewset.as_view(actions, **initkwargs)
+
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD') and read in ('list',
+                                                          'retrieve'):
+            return await AsyncRead(viewset(**initkwargs), read, request,
+                                   args, kwargs).run(sync_view)
+        response = await sync_to_async(sync_view)(request, *args, **kwargs)
+        # Под WSGI асинхронный итератор Django собрал бы в список целиком.
+        if (isinstance(request, ASGIRequest)
+                and isinstance(response, StreamingHttpResponse)
+                and not response.is_async):
+            response.streaming_content = iterate_in_executor(
+                response.streaming_content, render_executor)
+        return response
+
+    # csrf_exempt в Django 4.2 не поддерживает async-представления.
+    view.csrf_exempt = True
+    view.cls = viewset
+    view.initkwargs = initkwargs
+    view.actions = actions
+    return view
+
+
+class AsyncRead:
+    """GET list/retrieve вьюсета с выборкой через async ORM."""
+
+    def __init__(self, view, action, request, args, kwargs):
+        view.action_map = {'get': action, 'head': action}
+        view.args = args
+        view.kwargs = kwargs
+        self.view = view
+        self.http_request = request
+
+    async def run(self, sync_view):
+        view = self.view
+        request = view.initialize_request(self.http_request,
+                                          *view.args, **view.kwargs)
+        view.request = request
+        view.headers = view.default_response_headers
+        paginator = view.paginator
+        if (view.action == 'list' and hasattr(paginator, 'uses_cursor')
+                and paginator.uses_cursor(request)):
+            return await sync_to_async(sync_view)(
+                self.http_request, *view.args, **view.kwargs)
+        try:
+            # Аутентификация, права и throttling могут читать базу.
+            await sync_to_async(self.prepare)(request)
+            if self.table is not None:
+                response, key, headers = view.cached(request, self.table)
+                if response is not None:
+                    return self.finalize(request, response)
+                self.queryset = await sync_to_async(self.filter_queryset)()
+            if view.action == 'list':
+                response = await self.fetch_list(request)
+            else:
+                response = await self.fetch_object(request)
+            if self.table is not None:
+                response = view.store(key, headers, response)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+        return self.finalize(request, response)
+
+    def prepare(self, request):
+        """initial() и то, что нужно до выборки, за один переход в поток.
+
+        Для справочников с кешем - версия таблицы (фильтры вроде поиска
+        ингредиентов обращаются к базе и при попадании в кеш не нужны),
+        для остальных - отфильтрованный queryset.
+        """
+        view = self.view
+        view.initial(request, *view.args, **view.kwargs)
+        self.table = self.queryset = None
+        if isinstance(view, VersionedCacheMixin):
+            self.table = TableVersion.get(view.queryset.model)
+        else:
+            self.queryset = self.filter_queryset()
+
+    def filter_queryset(self):
+        return self.view.filter_queryset(self.view.get_queryset())
+
+    def finalize(self, request, response):
+        view = self.view
+        response = view.finalize_response(request, response,
+                                          *view.args, **view.kwargs)
+        return response.render()
+
+    async def fetch_object(self, request):
+        view = self.view
+        queryset = self.queryset
+        lookup = view.lookup_url_kwarg or view.lookup_field
+        try:
+            instance = await queryset.aget(
+                **{view.lookup_field: view.kwargs[lookup]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError):
+            # Текст как у get_object_or_404 синхронного вьюсета.
+            raise Http404(f'No {queryset.model._meta.object_name} '
+                          f'matches the given query.')
+        view.check_object_permissions(request, instance)
+        return Response(view.get_serializer(instance).data)
+
+    async def fetch_list(self, request):
+        view = self.view
+        queryset = self.queryset
+        paginator = view.paginator
+        page_size = paginator and paginator.get_page_size(request)
+        if not page_size:
+            objects = [instance async for instance in queryset]
+            return Response(view.get_serializer(objects, many=True).data)
+        # Как PageNumberPagination.paginate_queryset, но COUNT(*)
+        # и страница читаются асинхронно.
+        pages = paginator.django_paginator_class(queryset, page_size)
+        pages.count = await queryset.acount()
+        number = paginator.get_page_number(request, pages)
+        try:
+            page = pages.page(number)
+        except InvalidPage as exc:
+            raise NotFound(paginator.invalid_page_message.format(
+                page_number=number, message=str(exc)))
+        page.object_list = [instance async for instance in page.object_list]
+        paginator.page = page
+        paginator.request = request
+        return paginator.get_paginated_response(
+            view.get_serializer(page.object_list, many=True).data)
@@ -0,0 +1,776 @@
+"""Нагрузочные сценарии API для команд benchseed и benchrun.
+
+benchseed создаёт детерминированный набор данных (пользователи bench*,
+подписки, рецепты, избранное, списки покупок), benchrun гоняет по нему
+сценарии - в процессе через тестовый клиент Django или по HTTP
+к запущенному серверу - и считает пропускную способность, перцентили
+времени ответа и число SQL-запросов.
+
+Сценарий - функция (transport, data, rng), которая делает один или
+несколько запросов и возвращает список ответов; время сценария
+считается целиком, поэтому, например, пакетное и поштучное добавление
+в избранное сравниваются по одной и той же работе.
+"""
+import base64
+import csv
+import http.client
+import io
+import json
+import math
+import random
+import re
+import resource
+import shutil
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import redirect_stdout
+from urllib.parse import parse_qs, quote, urlsplit
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, reset_queries, transaction
+from django.http import QueryDict
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.serializers import ImageField
+
+from recipes.models import (IngredientModel, RecipeIngredients, RecipeModel,
+                            ShoppingCartRecipes, ShoppingListExport, TagModel,
+                            add_recipes)
+from users.models import User
+
+from .filters import RecipeFilter
+from .serializer_fields import Base64ImageField
+
+BENCH_PREFIX = 'bench'
+BENCH_PASSWORD = 'bench-password'
+BENCH_RECIPE_PREFIX = 'Замер'
+BENCH_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F2B134', 'dessert'),
+    ('Выпечка', '#B5651D', 'baking'),
+    ('Суп', '#D94F4F', 'soup'),
+    ('Салат', '#2FA36B', 'salad'),
+    ('Постное', '#5A8DEE', 'lenten'),
+    ('Гарнир', '#A0522D', 'side'),
+    ('Напитки', '#1E90FF', 'drinks'),
+)
+DISHES = ('Суп', 'Салат', 'Пирог', 'Рагу', 'Запеканка', 'Омлет',
+          'Каша', 'Паста', 'Котлеты', 'Соус', 'Десерт', 'Смузи')
+# Рецептов в одном сценарии пакетного и поштучного избранного
+BULK_SIZE = 10
+# Глубокая страница для сравнения OFFSET и курсора при limit=DEEP_LIMIT
+DEEP_PAGE = 10_000
+DEEP_LIMIT = 6
+# Шаг прохода к глубокому курсору (max_page_size курсорной пагинации)
+CURSOR_WALK_LIMIT = 200
+# Размеры списков покупок (ингредиентов) для замеров PDF
+CART_SIZES = (10, 100, 1000)
+# Сторона изображения с шумом для замера памяти при загрузке (~2.4 МБ PNG)
+LARGE_IMAGE_SIDE = 900
+# Записей в файле для замера ingredientsimport
+IMPORT_SIZE = 100_000
+IMPORT_UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries')
+
+Response = namedtuple('Response', 'ok body queries')
+Scenario = namedtuple('Scenario', 'name run client_only setup teardown')
+
+SCENARIOS = {}
+
+
+def scenario(name, client_only=False, setup=None, teardown=None):
+    """Регистрирует сценарий; setup(transport, data) готовит данные
+    для него до прогрева, teardown(transport, data) возвращает их после
+    замера, в замер они не входят."""
+    def register(run):
+        SCENARIOS[name] = Scenario(name, run, client_only, setup, teardown)
+        return run
+    return register
+
+
+def image_bytes(side, rng=None):
+    """PNG: однотонный или, с rng, из шума (не сжимается)."""
+    if rng is None:
+        image = Image.new('RGB', (side, side), '#E26C2D')
+    else:
+        image = Image.frombytes('RGB', (side, side),
+                                rng.randbytes(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def image_data_uri(side, rng=None):
+    return ('data:image/png;base64,'
+            + base64.b64encode(image_bytes(side, rng)).decode())
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу, values отсортированы."""
+    if not values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def max_rss():
+    """Пиковый RSS процесса в байтах (getrusage, на Linux - в КБ)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def summarize(durations, queries, requests, errors, elapsed, peak=None,
+              rss=None):
+    durations = sorted(durations)
+    summary = {
+        'samples': len(durations),
+        'requests': requests,
+        'errors': errors,
+        'throughput': round(len(durations) / elapsed, 1) if elapsed else None,
+        'requests_per_second': round(requests / elapsed, 1)
+        if elapsed else None,
+        'mean_ms': round(sum(durations) / len(durations) * 1000, 2)
+        if durations else None,
+    }
+    for percent in (50, 95, 99):
+        value = percentile(durations, percent)
+        summary[f'p{percent}_ms'] = (round(value * 1000, 2)
+                                     if value is not None else None)
+    counted = [count for count in queries if count is not None]
+    summary['queries'] = (round(sum(counted) / len(counted), 1)
+                          if counted else None)
+    if peak is not None:
+        summary['peak_memory_kb'] = round(peak / 1024)
+    if rss is not None:
+        summary['max_rss_kb'], summary['rss_growth_kb'] = (
+            round(value / 1024) for value in rss)
+    return summary
+
+
+class ClientTransport:
+    """Запросы в том же процессе через django.test.Client."""
+
+    name = 'client'
+    concurrent = False
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, token=None, body=None, expect=(200,),
+                authorization=None):
+        if token:
+            authorization = f'Token {token}'
+        headers = ({'HTTP_AUTHORIZATION': authorization} if authorization
+                   else {})
+        # Журнал запросов ограничен 9000 записей, при переполнении
+        # CaptureQueriesContext считает неверно.
+        reset_queries()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.generic(
+                method, path,
+                data=json.dumps(body) if body is not None else '',
+                content_type='application/json', **headers)
+            # Потоковый ответ формируется при чтении.
+            content = response.getvalue()
+        return Response(response.status_code in expect, content,
+                        len(context.captured_queries))
+
+
+class HTTPTransport:
+    """Запросы по HTTP, keep-alive соединение на поток.
+
+    Число запросов к базе берётся из заголовка Server-Timing, если
+    на сервере включено SQL_PROFILING.
+    """
+
+    name = 'http'
+    concurrent = True
+
+    def __init__(self, url, timeout=30):
+        parts = urlsplit(url)
+        self.connection_class = (http.client.HTTPSConnection
+                                 if parts.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get_connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = self.connection_class(
+                self.netloc, timeout=self.timeout)
+        return self.local.connection
+
+    def request(self, method, path, token=None, body=None, expect=(200,),
+                authorization=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            authorization = f'Token {token}'
+        if authorization:
+            headers['Authorization'] = authorization
+        data = json.dumps(body).encode() if body is not None else None
+        connection = self.get_connection()
+        try:
+            connection.request(method, self.prefix + path, body=data,
+                               headers=headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            return Response(False, b'', None)
+        match = SERVER_TIMING_QUERIES.search(
+            response.getheader('Server-Timing', ''))
+        return Response(response.status in expect, content,
+                        int(match.group(1)) if match else None)
+
+
+class SlowClients:
+    """Соединения медленных клиентов, не дописавших заголовки запроса.
+
+    Пока соединения открыты, синхронный воркер gunicorn ждёт конец
+    запроса и не принимает других, асинхронный обслуживает остальных.
+    """
+
+    def __init__(self, url, count):
+        self.parts = urlsplit(url)
+        self.count = count
+        self.sockets = []
+
+    def __enter__(self):
+        parts = self.parts
+        https = parts.scheme == 'https'
+        port = parts.port or (443 if https else 80)
+        context = ssl.create_default_context() if https else None
+        for _ in range(self.count):
+            sock = socket.create_connection((parts.hostname, port))
+            if context is not None:
+                sock = context.wrap_socket(sock,
+                                           server_hostname=parts.hostname)
+            self.sockets.append(sock)
+            sock.sendall(f'GET {parts.path.rstrip("/")}/api/tags/ HTTP/1.1'
+                         f'\r\nHost: {parts.netloc}\r\n'.encode())
+        return self
+
+    def __exit__(self, *exc_info):
+        for sock in self.sockets:
+            sock.close()
+        self.sockets.clear()
+
+
+class BenchData:
+    """Данные benchseed, по которым сценарии выбирают параметры."""
+
+    def __init__(self, users=50):
+        bench_users = list(User.objects.filter(
+            username__startswith=BENCH_PREFIX,
+        ).order_by('pk')[:users])
+        if not bench_users:
+            raise LookupError('Нет данных для замеров, выполните benchseed.')
+        self.tokens = [Token.objects.get_or_create(user=user)[0].key
+                       for user in bench_users]
+        self.credentials = [
+            base64.b64encode(f'{user.email}:{BENCH_PASSWORD}'.encode()
+                             ).decode()
+            for user in bench_users]
+        self.recipe_ids = list(RecipeModel.objects.filter(
+            author__username__startswith=BENCH_PREFIX,
+        ).order_by('pk').values_list('pk', flat=True))
+        self.tag_ids = list(TagModel.objects.values_list('pk', flat=True))
+        self.tag_slugs = list(TagModel.objects.values_list('slug', flat=True))
+        ingredients = list(IngredientModel.objects.order_by('pk').values_list(
+            'pk', 'name'))
+        self.ingredient_ids = [pk for pk, _ in ingredients]
+        self.prefixes = sorted({name[:3] for _, name in ingredients
+                                if len(name) >= 3})
+        self.words = sorted({word for _, name in ingredients
+                             for word in re.findall(r'\w{5,}', name.lower())})
+        self.created = []
+        self.deep_page = None
+        self.deep_cursor = None
+        self.own_recipes = {}
+        self.images = {}
+        self.cart_tokens = {}
+        self.import_files = {}
+
+    def image(self, side, noise=False):
+        """Изображение в data URI, строится один раз вне замера."""
+        key = (side, noise)
+        if key not in self.images:
+            rng = random.Random(side) if noise else None
+            self.images[key] = image_data_uri(side, rng)
+        return self.images[key]
+
+    def recipe_body(self, rng, image, name=None):
+        return {
+            'ingredients': [
+                {'id': pk, 'amount': rng.randint(1, 500)}
+                for pk in rng.sample(self.ingredient_ids,
+                                     min(5, len(self.ingredient_ids)))],
+            'tags': rng.sample(self.tag_ids, min(2, len(self.tag_ids))),
+            'image': image,
+            'name': name or f'{BENCH_RECIPE_PREFIX} {rng.randint(1, 10**6)}',
+            'text': 'Рецепт, созданный при замере производительности.',
+            'cooking_time': rng.randint(5, 120),
+        }
+
+
+@scenario('auth_token')
+def auth_token(transport, data, rng):
+    return [transport.request('GET', '/api/users/me/',
+                              rng.choice(data.tokens))]
+
+
+@scenario('auth_basic')
+def auth_basic(transport, data, rng):
+    # С ограничением BASIC_AUTH_RATE лишние попытки получают 429;
+    # для замера стоимости хеша пароля запустите сервер без него.
+    return [transport.request(
+        'GET', '/api/users/me/', expect=(200, 429),
+        authorization=f'Basic {rng.choice(data.credentials)}')]
+
+
+def list_recipes(transport, data, rng, limit):
+    pages = max(min(len(data.recipe_ids) // limit, 50), 1)
+    return [transport.request(
+        'GET', f'/api/recipes/?page={rng.randint(1, pages)}&limit={limit}')]
+
+
+@scenario('recipes_list')
+def recipes_list(transport, data, rng):
+    return list_recipes(transport, data, rng, 6)
+
+
+@scenario('recipes_list_50')
+def recipes_list_50(transport, data, rng):
+    return list_recipes(transport, data, rng, 50)
+
+
+@scenario('recipes_list_200')
+def recipes_list_200(transport, data, rng):
+    return list_recipes(transport, data, rng, 200)
+
+
+@scenario('recipes_list_auth')
+def recipes_list_auth(transport, data, rng):
+    return [transport.request(
+        'GET', f'/api/recipes/?page={rng.randint(1, 50)}&limit=6',
+        rng.choice(data.tokens))]
+
+
+@scenario('recipes_cursor')
+def recipes_cursor(transport, data, rng):
+    return [transport.request('GET', '/api/recipes/?cursor=&limit=6',
+                              rng.choice(data.tokens))]
+
+
+def find_deep_page(transport, data):
+    """Номер глубокой страницы: DEEP_PAGE или последняя, если их меньше."""
+    response = transport.request('GET', f'/api/recipes/?limit={DEEP_LIMIT}')
+    pages = math.ceil(json.loads(response.body)['count'] / DEEP_LIMIT)
+    data.deep_page = max(min(DEEP_PAGE, pages), 1)
+
+
+def find_deep_cursor(transport, data):
+    """Курсор той же глубокой страницы: проход по ссылкам next."""
+    find_deep_page(transport, data)
+    rest = (data.deep_page - 1) * DEEP_LIMIT
+    cursor = ''
+    while rest:
+        limit = min(rest, CURSOR_WALK_LIMIT)
+        response = transport.request(
+            'GET', f'/api/recipes/?cursor={quote(cursor)}&limit={limit}')
+        cursor = parse_qs(urlsplit(json.loads(response.body)['next']).query
+                          )['cursor'][0]
+        rest -= limit
+    data.deep_cursor = cursor
+
+
+@scenario('recipes_page_first')
+def recipes_page_first(transport, data, rng):
+    return [transport.request(
+        'GET', f'/api/recipes/?page=1&limit={DEEP_LIMIT}',
+        rng.choice(data.tokens))]
+
+
+@scenario('recipes_page_deep', setup=find_deep_page)
+def recipes_page_deep(transport, data, rng):
+    # OFFSET пропускает все предыдущие строки, плюс COUNT(*).
+    return [transport.request(
+        'GET', f'/api/recipes/?page={data.deep_page}&limit={DEEP_LIMIT}',
+        rng.choice(data.tokens))]
+
+
+@scenario('recipes_cursor_deep', setup=find_deep_cursor)
+def recipes_cursor_deep(transport, data, rng):
+    return [transport.request(
+        'GET', f'/api/recipes/?cursor={quote(data.deep_cursor)}'
+               f'&limit={DEEP_LIMIT}', rng.choice(data.tokens))]
+
+
+@scenario('recipes_tags_any')
+def recipes_tags_any(transport, data, rng):
+    tags = '&'.join(f'tags={slug}' for slug in rng.sample(data.tag_slugs, 2))
+    return [transport.request('GET', f'/api/recipes/?{tags}&limit=6')]
+
+
+@scenario('recipes_tags_all')
+def recipes_tags_all(transport, data, rng):
+    tags = '&'.join(f'tags={slug}' for slug in rng.sample(data.tag_slugs, 2))
+    return [transport.request(
+        'GET', f'/api/recipes/?{tags}&tags_match=all&limit=6')]
+
+
+def tag_filter_page(queryset):
+    """COUNT(*) и первая страница, как у пагинации списка рецептов."""
+    with CaptureQueriesContext(connection) as queries:
+        count = queryset.count()
+        page = list(queryset.values_list('pk', flat=True)[:DEEP_LIMIT])
+    return [Response(len(page) <= count, b'', len(queries))]
+
+
+def tag_filter_data(data, rng, match):
+    tags = QueryDict(mutable=True)
+    tags.setlist('tags', rng.sample(data.tag_slugs, 2))
+    tags['tags_match'] = match
+    return tags
+
+
+@scenario('tags_filter_distinct', client_only=True)
+def tags_filter_distinct(transport, data, rng):
+    """Прежний фильтр по тегам - JOIN и DISTINCT - для сравнения
+    с tags_filter_any и tags_filter_all."""
+    return tag_filter_page(RecipeModel.objects.filter(
+        tags__slug__in=rng.sample(data.tag_slugs, 2)).distinct())
+
+
+@scenario('tags_filter_any', client_only=True)
+def tags_filter_any(transport, data, rng):
+    return tag_filter_page(RecipeFilter(
+        tag_filter_data(data, rng, 'any'), queryset=RecipeModel.objects.all()).qs)
+
+
+@scenario('tags_filter_all', client_only=True)
+def tags_filter_all(transport, data, rng):
+    return tag_filter_page(RecipeFilter(
+        tag_filter_data(data, rng, 'all'), queryset=RecipeModel.objects.all()).qs)
+
+
+@scenario('recipes_search')
+def recipes_search(transport, data, rng):
+    search = quote(rng.choice(data.words))
+    return [transport.request('GET',
+                              f'/api/recipes/?search={search}&limit=6')]
+
+
+@scenario('recipes_favorited')
+def recipes_favorited(transport, data, rng):
+    return [transport.request('GET', '/api/recipes/?is_favorited=1&limit=6',
+                              rng.choice(data.tokens))]
+
+
+@scenario('recipe_detail')
+def recipe_detail(transport, data, rng):
+    return [transport.request(
+        'GET', f'/api/recipes/{rng.choice(data.recipe_ids)}/',
+        rng.choice(data.tokens))]
+
+
+@scenario('ingredients_typeahead')
+def ingredients_typeahead(transport, data, rng):
+    return [transport.request(
+        'GET', f'/api/ingredients/?name={quote(rng.choice(data.prefixes))}')]
+
+
+@scenario('subscriptions')
+def subscriptions(transport, data, rng):
+    return [transport.request(
+        'GET', '/api/users/subscriptions/?limit=6&recipes_limit=3',
+        rng.choice(data.tokens))]
+
+
+@scenario('feed')
+def feed(transport, data, rng):
+    return [transport.request('GET', '/api/recipes/feed/?limit=6',
+                              rng.choice(data.tokens))]
+
+
+def pull_feed(transport, data):
+    """Все авторы считаются популярными: рецепты не разложены по лентам
+    и выбираются при запросе."""
+    with override_settings(FEED_FANOUT_LIMIT=-1), \
+            redirect_stdout(io.StringIO()):
+        call_command('feedrebuild')
+
+
+def rebuild_feed(transport, data):
+    with redirect_stdout(io.StringIO()):
+        call_command('feedrebuild')
+
+
+@scenario('feed_pull', setup=pull_feed, teardown=rebuild_feed)
+def feed_pull(transport, data, rng):
+    return feed(transport, data, rng)
+
+
+@scenario('download_shopping_cart')
+def download_shopping_cart(transport, data, rng):
+    return [transport.request(
+        'GET', '/api/recipes/download_shopping_cart/?format=txt',
+        rng.choice(data.tokens))]
+
+
+@scenario('download_shopping_cart_pdf')
+def download_shopping_cart_pdf(transport, data, rng):
+    return [transport.request(
+        'GET', '/api/recipes/download_shopping_cart/?format=pdf',
+        rng.choice(data.tokens))]
+
+
+def cart_user(size):
+    return f'cart{size}-{BENCH_PREFIX}'
+
+
+def delete_cart_user(size):
+    # Автор защищён от удаления вместе с рецептами (PROTECT).
+    RecipeModel.objects.filter(author__username=cart_user(size)).delete()
+    User.objects.filter(username=cart_user(size)).delete()
+
+
+def fill_cart(size):
+    """Пользователь вне benchseed со списком покупок из size ингредиентов:
+    один рецепт с size ингредиентами в его списке покупок."""
+    def setup(transport, data):
+        delete_cart_user(size)
+        username = cart_user(size)
+        user = User.objects.create(
+            username=username, email=f'{username}@example.com',
+            first_name='Пользователь', last_name=username)
+        recipe = RecipeModel.objects.create(
+            author=user, name=f'{BENCH_RECIPE_PREFIX} список {size}',
+            text='Рецепт для замера списка покупок.', cooking_time=10,
+            image='images/bench.png')
+        RecipeIngredients.objects.bulk_create(
+            RecipeIngredients(recipe=recipe, ingredients_id=pk,
+                              amount=number + 1)
+            for number, pk in enumerate(data.ingredient_ids[:size]))
+        add_recipes(ShoppingCartRecipes, user, [recipe.pk])
+        data.cart_tokens[size] = Token.objects.create(user=user).key
+    return setup
+
+
+def empty_cart(size):
+    def teardown(transport, data):
+        delete_cart_user(size)
+        data.cart_tokens.pop(size, None)
+    return teardown
+
+
+def download_cart_pdf(size):
+    def run(transport, data, rng):
+        # Готовый PDF удаляется, чтобы каждый запрос формировал его заново.
+        ShoppingListExport.objects.filter(
+            user__username=cart_user(size)).delete()
+        return [transport.request(
+            'GET', '/api/recipes/download_shopping_cart/?format=pdf',
+            data.cart_tokens[size])]
+    return run
+
+
+for size in CART_SIZES:
+    scenario(f'download_shopping_cart_pdf_{size}', setup=fill_cart(size),
+             teardown=empty_cart(size))(download_cart_pdf(size))
+
+
+def import_rows():
+    """Детерминированные записи для ingredientsimport: каждая десятая
+    повторяет предыдущую и пропускается как дубликат."""
+    for number in range(IMPORT_SIZE):
+        if number % 10 == 9:
+            number -= 1
+        yield (f'{BENCH_PREFIX} ингредиент {number:06d}',
+               IMPORT_UNITS[number % len(IMPORT_UNITS)])
+
+
+def write_import_file(extension):
+    """Файл из IMPORT_SIZE записей во временном каталоге, вне замера."""
+    def setup(transport, data):
+        directory = tempfile.mkdtemp()
+        path = f'{directory}/ingredients.{extension}'
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            if extension == 'csv':
+                csv.writer(file).writerows(import_rows())
+            else:
+                json.dump([{'name': name, 'measurement_unit': unit}
+                           for name, unit in import_rows()],
+                          file, ensure_ascii=False)
+        data.import_files[extension] = path
+    return setup
+
+
+def delete_import_file(extension):
+    def teardown(transport, data):
+        path = data.import_files.pop(extension)
+        shutil.rmtree(path.rsplit('/', 1)[0], ignore_errors=True)
+    return teardown
+
+
+def import_ingredients(extension):
+    def run(transport, data, rng):
+        # Импорт откатывается, чтобы каждый повтор начинал с той же базы.
+        output = io.StringIO()
+        with CaptureQueriesContext(connection) as queries, \
+                redirect_stdout(output), transaction.atomic():
+            call_command('ingredientsimport', '-p',
+                         data.import_files[extension])
+            transaction.set_rollback(True)
+        expected = IMPORT_SIZE - IMPORT_SIZE // 10
+        return [Response(f'Было добавлено {expected} ' in output.getvalue(),
+                         b'', len(queries))]
+    return run
+
+
+for extension in ('json', 'csv'):
+    scenario(f'ingredients_import_{extension}', client_only=True,
+             setup=write_import_file(extension),
+             teardown=delete_import_file(extension),
+             )(import_ingredients(extension))
+
+
+@scenario('favorite_single')
+def favorite_single(transport, data, rng):
+    token = rng.choice(data.tokens)
+    ids = rng.sample(data.recipe_ids, BULK_SIZE)
+    return ([transport.request('POST', f'/api/recipes/{pk}/favorite/',
+                               token, expect=(201, 400)) for pk in ids]
+            + [transport.request('DELETE', f'/api/recipes/{pk}/favorite/',
+                                 token, expect=(204, 400)) for pk in ids])
+
+
+@scenario('favorite_bulk')
+def favorite_bulk(transport, data, rng):
+    token = rng.choice(data.tokens)
+    body = {'ids': rng.sample(data.recipe_ids, BULK_SIZE)}
+    return [transport.request('POST', '/api/recipes/favorite/', token, body),
+            transport.request('DELETE', '/api/recipes/favorite/', token,
+                              body)]
+
+
+def create_recipe(transport, data, token, body):
+    response = transport.request('POST', '/api/recipes/', token, body,
+                                 expect=(201,))
+    if response.ok:
+        data.created.append((token, json.loads(response.body)['id']))
+    return response
+
+
+@scenario('recipe_create')
+def recipe_create(transport, data, rng):
+    return [create_recipe(transport, data, rng.choice(data.tokens),
+                          data.recipe_body(rng, data.image(64)))]
+
+
+@scenario('recipe_create_large')
+def recipe_create_large(transport, data, rng):
+    return [create_recipe(
+        transport, data, rng.choice(data.tokens),
+        data.recipe_body(rng, data.image(LARGE_IMAGE_SIDE, noise=True)))]
+
+
+@scenario('image_decode', client_only=True)
+def image_decode(transport, data, rng):
+    """Только Base64ImageField на большом изображении, без запроса:
+    с --memory - пик памяти декодирования по частям."""
+    file = Base64ImageField().to_internal_value(
+        data.image(LARGE_IMAGE_SIDE, noise=True))
+    file.close()
+    return [Response(True, b'', None)]
+
+
+@scenario('image_decode_whole', client_only=True)
+def image_decode_whole(transport, data, rng):
+    """Прежнее декодирование для сравнения с image_decode: вся строка
+    base64 сразу и проверка ImageField, читающая файл в память."""
+    _, encoded = data.image(LARGE_IMAGE_SIDE, noise=True).split(';base64,')
+    ImageField().to_internal_value(
+        ContentFile(base64.b64decode(encoded), name='img.png'))
+    return [Response(True, b'', None)]
+
+
+def create_own_recipes(transport, data):
+    rng = random.Random(0)
+    for token in data.tokens:
+        body = data.recipe_body(rng, data.image(64))
+        response = create_recipe(transport, data, token, body)
+        if response.ok:
+            data.own_recipes[token] = (json.loads(response.body)['id'], body)
+
+
+@scenario('recipe_update', setup=create_own_recipes)
+def recipe_update(transport, data, rng):
+    # Правка только названия: состав и теги те же, что при создании.
+    token = rng.choice(list(data.own_recipes))
+    pk, body = data.own_recipes[token]
+    body = {**body, 'name': f'{BENCH_RECIPE_PREFIX} {rng.randint(1, 10**6)}'}
+    return [transport.request('PATCH', f'/api/recipes/{pk}/', token, body)]
+
+
+def cleanup(transport, data):
+    """Удаляет рецепты, созданные сценариями."""
+    for token, pk in data.created:
+        transport.request('DELETE', f'/api/recipes/{pk}/', token,
+                          expect=(204,))
+    data.created.clear()
+    data.own_recipes.clear()
+
+
+def dataset_info():
+    return {
+        'users': User.objects.count(),
+        'recipes': RecipeModel.objects.count(),
+        'ingredients': IngredientModel.objects.count(),
+        'tags': TagModel.objects.count(),
+        'database': connection.vendor,
+        'debug': settings.DEBUG,
+    }
+
+
+def explain(run, transport, data, rng):
+    """Планы SELECT-запросов одного выполнения сценария: {SQL: вывод
+    EXPLAIN} (в SQLite - EXPLAIN QUERY PLAN)."""
+    queries = []
+
+    def collect(execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(collect):
+        run(transport, data, rng)
+    prefix = connection.ops.explain_query_prefix()
+    plans = {}
+    for sql, params in queries:
+        if sql in plans:
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            plans[sql] = [str(row[-1]) for row in cursor.fetchall()]
+    return plans
+
+
+def run_timed(run, transport, data, rng):
+    started = time.perf_counter()
+    responses = run(transport, data, rng)
+    return time.perf_counter() - started, responses
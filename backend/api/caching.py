@@ -0,0 +1,98 @@
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from threading import Lock
+
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.response import Response
+
+from recipes.models import TableVersion
+
+
+class ResponseCache:
+    """LRU сериализованных ответов в памяти процесса.
+
+    Ключ включает версию таблицы, поэтому после изменения данных
+    в любом процессе старые записи просто перестают находиться.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.data:
+                return None
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+
+class VersionedCacheMixin:
+    """Кеширование list/retrieve для редко меняющихся справочников.
+
+    ETag и Last-Modified берутся из TableVersion модели вьюсета,
+    на совпадающие условные запросы отдаётся 304 без обращения
+    к таблице и сериализации.
+    """
+
+    response_cache = ResponseCache(size=256)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request,
+                                    *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        table = TableVersion.get(self.queryset.model)
+        response, key, headers = self.cached(request, table)
+        if response is not None:
+            return response
+        return self.store(key, headers, view(request, *args, **kwargs))
+
+    def cached(self, request, table):
+        """(ответ из кеша или 304 либо None, ключ кеша, заголовки)."""
+        etag = (f'"{table.table}-{table.version}-'
+                f'{request.accepted_renderer.format}"')
+        modified = int(table.updated.timestamp())
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        # В HTTP-дате нет долей секунды: пока не прошла секунда последнего
+        # изменения, в ней возможны новые, и If-Modified-Since отдал бы
+        # устаревший 304. До тех пор валидатор - только ETag.
+        if modified < int(time.time()):
+            headers['Last-Modified'] = http_date(modified)
+        key = (table.table, table.version, request.get_full_path(),
+               request.accepted_media_type)
+        if self.not_modified(request, etag, modified):
+            return (Response(status=HTTPStatus.NOT_MODIFIED, headers=headers),
+                    key, headers)
+        data = self.response_cache.get(key)
+        if data is not None:
+            return Response(data, headers=headers), key, headers
+        return None, key, headers
+
+    def store(self, key, headers, response):
+        if response.status_code == HTTPStatus.OK:
+            self.response_cache.set(key, response.data)
+            for header, value in headers.items():
+                response[header] = value
+        return response
+
+    @staticmethod
+    def not_modified(request, etag, modified):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in (tag.strip() for tag in if_none_match.split(','))
+        if_modified_since = parse_http_date_safe(
+            request.headers.get('If-Modified-Since', ''))
+        return if_modified_since is not None and modified <= if_modified_since
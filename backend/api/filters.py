@@ -1,25 +1,85 @@
-from django_filters import CharFilter, Filter, FilterSet, NumberFilter
+from django.conf import settings
+from django.db import connection
+from django.db.models import (Case, Exists, IntegerField, OuterRef, Q, Value,
+                              When)
+from django_filters import (CharFilter, ChoiceFilter, Filter, FilterSet,
+                            NumberFilter, OrderingFilter)
+from django_filters.constants import EMPTY_VALUES
 
 from recipes.models import IngredientModel, RecipeModel
+from recipes.search import search_recipes
 
 
 class IngredientFilter(FilterSet):
-    name = CharFilter(field_name='name', lookup_expr='istartswith')
+    name = CharFilter(method='name_filter')
 
     class Meta:
         model = IngredientModel
         fields = ('name',)
 
+    def name_filter(self, queryset, field_name, value):
+        """Сначала ингредиенты, начинающиеся с value, затем содержащие его.
+
+        Поиск по префиксу идёт по индексу name_lower; полный перебор
+        по вхождению нужен, только если совпадений по префиксу мало.
+        """
+        value = value.lower()
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+        queryset = queryset.order_by('name_lower')
+        prefixed = list(queryset.filter(self.prefix_lookup(value)).values_list(
+            'id', flat=True)[:limit])
+        if len(prefixed) == limit:
+            return queryset.filter(id__in=prefixed)
+        return queryset.filter(name_lower__contains=value).annotate(
+            not_prefixed=Case(When(id__in=prefixed, then=Value(0)),
+                              default=Value(1),
+                              output_field=IntegerField())
+        ).order_by('not_prefixed', 'name_lower')[:limit]
+
+    @staticmethod
+    def prefix_lookup(value):
+        if connection.vendor == 'sqlite':
+            # LIKE в SQLite не использует индекс, а сравнение строк - да.
+            return Q(name_lower__gte=value,
+                     name_lower__lt=value + chr(0x10FFFF))
+        # В PostgreSQL для LIKE 'value%' есть индекс varchar_pattern_ops.
+        return Q(name_lower__startswith=value)
+
+
+TAGS_ANY = 'any'
+TAGS_ALL = 'all'
+TAGS_MATCH_CHOICES = (
+    (TAGS_ANY, 'Любой из тегов'),
+    (TAGS_ALL, 'Все теги'),
+)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """Сортировка с датой публикации как дополнительным ключом."""
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        ordering = [self.get_ordering_value(param) for param in value]
+        return qs.order_by(*ordering, '-published', '-id')
+
 
 class RecipeFilter(FilterSet):
     tags = Filter(method='tag_filter')
+    tags_match = ChoiceFilter(choices=TAGS_MATCH_CHOICES,
+                              method='tags_match_filter')
     author = NumberFilter(field_name='author_id', lookup_expr='exact')
     is_favorited = Filter(method='get_favorite')
     is_in_shopping_cart = Filter(method='get_shopping_cart')
+    search = CharFilter(method='search_filter')
+    ordering = RecipeOrderingFilter(
+        fields=(('favorites_count', 'popularity'),
+                ('shopping_cart_count', 'shopping_cart')))
 
     class Meta:
         model = RecipeModel
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('tags', 'tags_match', 'author', 'is_favorited',
+                  'is_in_shopping_cart', 'search', 'ordering')
 
     def get_favorite(self, queryset, field, value):
         if value == '0':
@@ -32,8 +92,22 @@ class RecipeFilter(FilterSet):
         return queryset.filter(
             recipes_in_shopping_card__user=self.request.user)
 
+    def search_filter(self, queryset, field_name, value):
+        return search_recipes(queryset, value)
+
     def tag_filter(self, queryset, field_name, value):
+        # EXISTS вместо JOIN + DISTINCT: строки рецептов не размножаются,
+        # и COUNT для пагинации не сортирует весь результат.
         tags = self.data.getlist('tags')
-        if tags is None:
+        tagged = RecipeModel.tags.through.objects.filter(
+            recipemodel=OuterRef('pk'))
+        if self.form.cleaned_data.get('tags_match') == TAGS_ALL:
+            for slug in set(tags):
+                queryset = queryset.filter(
+                    Exists(tagged.filter(tagmodel__slug=slug)))
             return queryset
-        return queryset.filter(tags__slug__in=tags).distinct()
+        return queryset.filter(Exists(tagged.filter(tagmodel__slug__in=tags)))
+
+    def tags_match_filter(self, queryset, field_name, value):
+        # Учитывается в tag_filter.
+        return queryset
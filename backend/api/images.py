@@ -0,0 +1,34 @@
+"""Уменьшенные копии изображений рецептов в формате WebP.
+
+Копии строит воркер (runworker), в запросе сохраняется только оригинал.
+"""
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+WEBP_QUALITY = 80
+
+
+def make_image_variant(file, size):
+    """Вписывает изображение в квадрат size x size и кодирует в WebP."""
+    file.open('rb')
+    try:
+        with Image.open(file) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            if image.mode not in ('RGB', 'RGBA'):
+                alpha = ('A' in image.getbands()
+                         or 'transparency' in image.info)
+                image = image.convert('RGBA' if alpha else 'RGB')
+            buffer = BytesIO()
+            image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    finally:
+        file.close()
+    return ContentFile(buffer.getvalue())
+
+
+def variant_name(name, suffix):
+    """images/abc.jpg -> abc_<suffix>.webp"""
+    return f'{PurePosixPath(name).stem}_{suffix}.webp'
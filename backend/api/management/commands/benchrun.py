@@ -0,0 +1,222 @@
+import gc
+import json
+import logging
+import random
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.benchmarks import (SCENARIOS, BenchData, ClientTransport,
+                            HTTPTransport, SlowClients, cleanup, dataset_info,
+                            explain, max_rss, run_timed, summarize)
+
+COLUMNS = (
+    ('throughput', 'опер/с'),
+    ('p50_ms', 'p50 мс'),
+    ('p95_ms', 'p95 мс'),
+    ('p99_ms', 'p99 мс'),
+    ('queries', 'SQL'),
+    ('errors', 'ошибок'),
+    ('peak_memory_kb', 'память КБ'),
+    ('rss_growth_kb', 'рост RSS КБ'),
+)
+NAME_WIDTH = 28
+COLUMN_WIDTH = 16
+
+
+class Command(BaseCommand):
+    help = ('Замеряет сценарии API на данных benchseed: пропускная '
+            'способность, p50/p95/p99 и число SQL-запросов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--scenario', action='append',
+                            choices=sorted(SCENARIOS),
+                            help='Сценарий, можно указать несколько раз; '
+                                 'по умолчанию - все.')
+        parser.add_argument('--url',
+                            help='Адрес запущенного сервера, например '
+                                 'http://127.0.0.1:8000; без него запросы '
+                                 'идут через тестовый клиент Django.')
+        parser.add_argument('-n', '--requests', type=int, default=200,
+                            help='Повторов каждого сценария.')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('-c', '--concurrency', type=int, default=1,
+                            help='Параллельных потоков (только с --url).')
+        parser.add_argument('--slow-clients', type=int, default=0,
+                            help='Держать открытыми столько соединений '
+                                 'с недописанным запросом (только с --url).')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--users', type=int, default=50,
+                            help='Сколько пользователей benchseed '
+                                 'делают запросы.')
+        parser.add_argument('--memory', action='store_true',
+                            help='Пиковая память одной операции сценария '
+                                 '(tracemalloc, без --url; замедляет '
+                                 'запросы).')
+        parser.add_argument('--explain', action='store_true',
+                            help='Вывести планы SELECT-запросов одного '
+                                 'повтора сценария (без --url).')
+        parser.add_argument('-o', '--output',
+                            help='Сохранить результаты в JSON.')
+        parser.add_argument('--compare',
+                            help='JSON прошлого запуска для сравнения.')
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options['url']:
+            transport = HTTPTransport(options['url'])
+        else:
+            transport = ClientTransport()
+            # Ожидаемые ответы 400/404 сценариев не засоряют вывод.
+            logging.getLogger('django.request').setLevel(logging.ERROR)
+        if options['concurrency'] > 1 and not transport.concurrent:
+            raise CommandError('--concurrency работает только с --url.')
+        if options['slow_clients'] and not transport.concurrent:
+            raise CommandError('--slow-clients работает только с --url.')
+        if options['memory'] and transport.concurrent:
+            raise CommandError('--memory работает только без --url.')
+        if options['explain'] and transport.concurrent:
+            raise CommandError('--explain работает только без --url.')
+        baseline = None
+        if options['compare']:
+            baseline = json.loads(Path(options['compare']).read_text())
+        try:
+            data = BenchData(options['users'])
+        except LookupError as error:
+            raise CommandError(error)
+        names = options['scenario'] or [
+            name for name, scenario in SCENARIOS.items()
+            if not (scenario.client_only and transport.concurrent)]
+        results = {}
+        print('сценарий'.ljust(NAME_WIDTH) + ''.join(
+            title.rjust(COLUMN_WIDTH) for _, title in COLUMNS))
+        slow_clients = (SlowClients(options['url'], options['slow_clients'])
+                        if options['slow_clients'] else nullcontext())
+        try:
+            with slow_clients:
+                for name in names:
+                    scenario = SCENARIOS[name]
+                    if scenario.client_only and transport.concurrent:
+                        print(f'{name}: только без --url, пропущен.')
+                        continue
+                    results[name] = self.measure(scenario, transport, data,
+                                                 options)
+                    self.print_row(
+                        name, results[name],
+                        baseline and baseline['scenarios'].get(name))
+                    if options['explain']:
+                        self.print_plans(results[name]['plans'])
+        finally:
+            cleanup(transport, data)
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'transport': transport.name,
+                'url': options['url'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'slow_clients': options['slow_clients'],
+                'seed': options['seed'],
+                'django': django.get_version(),
+                'dataset': dataset_info(),
+            },
+            'scenarios': results,
+        }
+        if options['output']:
+            Path(options['output']).write_text(
+                json.dumps(report, ensure_ascii=False, indent=2))
+            print(f'Результаты сохранены в {options["output"]}.')
+
+    @staticmethod
+    def measure(scenario, transport, data, options):
+        seed = options['seed']
+        peaks = []
+
+        def sample(number):
+            rng = random.Random(f'{seed}:{scenario.name}:{number}')
+            if not options['memory']:
+                return run_timed(scenario.run, transport, data, rng)
+            # Пик сверх памяти, занятой до операции: мусор прошлых
+            # операций собирается заранее и в пик не попадает.
+            gc.collect()
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            try:
+                return run_timed(scenario.run, transport, data, rng)
+            finally:
+                peaks.append(tracemalloc.get_traced_memory()[1] - current)
+
+        if scenario.setup is not None:
+            scenario.setup(transport, data)
+        try:
+            for number in range(-options['warmup'], 0):
+                sample(number)
+            peaks.clear()
+            # Пиковый RSS только растёт: прирост за сценарий виден, если
+            # сценарий поднял пик процесса выше прежних. Для сравнения
+            # сценариев между собой запускайте их по одному (-s).
+            rss_before = max_rss()
+            if options['memory']:
+                tracemalloc.start()
+            started = time.perf_counter()
+            if options['concurrency'] > 1:
+                with ThreadPoolExecutor(options['concurrency']) as executor:
+                    samples = list(executor.map(
+                        sample, range(options['requests'])))
+            else:
+                samples = [sample(number)
+                           for number in range(options['requests'])]
+            elapsed = time.perf_counter() - started
+            rss = max_rss()
+            plans = (explain(scenario.run, transport, data,
+                             random.Random(f'{seed}:{scenario.name}'))
+                     if options['explain'] else None)
+        finally:
+            if options['memory']:
+                tracemalloc.stop()
+            if scenario.teardown is not None:
+                scenario.teardown(transport, data)
+        responses = [response for _, batch in samples for response in batch]
+        result = summarize(
+            durations=[duration for duration, _ in samples],
+            queries=[sum(response.queries for response in batch)
+                     if all(response.queries is not None
+                            for response in batch) else None
+                     for _, batch in samples],
+            requests=len(responses),
+            errors=sum(not response.ok for response in responses),
+            elapsed=elapsed,
+            peak=max(peaks) if peaks else None,
+            # С --url запросы обрабатывает другой процесс.
+            rss=(None if transport.concurrent
+                 else (rss, rss - rss_before)),
+        )
+        if plans is not None:
+            result['plans'] = plans
+        return result
+
+    @staticmethod
+    def print_plans(plans):
+        for sql, plan in plans.items():
+            print(f'  {sql}')
+            for line in plan:
+                print(f'    {line}')
+
+    @staticmethod
+    def print_row(name, result, previous=None):
+        """Строка таблицы; с --compare - изменение к прошлому запуску."""
+        cells = []
+        for key, _ in COLUMNS:
+            value = result.get(key)
+            cell = '-' if value is None else str(value)
+            old = previous.get(key) if previous else None
+            if value is not None and old:
+                cell += f' {(value - old) / old:+.0%}'
+            cells.append(cell.rjust(COLUMN_WIDTH))
+        print(name.ljust(NAME_WIDTH) + ''.join(cells))
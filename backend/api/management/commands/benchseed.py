@@ -0,0 +1,179 @@
+import random
+import time
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.benchmarks import (BENCH_PASSWORD, BENCH_PREFIX, BENCH_TAGS, DISHES,
+                            image_bytes)
+from recipes.models import (FavoriteRecipe, IngredientModel, RecipeIngredients,
+                            RecipeModel, ShoppingCartRecipes, TagModel)
+from users.models import Follow, User
+
+IMAGE_NAME = 'images/bench.png'
+
+
+def skewed_sample(rng, population, cum_weights, size):
+    """size разных элементов, популярные выбираются чаще."""
+    size = min(size, len(population))
+    chosen = set()
+    while len(chosen) < size:
+        chosen.update(rng.choices(population, cum_weights=cum_weights,
+                                  k=size - len(chosen)))
+    return chosen
+
+
+class Command(BaseCommand):
+    help = ('Создаёт детерминированный набор данных для замеров benchrun: '
+            'пользователей bench*, подписки, рецепты, избранное и списки '
+            'покупок; ингредиенты - из data/ingredients.csv.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--authors', type=int, default=200,
+                            help='Сколько из пользователей публикуют '
+                                 'рецепты.')
+        parser.add_argument('--recipes', type=int, default=100_000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Подписок на пользователя.')
+        parser.add_argument('--favorites', type=int, default=30,
+                            help='Рецептов в избранном на пользователя.')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Рецептов в списке покупок '
+                                 'на пользователя.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('-p', '--ingredients-path',
+                            default=str(settings.BASE_DIR.parent / 'data'
+                                        / 'ingredients.csv'))
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--flush', action='store_true',
+                            help='Удалить прежние данные замеров.')
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        bench_users = User.objects.filter(username__startswith=BENCH_PREFIX)
+        if options['flush']:
+            self.flush(bench_users)
+        elif bench_users.exists():
+            raise CommandError('Данные замеров уже есть, для пересоздания '
+                               'укажите --flush.')
+        if options['authors'] > options['users']:
+            raise CommandError('--authors больше --users.')
+        started = time.monotonic()
+        if not IngredientModel.objects.exists():
+            call_command('ingredientsimport',
+                         path=options['ingredients_path'])
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            tags = [TagModel.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color})[0].pk
+                for name, color, slug in BENCH_TAGS]
+            users = self.create_users(options)
+            authors = users[:options['authors']]
+            # Популярность автора убывает с номером (закон Ципфа).
+            weights = list(accumulate(
+                1 / rank for rank in range(1, len(authors) + 1)))
+            recipes = self.create_recipes(rng, authors, weights, tags,
+                                          options)
+            self.create_relations(rng, users, authors, weights, recipes,
+                                  options)
+        for command in ('reconcilecounters', 'shoppingcartrebuild',
+                        'feedrebuild', 'searchrebuild'):
+            call_command(command)
+        print(f'Данные для замеров созданы за '
+              f'{time.monotonic() - started:.0f} с.')
+
+    @staticmethod
+    def flush(bench_users):
+        recipes = RecipeModel.objects.filter(author__in=bench_users)
+        deleted, _ = recipes.delete()
+        bench_users.delete()
+        print(f'Удалены прежние данные замеров ({deleted} объектов).')
+
+    @staticmethod
+    def create_users(options):
+        password = make_password(BENCH_PASSWORD)
+        User.objects.bulk_create(
+            (User(username=f'{BENCH_PREFIX}{number}',
+                  email=f'{BENCH_PREFIX}{number}@example.com',
+                  first_name='Пользователь', last_name=str(number),
+                  password=password)
+             for number in range(options['users'])),
+            batch_size=options['batch_size'])
+        print(f'Пользователей: {options["users"]}.')
+        return list(User.objects.filter(
+            username__startswith=BENCH_PREFIX).order_by('pk').values_list(
+                'pk', flat=True))
+
+    @staticmethod
+    def create_recipes(rng, authors, weights, tags, options):
+        ingredients = list(IngredientModel.objects.order_by('pk').values_list(
+            'pk', 'name'))
+        if not ingredients:
+            raise CommandError('Нет ингредиентов, проверьте '
+                               '--ingredients-path.')
+        # Все рецепты ссылаются на одно изображение с готовыми копиями,
+        # чтобы воркер не обрабатывал их.
+        image = default_storage.save(IMAGE_NAME, ContentFile(image_bytes(64)))
+        recipe_ids = []
+        batch_size = options['batch_size']
+        for start in range(0, options['recipes'], batch_size):
+            count = min(batch_size, options['recipes'] - start)
+            recipes = []
+            contents = []
+            for _ in range(count):
+                chosen = rng.sample(ingredients, rng.randint(3, 10))
+                main = chosen[0][1]
+                recipes.append(RecipeModel(
+                    author_id=rng.choices(authors, cum_weights=weights)[0],
+                    name=f'{rng.choice(DISHES)}: {main}'[:200],
+                    text='Понадобится: ' + ', '.join(
+                        name for _, name in chosen) + '.',
+                    image=image, image_list=image, image_detail=image,
+                    image_status=RecipeModel.IMAGE_DONE,
+                    cooking_time=rng.randint(5, 240)))
+                contents.append((chosen, rng.sample(tags, rng.randint(1, 3))))
+            RecipeModel.objects.bulk_create(recipes)
+            RecipeIngredients.objects.bulk_create(
+                RecipeIngredients(recipe_id=recipe.pk, ingredients_id=pk,
+                                  amount=rng.randint(1, 500))
+                for recipe, (chosen, _) in zip(recipes, contents)
+                for pk, _ in chosen)
+            RecipeModel.tags.through.objects.bulk_create(
+                RecipeModel.tags.through(recipemodel_id=recipe.pk,
+                                         tagmodel_id=tag)
+                for recipe, (_, recipe_tags) in zip(recipes, contents)
+                for tag in recipe_tags)
+            recipe_ids.extend(recipe.pk for recipe in recipes)
+            print(f'Рецептов: {len(recipe_ids)}.')
+        return recipe_ids
+
+    @staticmethod
+    def create_relations(rng, users, authors, weights, recipes, options):
+        batch_size = options['batch_size']
+        follows, favorites, carts = [], [], []
+        for user in users:
+            follows.extend(
+                Follow(follower_id=user, author_id=author)
+                for author in skewed_sample(
+                    rng, authors, weights, options['follows'])
+                if author != user)
+            favorites.extend(
+                FavoriteRecipe(user_id=user, recipe_id=recipe)
+                for recipe in rng.sample(recipes,
+                                         min(options['favorites'],
+                                             len(recipes))))
+            carts.extend(
+                ShoppingCartRecipes(user_id=user, recipe_id=recipe)
+                for recipe in rng.sample(recipes,
+                                         min(options['cart'], len(recipes))))
+        for model, objects in ((Follow, follows), (FavoriteRecipe, favorites),
+                               (ShoppingCartRecipes, carts)):
+            model.objects.bulk_create(objects, batch_size=batch_size)
+            print(f'{model.__name__}: {len(objects)}.')
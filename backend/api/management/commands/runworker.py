@@ -0,0 +1,152 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from api.images import make_image_variant, variant_name
+from api.utils import render_shopping_list
+from recipes.models import RecipeModel, ShoppingListExport
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Формирует PDF списков покупок и копии изображений рецептов '
+            'из очереди в базе данных.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать очередь и завершиться.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза между опросами пустой очереди, с.')
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                if self.run_job():
+                    continue
+            except Exception:
+                # Ошибка одной задачи (или потеря соединения с базой)
+                # не останавливает очередь.
+                logger.exception('Ошибка воркера.')
+                close_old_connections()
+                if not options['once']:
+                    time.sleep(options['interval'])
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
+
+    def run_job(self):
+        """Обрабатывает одну задачу; False - очередь пуста."""
+        self.requeue_stale()
+        export = self.claim_export()
+        if export is not None:
+            self.process_export(export)
+            return True
+        recipe = self.claim_recipe_image()
+        if recipe is not None:
+            self.process_recipe_image(recipe)
+            return True
+        return False
+
+    @staticmethod
+    def requeue_stale():
+        """Возвращает в очередь задачи, брошенные упавшим воркером."""
+        deadline = timezone.now() - timedelta(
+            seconds=settings.WORKER_JOB_TIMEOUT)
+        exports = ShoppingListExport.objects.filter(
+            status=ShoppingListExport.PROCESSING,
+            started__lt=deadline).update(status=ShoppingListExport.PENDING)
+        images = RecipeModel.objects.filter(
+            image_status=RecipeModel.IMAGE_PROCESSING,
+            image_started__lt=deadline).update(
+                image_status=RecipeModel.IMAGE_PENDING)
+        if exports or images:
+            logger.warning('Возвращено в очередь: списков покупок %s, '
+                           'изображений %s.', exports, images)
+
+    @staticmethod
+    def claim_export():
+        """Берёт задачу из очереди; skip_locked - для нескольких воркеров."""
+        with transaction.atomic():
+            export = ShoppingListExport.objects.select_for_update(
+                skip_locked=True).filter(
+                    status=ShoppingListExport.PENDING).first()
+            if export is None:
+                return None
+            export.status = ShoppingListExport.PROCESSING
+            export.started = timezone.now()
+            export.save(update_fields=['status', 'started'])
+        return export
+
+    def process_export(self, export):
+        # Строку могли удалить (корзина изменилась) или отдать другому
+        # воркеру по таймауту - тогда результат этой задачи не нужен.
+        claimed = ShoppingListExport.objects.filter(
+            pk=export.pk, status=ShoppingListExport.PROCESSING,
+            started=export.started)
+        try:
+            export.file.save('shopping_list.pdf',
+                             render_shopping_list(export.ingredients),
+                             save=False)
+            updated = claimed.update(file=export.file.name,
+                                     status=ShoppingListExport.DONE,
+                                     finished=timezone.now())
+        except Exception:
+            logger.exception('Ошибка при формировании списка покупок %s.',
+                             export.id)
+            export.file.delete(save=False)
+            claimed.update(status=ShoppingListExport.FAILED)
+            return
+        if not updated:
+            logger.info('Список покупок %s отменён.', export.id)
+            export.file.delete(save=False)
+
+    @staticmethod
+    def claim_recipe_image():
+        with transaction.atomic():
+            recipe = RecipeModel.objects.select_for_update(
+                skip_locked=True).filter(
+                    image_status=RecipeModel.IMAGE_PENDING).only(
+                        'id', 'image', *RecipeModel.IMAGE_VARIANTS).first()
+            if recipe is None:
+                return None
+            recipe.image_started = timezone.now()
+            RecipeModel.objects.filter(pk=recipe.pk).update(
+                image_status=RecipeModel.IMAGE_PROCESSING,
+                image_started=recipe.image_started)
+        return recipe
+
+    def process_recipe_image(self, recipe):
+        sizes = settings.RECIPE_IMAGE_SIZES
+        # Если рецепт удалили, изображение заменили или задачу отдали
+        # другому воркеру, пока строились копии, они устарели.
+        claimed = RecipeModel.objects.filter(
+            pk=recipe.pk, image=recipe.image.name,
+            image_status=RecipeModel.IMAGE_PROCESSING,
+            image_started=recipe.image_started)
+        names = {}
+        try:
+            for field in RecipeModel.IMAGE_VARIANTS:
+                content = make_image_variant(recipe.image, sizes[field])
+                file = getattr(recipe, field)
+                suffix = field.rsplit('_', 1)[-1]
+                file.save(variant_name(recipe.image.name, suffix), content,
+                          save=False)
+                names[field] = file.name
+            updated = claimed.update(image_status=RecipeModel.IMAGE_DONE,
+                                     **names)
+        except Exception:
+            logger.exception('Ошибка при обработке изображения рецепта %s.',
+                             recipe.id)
+            updated = 0
+            claimed.update(image_status=RecipeModel.IMAGE_FAILED)
+        if not updated:
+            for field in names:
+                getattr(recipe, field).delete(save=False)
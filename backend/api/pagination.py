@@ -1,5 +1,42 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Пагинация по ключу (-published, -id) без OFFSET и COUNT(*)."""
+
+    ordering = ('-published', '-id')
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 200
+
+
+class RecipePagination(PageLimitPagination):
+    """page/limit по умолчанию, курсор - если в запросе есть ?cursor=.
+
+    Первая страница в курсорном режиме запрашивается с пустым ?cursor=,
+    следующие - по ссылкам next/previous из ответа.
+    """
+
+    cursor_pagination_class = RecipeCursorPagination
+    cursor_pagination = None
+
+    def uses_cursor(self, request):
+        return self.cursor_pagination_class.cursor_query_param in (
+            request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        if self.uses_cursor(request):
+            self.cursor_pagination = self.cursor_pagination_class()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
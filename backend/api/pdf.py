@@ -0,0 +1,351 @@
+"""Минимальный генератор PDF без внешних процессов.
+
+Документ собирается построчно и отдаётся частями: страницы пишутся по мере
+заполнения, шрифт, дерево страниц и таблица xref - в конце файла.
+Кириллица выводится встроенным TrueType-шрифтом (Type0, Identity-H).
+"""
+import struct
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+
+
+class TrueTypeFont:
+    """TTF-шрифт: метрики, таблица cmap (формат 4) и выделение подмножества."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.name = ''.join(
+            char for char in self.path.stem if char.isalnum()) or 'Font'
+        self.data = data = self.path.read_bytes()
+        self.tables = tables = {}
+        num_tables = struct.unpack('>H', data[4:6])[0]
+        for index in range(num_tables):
+            start = 12 + 16 * index
+            tag, _, offset, length = struct.unpack('>4sIII',
+                                                   data[start:start + 16])
+            tables[tag.decode('latin-1')] = (offset, length)
+        head = tables['head'][0]
+        self.units_per_em = struct.unpack('>H', data[head + 18:head + 20])[0]
+        self.bbox = [self.scale(value) for value in
+                     struct.unpack('>4h', data[head + 36:head + 44])]
+        long_offsets = struct.unpack('>h', data[head + 50:head + 52])[0]
+        hhea = tables['hhea'][0]
+        ascent, descent = struct.unpack('>hh', data[hhea + 4:hhea + 8])
+        self.ascent, self.descent = self.scale(ascent), self.scale(descent)
+        num_metrics = struct.unpack('>H', data[hhea + 34:hhea + 36])[0]
+        hmtx = tables['hmtx'][0]
+        self.advances = struct.unpack(
+            f'>{num_metrics * 2}H',
+            data[hmtx:hmtx + 4 * num_metrics])[::2]
+        maxp = tables['maxp'][0]
+        num_glyphs = struct.unpack('>H', data[maxp + 4:maxp + 6])[0]
+        loca = tables['loca'][0]
+        if long_offsets:
+            self.loca = struct.unpack(f'>{num_glyphs + 1}I',
+                                      data[loca:loca + 4 * num_glyphs + 4])
+        else:
+            self.loca = [offset * 2 for offset in struct.unpack(
+                f'>{num_glyphs + 1}H', data[loca:loca + 2 * num_glyphs + 2])]
+        self.cmap = self._read_cmap(data, tables['cmap'][0])
+
+    def scale(self, value):
+        return round(value * 1000 / self.units_per_em)
+
+    def glyph(self, char):
+        return self.cmap.get(ord(char), 0)
+
+    def width(self, glyph):
+        return self.scale(self.advances[min(glyph, len(self.advances) - 1)])
+
+    def text_width(self, text, size):
+        return sum(self.width(self.glyph(char)) for char in text) * size / 1000
+
+    def subset(self, glyphs):
+        """Шрифт только с нужными контурами; номера глифов сохраняются."""
+        glyf = self.tables['glyf'][0]
+        keep = set(glyphs) | {0}
+        pending = list(keep)
+        while pending:
+            for component in self._components(glyf, pending.pop()):
+                if component not in keep:
+                    keep.add(component)
+                    pending.append(component)
+        outlines, loca = [], [0]
+        for glyph in range(len(self.loca) - 1):
+            if glyph in keep:
+                start, end = self.loca[glyph], self.loca[glyph + 1]
+                data = self.data[glyf + start:glyf + end]
+                outlines.append(data + b'\0' * (-len(data) % 4))
+            loca.append(loca[-1] + len(outlines[-1]) if glyph in keep
+                        else loca[-1])
+        head_offset, head_length = self.tables['head']
+        head = bytearray(self.data[head_offset:head_offset + head_length])
+        head[8:12] = b'\0\0\0\0'
+        head[50:52] = struct.pack('>h', 1)
+        tables = {
+            'head': bytes(head),
+            'loca': struct.pack(f'>{len(loca)}I', *loca),
+            'glyf': b''.join(outlines),
+        }
+        for tag in ('hhea', 'hmtx', 'maxp', 'cvt ', 'fpgm', 'prep'):
+            if tag in self.tables:
+                offset, length = self.tables[tag]
+                tables[tag] = self.data[offset:offset + length]
+        return self._build(tables)
+
+    def _components(self, glyf, glyph):
+        start, end = self.loca[glyph], self.loca[glyph + 1]
+        data = self.data[glyf + start:glyf + end]
+        if len(data) < 10 or struct.unpack('>h', data[:2])[0] >= 0:
+            return
+        position = 10
+        while True:
+            flags, component = struct.unpack(
+                '>HH', data[position:position + 4])
+            yield component
+            position += 8 if flags & 0x0001 else 6
+            if flags & 0x0008:
+                position += 2
+            elif flags & 0x0040:
+                position += 4
+            elif flags & 0x0080:
+                position += 8
+            if not flags & 0x0020:
+                return
+
+    @staticmethod
+    def _build(tables):
+        count = len(tables)
+        power = 1 << (count.bit_length() - 1)
+        header = struct.pack('>IHHHH', 0x00010000, count, power * 16,
+                             power.bit_length() - 1, (count - power) * 16)
+        offset = 12 + 16 * count
+        directory, body = [], []
+        for tag in sorted(tables):
+            data = tables[tag] + b'\0' * (-len(tables[tag]) % 4)
+            checksum = sum(struct.unpack(f'>{len(data) // 4}I', data))
+            directory.append(struct.pack('>4sIII', tag.encode('latin-1'),
+                                         checksum & 0xFFFFFFFF, offset,
+                                         len(tables[tag])))
+            body.append(data)
+            offset += len(data)
+        return header + b''.join(directory) + b''.join(body)
+
+    @staticmethod
+    def _read_cmap(data, cmap):
+        num_subtables = struct.unpack('>H', data[cmap + 2:cmap + 4])[0]
+        for index in range(num_subtables):
+            start = cmap + 4 + 8 * index
+            platform, encoding, offset = struct.unpack(
+                '>HHI', data[start:start + 8])
+            sub = cmap + offset
+            if (platform, encoding) not in ((3, 1), (0, 3)):
+                continue
+            if struct.unpack('>H', data[sub:sub + 2])[0] != 4:
+                continue
+            seg_x2 = struct.unpack('>H', data[sub + 6:sub + 8])[0]
+            segments = seg_x2 // 2
+            ends_at = sub + 14
+            starts_at = ends_at + seg_x2 + 2
+            deltas_at = starts_at + seg_x2
+            offsets_at = deltas_at + seg_x2
+            ends = struct.unpack(f'>{segments}H',
+                                 data[ends_at:ends_at + seg_x2])
+            starts = struct.unpack(f'>{segments}H',
+                                   data[starts_at:starts_at + seg_x2])
+            deltas = struct.unpack(f'>{segments}h',
+                                   data[deltas_at:deltas_at + seg_x2])
+            offsets = struct.unpack(f'>{segments}H',
+                                    data[offsets_at:offsets_at + seg_x2])
+            result = {}
+            for index, (first, last) in enumerate(zip(starts, ends)):
+                for code in range(first, min(last, 0xFFFE) + 1):
+                    if offsets[index] == 0:
+                        glyph = (code + deltas[index]) & 0xFFFF
+                    else:
+                        position = (offsets_at + 2 * index + offsets[index]
+                                    + 2 * (code - first))
+                        glyph = struct.unpack(
+                            '>H', data[position:position + 2])[0]
+                        if glyph:
+                            glyph = (glyph + deltas[index]) & 0xFFFF
+                    if glyph:
+                        result[code] = glyph
+            return result
+        raise ValueError('В шрифте нет таблицы cmap формата 4')
+
+
+@lru_cache(maxsize=4)
+def load_font(path):
+    return TrueTypeFont(path)
+
+
+class PDFDocument:
+    """Потоковая запись PDF: `stream()` отдаёт байты по одной странице."""
+
+    line_height = 18
+    font_size = 12
+
+    # Номера объектов, которые пишутся в конце документа.
+    CATALOG, PAGES, FONT, CID_FONT, DESCRIPTOR, FONT_FILE, TO_UNICODE = (
+        range(1, 8))
+
+    def __init__(self, font):
+        self.font = font
+        self.used = {}
+        self.offsets = {}
+        self.position = 0
+        self.pages = []
+
+    def stream(self, lines):
+        """Строки - пары (текст, размер шрифта) или кортежи колонок."""
+        yield self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        page = []
+        y = PAGE_HEIGHT - MARGIN
+        for line in lines:
+            height = max(self.line_height, line[0][1] * 1.5)
+            if y - height < MARGIN and page:
+                yield self._page(page)
+                page, y = [], PAGE_HEIGHT - MARGIN
+            y -= height
+            for x, (text, size) in zip(self._columns(line), line):
+                page.append((x, y, size, text))
+        yield self._page(page)
+        yield self._fonts()
+        kids = ' '.join(f'{number} 0 R' for number in self.pages)
+        yield self._object(
+            self.PAGES,
+            f'<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>')
+        yield self._object(self.CATALOG,
+                           f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>')
+        yield self._xref()
+
+    @staticmethod
+    def _columns(line):
+        if len(line) == 1:
+            return (MARGIN,)
+        return (MARGIN, PAGE_WIDTH * 0.6)
+
+    def fit(self, text, size, width):
+        """Обрезает текст, не помещающийся в колонку."""
+        font = self.font
+        if font.text_width(text, size) <= width:
+            return text
+        limit = width * 1000 / size - font.width(font.glyph('…'))
+        total = 0
+        for index, char in enumerate(text):
+            total += font.width(font.glyph(char))
+            if total > limit:
+                return text[:index] + '…'
+        return text
+
+    def _encode(self, text):
+        glyphs = []
+        for char in text:
+            glyph = self.font.glyph(char)
+            self.used.setdefault(glyph, char)
+            glyphs.append(f'{glyph:04X}')
+        return ''.join(glyphs)
+
+    def _page(self, page):
+        commands = ['BT']
+        for x, y, size, text in page:
+            commands.append(f'/F1 {size} Tf 1 0 0 1 {x:.2f} {y:.2f} Tm '
+                            f'<{self._encode(text)}> Tj')
+        commands.append('ET')
+        number = 8 + 2 * len(self.pages)
+        self.pages.append(number)
+        content = zlib.compress('\n'.join(commands).encode())
+        return self._object(
+            number,
+            f'<< /Type /Page /Parent {self.PAGES} 0 R '
+            f'/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 {self.FONT} 0 R >> >> '
+            f'/Contents {number + 1} 0 R >>'
+        ) + self._stream_object(number + 1, content)
+
+    def _fonts(self):
+        font = self.font
+        widths = ' '.join(f'{glyph} [{font.width(glyph)}]'
+                          for glyph in sorted(self.used))
+        bbox = ' '.join(str(value) for value in font.bbox)
+        font_file = font.subset(self.used)
+        chunks = [
+            self._object(
+                self.FONT,
+                f'<< /Type /Font /Subtype /Type0 /BaseFont /{font.name} '
+                f'/Encoding /Identity-H '
+                f'/DescendantFonts [{self.CID_FONT} 0 R] '
+                f'/ToUnicode {self.TO_UNICODE} 0 R >>'),
+            self._object(
+                self.CID_FONT,
+                f'<< /Type /Font /Subtype /CIDFontType2 '
+                f'/BaseFont /{font.name} '
+                f'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) '
+                f'/Supplement 0 >> '
+                f'/FontDescriptor {self.DESCRIPTOR} 0 R '
+                f'/W [{widths}] /CIDToGIDMap /Identity >>'),
+            self._object(
+                self.DESCRIPTOR,
+                f'<< /Type /FontDescriptor /FontName /{font.name} '
+                f'/Flags 32 /FontBBox [{bbox}] /ItalicAngle 0 '
+                f'/Ascent {font.ascent} /Descent {font.descent} '
+                f'/CapHeight {font.ascent} /StemV 80 '
+                f'/FontFile2 {self.FONT_FILE} 0 R >>'),
+            self._stream_object(self.FONT_FILE, zlib.compress(font_file),
+                                f'/Length1 {len(font_file)} '),
+            self._stream_object(self.TO_UNICODE,
+                                zlib.compress(self._to_unicode())),
+        ]
+        return b''.join(chunks)
+
+    def _to_unicode(self):
+        mapping = [f'<{glyph:04X}> <{ord(char):04X}>'
+                   for glyph, char in sorted(self.used.items())
+                   if ord(char) <= 0xFFFF]
+        blocks = []
+        for start in range(0, len(mapping), 100):
+            block = mapping[start:start + 100]
+            blocks.append(f'{len(block)} beginbfchar\n'
+                          + '\n'.join(block) + '\nendbfchar')
+        return (
+            '/CIDInit /ProcSet findresource begin\n12 dict begin\n'
+            'begincmap\n/CIDSystemInfo << /Registry (Adobe) '
+            '/Ordering (UCS) /Supplement 0 >> def\n'
+            '/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+            '1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n'
+            + '\n'.join(blocks)
+            + '\nendcmap\nCMapName currentdict /CMap defineresource pop\n'
+            'end\nend'
+        ).encode()
+
+    def _object(self, number, body):
+        self.offsets[number] = self.position
+        return self._write(f'{number} 0 obj\n{body}\nendobj\n'.encode())
+
+    def _stream_object(self, number, data, extra=''):
+        self.offsets[number] = self.position
+        return self._write(
+            f'{number} 0 obj\n<< {extra}/Length {len(data)} '
+            f'/Filter /FlateDecode >>\nstream\n'.encode()
+            + data + b'\nendstream\nendobj\n')
+
+    def _xref(self):
+        size = max(self.offsets) + 1
+        rows = ['0000000000 65535 f ']
+        for number in range(1, size):
+            offset = self.offsets.get(number)
+            rows.append(f'{offset:010d} 00000 n ' if offset is not None
+                        else '0000000000 65535 f ')
+        return (f'xref\n0 {size}\n' + '\n'.join(rows)
+                + f'\ntrailer\n<< /Size {size} /Root {self.CATALOG} 0 R >>\n'
+                f'startxref\n{self.position}\n%%EOF\n').encode()
+
+    def _write(self, data):
+        self.position += len(data)
+        return data
@@ -0,0 +1,174 @@
+"""Профилирование SQL-запросов по запросам к API.
+
+SQLProfilingMiddleware считает запросы к базе, их суммарное время,
+повторяющиеся запросы (признак N+1) и время на открытие соединений,
+отдаёт итог в заголовке Server-Timing и пишет строку JSON в лог
+api.profiling. Время сериализации учитывается у вьюсетов
+с ProfiledSerializerMixin.
+
+Вьюсет может объявить бюджет запросов: query_budget = 5 или
+{'list': 5, 'retrieve': 4}. Превышение пишется в лог как warning,
+а в строгом режиме (SQL_PROFILING_STRICT, для тестов) - исключение.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('api.profiling')
+
+FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    """SQL без значений параметров: одинаков у запросов из одного цикла."""
+    for pattern, replacement in FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class QueryProfile:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.serializer_duration = 0.0
+        self.serializer_count = 0
+        self.connect_count = 0
+        self.connect_duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.most_common()
+                if count > 1}
+
+
+def get_query_budget(view_func, method):
+    view_class = getattr(view_func, 'cls', None)
+    budget = getattr(view_class, 'query_budget', None)
+    if not isinstance(budget, dict):
+        return budget
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+    return budget.get(action)
+
+
+class ProfiledSerializerMixin:
+    """Учитывает время и запросы сериализации ответа вьюсета."""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        profile = getattr(self.request, 'query_profile', None)
+        if profile is None:
+            return serializer
+        to_representation = serializer.to_representation
+
+        def timed_representation(instance):
+            started = time.perf_counter()
+            queries = profile.count
+            try:
+                return to_representation(instance)
+            finally:
+                profile.serializer_duration += time.perf_counter() - started
+                profile.serializer_count += profile.count - queries
+
+        serializer.to_representation = timed_representation
+        return serializer
+
+
+class SQLProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.SQL_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = request.query_profile = QueryProfile()
+        request.query_budget = None
+        started = time.perf_counter()
+        before = self.connect_stats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+        after = self.connect_stats()
+        profile.connect_count = after[0] - before[0]
+        profile.connect_duration = after[1] - before[1]
+        total = time.perf_counter() - started
+        response['Server-Timing'] = self.server_timing(profile, total)
+        self.report(request, response, profile, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func, request.method)
+
+    @staticmethod
+    def connect_stats():
+        """Сколько раз и за какое время открывались соединения: счётчики
+        ведут обёртки из foodgram_backend.db."""
+        count = duration = 0
+        for connection in connections.all():
+            count += getattr(connection, 'connect_count', 0)
+            duration += getattr(connection, 'connect_time', 0.0)
+        return count, duration
+
+    @staticmethod
+    def server_timing(profile, total):
+        duplicated = sum(count - 1 for count in profile.duplicates.values())
+        return ', '.join((
+            f'db;dur={profile.duration * 1000:.1f};'
+            f'desc="{profile.count} queries, {duplicated} duplicated"',
+            f'serializer;dur={profile.serializer_duration * 1000:.1f};'
+            f'desc="{profile.serializer_count} queries"',
+            f'connect;dur={profile.connect_duration * 1000:.1f};'
+            f'desc="{profile.connect_count} connections"',
+            f'total;dur={total * 1000:.1f}',
+        ))
+
+    @staticmethod
+    def report(request, response, profile, total):
+        budget = request.query_budget
+        over_budget = budget is not None and profile.count > budget
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': profile.count,
+            'db_ms': round(profile.duration * 1000, 1),
+            'serializer_ms': round(profile.serializer_duration * 1000, 1),
+            'serializer_queries': profile.serializer_count,
+            'connections': profile.connect_count,
+            'connect_ms': round(profile.connect_duration * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'budget': budget,
+            'duplicates': profile.duplicates,
+        }
+        logger.log(logging.WARNING if over_budget else logging.INFO,
+                   json.dumps(record, ensure_ascii=False))
+        if over_budget and settings.SQL_PROFILING_STRICT:
+            raise QueryBudgetExceeded(
+                f'{request.method} {request.path}: {profile.count} '
+                f'запросов при бюджете {budget}')
@@ -0,0 +1,114 @@
+import csv
+
+from django.conf import settings
+from django.utils import formats, timezone
+from rest_framework.renderers import BaseRenderer
+
+from .pdf import MARGIN, PAGE_WIDTH, PDFDocument, load_font
+
+TITLE = 'Список покупок'
+EMPTY = 'Список покупок пуст'
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    `stream()` отдаёт документ частями для StreamingHttpResponse,
+    `render()` собирает его целиком (ответы DRF, кеш PDF).
+    Ошибки DRF (словарь вместо списка) выводятся одной строкой.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''.join(self.stream(data))
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+    @staticmethod
+    def rows(ingredients):
+        for item in ingredients:
+            yield (item['name'], item['amount'], item['measurement_unit'])
+
+    @staticmethod
+    def footer():
+        date = formats.date_format(timezone.localtime(), 'j E Y H:i')
+        return f'Дата составления: {date}'
+
+    @staticmethod
+    def error(data):
+        if isinstance(data, dict):
+            return str(data.get('detail', data))
+        return None
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def stream(self, ingredients):
+        document = PDFDocument(load_font(settings.SHOPPING_LIST_FONT))
+        return document.stream(self.lines(document, ingredients))
+
+    def lines(self, document, ingredients):
+        error = self.error(ingredients)
+        if error is not None:
+            yield ((error, 12),)
+            return
+        size = document.font_size
+        name_width = PAGE_WIDTH * 0.6 - MARGIN - size
+        yield ((TITLE, 28),)
+        yield (('', size),)
+        empty = True
+        for name, amount, unit in self.rows(ingredients):
+            empty = False
+            yield ((document.fit(name, size, name_width), size),
+                   (f'{amount} ({unit})', size))
+        if empty:
+            yield ((EMPTY, size),)
+        yield (('', size),)
+        yield ((self.footer(), size),)
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        error = self.error(ingredients)
+        if error is not None:
+            yield error.encode()
+            return
+        yield f'{TITLE}\n\n'.encode()
+        empty = True
+        for name, amount, unit in self.rows(ingredients):
+            empty = False
+            yield f'{name} - {amount} ({unit})\n'.encode()
+        if empty:
+            yield f'{EMPTY}\n'.encode()
+        yield f'\n{self.footer()}\n'.encode()
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        error = self.error(ingredients)
+        if error is not None:
+            yield writer.writerow([error]).encode()
+            return
+        yield writer.writerow(
+            ['Ингредиент', 'Количество', 'Единица измерения']).encode()
+        for row in self.rows(ingredients):
+            yield writer.writerow(row).encode()
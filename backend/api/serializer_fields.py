@@ -1,13 +1,108 @@
-import base64
+import binascii
+from tempfile import SpooledTemporaryFile
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
+from rest_framework.exceptions import ValidationError
 from rest_framework.serializers import ImageField
 
+# Символов base64 за шаг декодирования, кратно 4
+CHUNK_SIZE = 64 * 1024
+BASE64_MARKER = ';base64,'
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def image_format(head):
+    """Формат изображения по первым байтам или None."""
+    for signature, format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return format
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
 
 class Base64ImageField(ImageField):
+    """Изображение в data URI, декодируется по частям.
+
+    Строка base64 не копируется целиком: каждый фрагмент декодируется
+    и сразу пишется в файл, который больше FILE_UPLOAD_MAX_MEMORY_SIZE
+    уходит из памяти во временный файл на диске. Не изображение
+    отклоняется по первому фрагменту, размер - до декодирования,
+    число пикселей - по заголовку изображения.
+    """
+
+    default_error_messages = {
+        **ImageField.default_error_messages,
+        'too_large': 'Размер изображения больше {max_size} байт.',
+        'too_many_pixels': 'Изображение больше {max_pixels} пикселей.',
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='img.' + ext)
+            # Изображение уже проверено в decode, проверка ImageField
+            # прочитала бы весь файл в память ещё раз.
+            return super(ImageField, self).to_internal_value(
+                self.decode(data))
         return super().to_internal_value(data)
+
+    def decode(self, data):
+        start = data.find(BASE64_MARKER, 0, 100)
+        if start == -1:
+            self.fail('invalid_image')
+        start += len(BASE64_MARKER)
+        size = (len(data) - start) * 3 // 4
+        max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+        if size > max_size:
+            self.fail('too_large', max_size=max_size)
+        file = UploadedFile(SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE), 'img')
+        try:
+            format = self.write(file, data, start)
+            self.verify(file)
+        except ValidationError:
+            file.close()
+            raise
+        file.name = f'img.{format}'
+        file.content_type = f'image/{format}'
+        return file
+
+    def write(self, file, data, start):
+        format = None
+        size = 0
+        try:
+            for offset in range(start, len(data), CHUNK_SIZE):
+                chunk = binascii.a2b_base64(data[offset:offset + CHUNK_SIZE])
+                if format is None:
+                    format = image_format(chunk)
+                    if format is None:
+                        self.fail('invalid_image')
+                file.write(chunk)
+                size += len(chunk)
+        except binascii.Error:
+            self.fail('invalid_image')
+        if format is None:
+            self.fail('invalid_image')
+        file.size = size
+        file.seek(0)
+        return format
+
+    def verify(self, file):
+        max_pixels = settings.IMAGE_UPLOAD_MAX_PIXELS
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+                if width * height > max_pixels:
+                    self.fail('too_many_pixels', max_pixels=max_pixels)
+                image.verify()
+        except ValidationError:
+            raise
+        except Exception:
+            self.fail('invalid_image')
+        file.seek(0)
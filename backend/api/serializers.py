@@ -1,10 +1,13 @@
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.serializers import SerializerMethodField
 from rest_framework.validators import ValidationError
 
 from recipes.models import (FavoriteRecipe, IngredientModel, RecipeIngredients,
-                            RecipeModel, ShoppingCartRecipes, TagModel)
+                            RecipeModel, ShoppingCartRecipes, TagModel,
+                            set_recipe_amounts)
+from recipes.search import update_search_index
 from users.models import Follow, User
 
 from .serializer_fields import Base64ImageField
@@ -46,6 +49,8 @@ class AuthorSerializer(serializers.ModelSerializer):
     def get_subscription(self, obj):
         if self.context['request'].user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return Follow.objects.filter(follower=self.context['request'].user,
                                      author=obj).exists()
 
@@ -61,12 +66,14 @@ class RecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = RecipeModel
         fields = ('id', 'tags', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'author',  'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'author',  'name', 'image',
+                  'image_list', 'image_detail', 'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
         if self.context['request'].user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return FavoriteRecipe.objects.filter(user=self.
                                              context['request'].user,
                                              recipe=obj).exists()
@@ -74,8 +81,8 @@ class RecipeSerializer(serializers.ModelSerializer):
     def get_is_in_shopping_cart(self, obj):
         if self.context['request'].user.is_anonymous:
             return False
-        # user = self.context['request'].user
-        # return obj.recipes_in_shopping_card.filter(user=user).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return ShoppingCartRecipes.objects.filter(user=self.
                                                   context['request'].user,
                                                   recipe=obj).exists()
@@ -85,13 +92,12 @@ class FavoriteRecipeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RecipeModel
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_list', 'cooking_time')
 
 
 class CreateIngredientAmountSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=IngredientModel.objects.all(),
-        )
+    # Ингредиенты по id проверяет PostRecipeSerializer, одним запросом.
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredients
@@ -124,6 +130,7 @@ class PostRecipeSerializer(serializers.ModelSerializer):
                                                amount=elem['amount']))
         RecipeIngredients.objects.bulk_create(to_create)
         recipe.tags.set(tags)
+        update_search_index([recipe.pk])
         return recipe
 
     @transaction.atomic
@@ -131,28 +138,35 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         if ingredients:
-            instance.ingredients.clear()
-            to_create = []
-            for elem in ingredients:
-                to_create.append(RecipeIngredients(ingredients=elem['id'],
-                                                   recipe=instance,
-                                                   amount=elem['amount']))
-            RecipeIngredients.objects.bulk_create(to_create)
+            set_recipe_amounts(instance, {elem['id'].id: elem['amount']
+                                          for elem in ingredients})
         if tags:
-            instance.tags.clear()
             instance.tags.set(tags)
-        if (instance.image is not None and
-                validated_data.get('image') is not None):
-            instance.image.delete()
-        return super().update(instance, validated_data)
+        instance = super().update(instance, validated_data)
+        update_search_index([instance.pk])
+        return instance
 
     def to_representation(self, instance):
+        # После сохранения prefetch сброшен: теги и состав с ингредиентами
+        # читаются двумя запросами, а не по запросу на ингредиент.
+        prefetch_related_objects(
+            [instance], 'tags',
+            Prefetch('recipe_ingredients',
+                     queryset=RecipeIngredients.objects.select_related(
+                         'ingredients')))
         new = RecipeSerializer(instance, context=self.context)
         return new.data
 
     def validate_ingredients(self, obj):
         if len(obj) == 0:
             raise ValidationError("Ingredients list must not be empty")
+        ingredients = IngredientModel.objects.in_bulk(
+            [elem['id'] for elem in obj])
+        for elem in obj:
+            if elem['id'] not in ingredients:
+                raise ValidationError(
+                    f'Invalid pk "{elem["id"]}" - object does not exist.')
+            elem['id'] = ingredients[elem['id']]
         return obj
 
     def validate_tags(self, obj):
@@ -0,0 +1,1376 @@
+import base64
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import redirect_stdout
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Q, Sum
+from django.test import (AsyncClient, Client, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from api.images import variant_name
+from api.management.commands import runworker
+from api.management.commands.runworker import Command as RunWorker
+from api.pdf import PDFDocument
+from api.profiling import QueryBudgetExceeded
+from api.serializer_fields import Base64ImageField
+from api.urls import async_urlpatterns, router
+from api.views import RecipeViewSet
+from foodgram_backend.db.pool import POOLS, ConnectionPool
+from recipes.management.commands.ingredientsimport import read_json
+from recipes.models import (FavoriteRecipe, FeedEntry, IngredientModel,
+                            RecipeIngredients, RecipeModel,
+                            ShoppingCartIngredient, ShoppingCartRecipes,
+                            ShoppingListExport, TableVersion, TagModel,
+                            add_recipes)
+from recipes.search import SQLITE_TABLE, search_recipes, update_search_index
+from users.models import Follow, User
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        password='password', first_name=username, last_name=username)
+
+
+def image_data_uri(side=4, image_format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (side, side), '#E26C2D').save(buffer, image_format)
+    return (f'data:image/{image_format.lower()};base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def create_recipes(author, count, tags=(), ingredients=()):
+    recipes = []
+    for number in range(count):
+        recipe = RecipeModel.objects.create(
+            author=author, name=f'Рецепт {number}', text='Текст',
+            image='images/test.png', cooking_time=10)
+        recipe.tags.set(tags)
+        RecipeIngredients.objects.bulk_create(
+            RecipeIngredients(recipe=recipe, ingredients=ingredient,
+                              amount=number + 1)
+            for ingredient in ingredients)
+        recipes.append(recipe)
+    return recipes
+
+
+class TempMediaMixin:
+    """Файлы теста сохраняются во временный MEDIA_ROOT."""
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root))
+        super().setUpClass()
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов страницы рецептов не зависит от её размера."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        authors = [create_user(f'author{number}') for number in range(5)]
+        tags = [TagModel.objects.create(name=f'Тег {number}',
+                                        color=f'#00000{number}',
+                                        slug=f'tag{number}')
+                for number in range(2)]
+        ingredients = [IngredientModel.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(3)]
+        recipes = []
+        for author in authors:
+            recipes += create_recipes(author, 40, tags, ingredients)
+        Follow.objects.create(follower=cls.user, author=authors[0])
+        for recipe in recipes[::3]:
+            FavoriteRecipe.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCartRecipes.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        # COUNT(*), страница с флагами, теги, ингредиенты, авторы.
+        for limit in (6, 50, 200):
+            with self.subTest(limit=limit), self.assertNumQueries(5):
+                response = self.client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_list_flags_come_from_annotations(self):
+        response = self.client.get('/api/recipes/?limit=50')
+        favorited = set(FavoriteRecipe.objects.filter(
+            user=self.user).values_list('recipe_id', flat=True))
+        for recipe in response.data['results']:
+            self.assertEqual(recipe['is_favorited'],
+                             recipe['id'] in favorited)
+            self.assertEqual(recipe['is_in_shopping_cart'],
+                             recipe['id'] in favorited)
+
+
+class RecipeCursorPaginationTest(TestCase):
+    """Курсорный режим списка рецептов (?cursor=) и прежний page/limit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        create_recipes(cls.author, 20)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    @staticmethod
+    def newest_first():
+        return list(RecipeModel.objects.order_by(
+            '-published', '-id').values_list('pk', flat=True))
+
+    @staticmethod
+    def ids(response):
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def walk(self, url):
+        pages = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            for query in queries.captured_queries:
+                self.assertNotIn('COUNT(', query['sql'])
+            pages.append(self.ids(response))
+            url = response.data['next']
+        return pages
+
+    def test_first_page_with_empty_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+        self.assertIn('cursor=', response.data['next'])
+        self.assertEqual(self.ids(response), self.newest_first()[:5])
+
+    def test_next_links_cover_all_recipes(self):
+        pages = self.walk('/api/recipes/?cursor=&limit=6')
+        self.assertEqual([len(page) for page in pages], [6, 6, 6, 2])
+        self.assertEqual(sum(pages, []), self.newest_first())
+
+    def test_stable_under_inserts(self):
+        expected = self.newest_first()
+        response = self.client.get('/api/recipes/?cursor=&limit=6')
+        first = self.ids(response)
+        # Новые рецепты появляются в начале списка и не сдвигают
+        # следующие страницы: нет ни повторов, ни пропусков.
+        create_recipes(self.author, 3)
+        rest = self.walk(response.data['next'])
+        self.assertEqual(first + sum(rest, []), expected)
+
+    def test_page_mode_is_unchanged(self):
+        expected = self.newest_first()
+        response = self.client.get('/api/recipes/?limit=6&page=2')
+        self.assertEqual(response.data['count'], 20)
+        self.assertIn('page=3', response.data['next'])
+        self.assertEqual(self.ids(response), expected[6:12])
+        response = self.client.get('/api/recipes/')
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         expected)
+
+
+class RecipeTagFilterTest(TestCase):
+    """Фильтр по тегам: любой (tags_match=any, по умолчанию) или все
+    теги (tags_match=all), без DISTINCT."""
+
+    @classmethod
+    def setUpTestData(cls):
+        breakfast, lunch, dinner = (
+            TagModel.objects.create(name=slug, color=color, slug=slug)
+            for slug, color in (('breakfast', '#000001'),
+                                ('lunch', '#000002'),
+                                ('dinner', '#000003')))
+        author = create_user('author')
+        (cls.breakfast, cls.both, cls.lunch_dinner,
+         cls.untagged) = create_recipes(author, 4)
+        cls.breakfast.tags.set([breakfast])
+        cls.both.tags.set([breakfast, lunch])
+        cls.lunch_dinner.tags.set([lunch, dinner])
+
+    def filtered(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/',
+                                       {'limit': 10, **params})
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            self.assertNotIn('DISTINCT', query['sql'])
+        self.assertEqual(response.data['count'],
+                         len(response.data['results']))
+        return {recipe['id'] for recipe in response.data['results']}
+
+    def test_any(self):
+        expected = {self.breakfast.pk, self.both.pk, self.lunch_dinner.pk}
+        self.assertEqual(self.filtered(tags=['breakfast', 'lunch']), expected)
+        self.assertEqual(self.filtered(tags=['breakfast', 'lunch'],
+                                       tags_match='any'), expected)
+        self.assertEqual(self.filtered(tags=['dinner']),
+                         {self.lunch_dinner.pk})
+
+    def test_all(self):
+        self.assertEqual(self.filtered(tags=['breakfast', 'lunch'],
+                                       tags_match='all'), {self.both.pk})
+        self.assertEqual(self.filtered(tags=['breakfast', 'breakfast'],
+                                       tags_match='all'),
+                         {self.breakfast.pk, self.both.pk})
+        self.assertEqual(self.filtered(tags=['breakfast', 'dinner'],
+                                       tags_match='all'), set())
+
+    def test_unknown_match(self):
+        response = self.client.get('/api/recipes/', {
+            'tags': ['breakfast', 'lunch'], 'tags_match': 'some'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tags_match', response.data)
+
+
+class SubscriptionsQueriesTest(TestCase):
+    """Страница подписок: число запросов не зависит от числа авторов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        cls.authors = [create_user(f'author{number}') for number in range(5)]
+        for author in cls.authors:
+            create_recipes(author, 10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_queries_do_not_grow_with_authors(self):
+        url = '/api/users/subscriptions/?limit=6&recipes_limit=3'
+        # COUNT(*), страница авторов, рецепты всех авторов страницы.
+        for count in (1, len(self.authors)):
+            Follow.objects.bulk_create(
+                Follow(follower=self.user, author=author)
+                for author in self.authors[:count])
+            with self.subTest(authors=count), self.assertNumQueries(3):
+                response = self.client.get(url)
+            self.assertEqual(len(response.data['results']), count)
+            for author in response.data['results']:
+                self.assertEqual(len(author['recipes']), 3)
+                self.assertEqual(author['recipes_count'], 10)
+            Follow.objects.filter(follower=self.user).delete()
+
+
+INGREDIENT_WRITES = ('INSERT INTO "recipes_recipeingredients"',
+                     'UPDATE "recipes_recipeingredients"',
+                     'DELETE FROM "recipes_recipeingredients"')
+
+
+class RecipeUpdateQueriesTest(TestCase):
+    """Изменение рецепта: запросы не зависят от размера состава."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('author')
+        cls.tags = [TagModel.objects.create(name=f'Тег {number}',
+                                            color=f'#00000{number}',
+                                            slug=f'tag{number}')
+                    for number in range(2)]
+        cls.ingredients = [IngredientModel.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(10)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def update(self, size, amount=1):
+        recipe, = create_recipes(self.user, 1, self.tags,
+                                 self.ingredients[:size])
+        body = {
+            'name': 'Новое название', 'text': 'Текст', 'cooking_time': 5,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [{'id': ingredient.pk, 'amount': amount}
+                            for ingredient in self.ingredients[:size]],
+        }
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(f'/api/recipes/{recipe.pk}/',
+                                         body, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), size)
+        return [query['sql'] for query in context.captured_queries]
+
+    def test_queries_do_not_grow_with_ingredients(self):
+        self.assertEqual(len(self.update(3)), len(self.update(10)))
+
+    def test_unchanged_ingredients_are_not_rewritten(self):
+        # create_recipes даёт первому рецепту количество 1.
+        writes = [sql for sql in self.update(10)
+                  if sql.startswith(INGREDIENT_WRITES)]
+        self.assertEqual(writes, [])
+        writes = [sql for sql in self.update(10, amount=2)
+                  if sql.startswith(INGREDIENT_WRITES)]
+        self.assertEqual(len(writes), 1)
+
+    def test_unknown_ingredient(self):
+        recipe, = create_recipes(self.user, 1, self.tags,
+                                 self.ingredients[:1])
+        response = self.client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {'name': 'Рецепт', 'text': 'Текст', 'cooking_time': 5,
+             'tags': [self.tags[0].pk],
+             'ingredients': [{'id': 0, 'amount': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.data)
+
+
+class BulkRelationQueriesTest(TestCase):
+    """Пакетные добавление и удаление не делают запросов на каждый
+    рецепт: ни чтений, ни сигналов удаления."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        ingredients = [IngredientModel.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(3)]
+        cls.recipes = create_recipes(create_user('author'), 10,
+                                     ingredients=ingredients)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def toggle(self, method, relation, recipes):
+        with CaptureQueriesContext(connection) as context:
+            response = method(f'/api/recipes/{relation}/',
+                              {'ids': [recipe.pk for recipe in recipes]},
+                              format='json')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_queries_do_not_grow_with_batch(self):
+        for relation in ('favorite', 'shopping_cart'):
+            with self.subTest(relation=relation):
+                counts = {}
+                for size in (1, 10):
+                    recipes = self.recipes[:size]
+                    counts[size] = (
+                        self.toggle(self.client.post, relation, recipes),
+                        self.toggle(self.client.delete, relation, recipes))
+                self.assertEqual(counts[1], counts[10])
+        self.assertFalse(ShoppingCartIngredient.objects.exists())
+        self.assertFalse(RecipeModel.objects.filter(
+            Q(favorites_count__gt=0) | Q(shopping_cart_count__gt=0),
+        ).exists())
+
+
+@override_settings(FEED_FANOUT_LIMIT=1)
+class FeedTest(TestCase):
+    """Лента при переходе числа подписчиков через FEED_FANOUT_LIMIT."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.readers = [create_user(f'reader{number}') for number in range(2)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.readers[0])
+
+    def feed_ids(self):
+        response = self.client.get('/api/recipes/feed/?limit=50')
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_recipes_survive_crossing_the_limit(self):
+        Follow.objects.create(follower=self.readers[0], author=self.author)
+        pushed, = create_recipes(self.author, 1)
+        Follow.objects.create(follower=self.readers[1], author=self.author)
+        pulled, = create_recipes(self.author, 1)
+        self.assertTrue(pushed.fanned_out)
+        self.assertFalse(pulled.fanned_out)
+        self.assertEqual(self.feed_ids(), [pulled.pk, pushed.pk])
+        Follow.objects.get(follower=self.readers[1]).delete()
+        self.assertEqual(self.feed_ids(), [pulled.pk, pushed.pk])
+        Follow.objects.get(follower=self.readers[0]).delete()
+        self.assertEqual(self.feed_ids(), [])
+
+
+@override_settings(SQL_PROFILING=True, SQL_PROFILING_STRICT=True)
+class QueryBudgetTest(TestCase):
+    """Вьюсеты укладываются в query_budget; превышение в строгом режиме -
+    исключение QueryBudgetExceeded."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        author = create_user('author')
+        tags = [TagModel.objects.create(name=f'Тег {number}',
+                                        color=f'#00000{number}',
+                                        slug=f'tag{number}')
+                for number in range(3)]
+        ingredients = [IngredientModel.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(5)]
+        recipes = create_recipes(author, 10, tags, ingredients)
+        Follow.objects.create(follower=cls.user, author=author)
+        add_recipes(FavoriteRecipe, cls.user, [recipes[0].pk])
+        add_recipes(ShoppingCartRecipes, cls.user,
+                    [recipe.pk for recipe in recipes[:3]])
+        cls.recipe = recipes[0]
+
+    def setUp(self):
+        # Middleware собирается при первом запросе клиента, уже
+        # с SQL_PROFILING=True.
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        with self.assertLogs('api.profiling', 'INFO') as logs:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertIn('Server-Timing', response)
+        return json.loads(logs.records[-1].getMessage())
+
+    def test_views_fit_budgets(self):
+        for url in ('/api/tags/', '/api/ingredients/',
+                    '/api/recipes/?limit=6', f'/api/recipes/{self.recipe.pk}/',
+                    '/api/recipes/feed/',
+                    '/api/recipes/download_shopping_cart/',
+                    '/api/users/subscriptions/'):
+            record = self.get(url)
+            self.assertIsNotNone(record['budget'], url)
+            self.assertLessEqual(record['queries'], record['budget'], url)
+
+    def test_over_budget_raises(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        with mock.patch.object(RecipeViewSet, 'query_budget',
+                               {'retrieve': 1}):
+            with self.assertLogs('api.profiling', 'WARNING'), \
+                    self.assertRaisesMessage(QueryBudgetExceeded,
+                                             'при бюджете 1'):
+                self.client.get(url)
+            with override_settings(SQL_PROFILING_STRICT=False):
+                record = self.get(url)
+        self.assertGreater(record['queries'], record['budget'])
+
+
+def run_concurrently(target, threads):
+    """Запускает target(number, statuses) в threads потоках разом и
+    возвращает Counter статусов ответов."""
+    barrier = threading.Barrier(threads)
+    counters = [Counter() for _ in range(threads)]
+
+    def run(number):
+        try:
+            barrier.wait()
+            target(number, counters[number])
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=run, args=(number,))
+               for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counters, Counter())
+
+
+def expected_cart_amounts():
+    """Суммы списков покупок, пересчитанные по составу рецептов."""
+    return {
+        (row['recipe__recipes_in_shopping_card__user'],
+         row['ingredients']): row['total']
+        for row in RecipeIngredients.objects.filter(
+            recipe__recipes_in_shopping_card__isnull=False,
+        ).values('ingredients', 'recipe__recipes_in_shopping_card__user',
+                 ).annotate(total=Sum('amount')).order_by()}
+
+
+def cart_amounts():
+    return {(row.user_id, row.ingredient_id): row.amount
+            for row in ShoppingCartIngredient.objects.all()}
+
+
+class RelationTogglesConcurrencyTest(TransactionTestCase):
+    """Параллельные добавления и удаления избранного и списка покупок."""
+
+    threads = 8
+    rounds = 15
+
+    def setUp(self):
+        self.users = [create_user(f'user{number}') for number in range(2)]
+        author = create_user('author')
+        ingredients = [IngredientModel.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(3)]
+        # Общие ингредиенты: одни и те же строки ShoppingCartIngredient.
+        self.recipes = create_recipes(author, 4, ingredients=ingredients)
+
+    def toggle(self, number, statuses):
+        client = APIClient()
+        client.force_authenticate(self.users[number % len(self.users)])
+        for round_number in range(self.rounds):
+            recipe = self.recipes[(number + round_number)
+                                  % len(self.recipes)]
+            for relation in ('favorite', 'shopping_cart'):
+                url = f'/api/recipes/{recipe.pk}/{relation}/'
+                method = (client.post if (number + round_number) % 2
+                          else client.delete)
+                statuses[method(url).status_code] += 1
+
+    def test_counters_and_cart_stay_consistent(self):
+        statuses = run_concurrently(self.toggle, self.threads)
+        self.assertEqual(sum(statuses.values()),
+                         self.threads * self.rounds * 2)
+        self.assertEqual(set(statuses) - {201, 204, 400}, set())
+        for recipe in RecipeModel.objects.all():
+            self.assertEqual(recipe.favorites_count,
+                             recipe.favoring_users.count())
+            self.assertEqual(recipe.shopping_cart_count,
+                             recipe.recipes_in_shopping_card.count())
+        self.assertEqual(cart_amounts(), expected_cart_amounts())
+
+
+class SubscribeConcurrencyTest(TransactionTestCase):
+    """Параллельные подписки и отписки на одного автора."""
+
+    threads = 8
+    rounds = 10
+
+    def setUp(self):
+        self.author = create_user('author')
+        create_recipes(self.author, 3)
+        self.users = [create_user(f'user{number}') for number in range(2)]
+
+    def toggle(self, number, statuses):
+        client = APIClient()
+        client.force_authenticate(self.users[number % len(self.users)])
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        for round_number in range(self.rounds):
+            method = (client.post if (number + round_number) % 2
+                      else client.delete)
+            statuses[method(url).status_code] += 1
+
+    def test_follows_and_feed_stay_consistent(self):
+        statuses = run_concurrently(self.toggle, self.threads)
+        self.assertEqual(sum(statuses.values()), self.threads * self.rounds)
+        self.assertEqual(set(statuses) - {201, 204, 400}, set())
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count,
+                         Follow.objects.filter(author=self.author).count())
+        for user in self.users:
+            followed = Follow.objects.filter(follower=user,
+                                             author=self.author).exists()
+            self.assertEqual(
+                FeedEntry.objects.filter(user=user).count(),
+                3 if followed else 0)
+
+
+class RecipeEditCartConcurrencyTest(TransactionTestCase):
+    """Правка состава рецепта одновременно с добавлением его в списки."""
+
+    editors = 2
+    shoppers = 6
+    rounds = 10
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.users = [create_user(f'user{number}')
+                      for number in range(self.shoppers)]
+        self.tags = [TagModel.objects.create(name='Тег', color='#000000',
+                                             slug='tag')]
+        self.ingredients = [IngredientModel.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(4)]
+        self.recipe, = create_recipes(self.author, 1, self.tags,
+                                      self.ingredients[:2])
+
+    def edit(self, round_number):
+        # Меняются и количества, и набор ингредиентов.
+        ingredients = self.ingredients[round_number % 3:][:2]
+        return {
+            'name': 'Рецепт', 'text': 'Текст', 'cooking_time': 5,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [{'id': ingredient.pk, 'amount': round_number + 1}
+                            for ingredient in ingredients],
+        }
+
+    def work(self, number, statuses):
+        client = APIClient()
+        url = f'/api/recipes/{self.recipe.pk}/'
+        if number < self.editors:
+            client.force_authenticate(self.author)
+            for round_number in range(self.rounds):
+                statuses[client.patch(url, self.edit(round_number + number),
+                                      format='json').status_code] += 1
+            return
+        client.force_authenticate(self.users[number - self.editors])
+        for round_number in range(self.rounds):
+            method = client.post if round_number % 2 == 0 else client.delete
+            statuses[method(f'{url}shopping_cart/').status_code] += 1
+
+    def test_cart_follows_recipe_edits(self):
+        statuses = run_concurrently(self.work, self.editors + self.shoppers)
+        self.assertEqual(sum(statuses.values()),
+                         (self.editors + self.shoppers) * self.rounds)
+        self.assertEqual(set(statuses) - {200, 201, 204}, set())
+        self.assertEqual(cart_amounts(), expected_cart_amounts())
+        # Последний раунд покупателей - удаление, добавим рецепт снова.
+        for user in self.users:
+            client = APIClient()
+            client.force_authenticate(user)
+            client.post(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.assertEqual(len(cart_amounts()), self.shoppers * 2)
+        self.assertEqual(cart_amounts(), expected_cart_amounts())
+
+
+class TagCacheTest(TestCase):
+    """Условные запросы к справочнику тегов."""
+
+    def setUp(self):
+        TagModel.objects.create(name='Завтрак', color='#E26C2D',
+                                slug='breakfast')
+        TableVersion.objects.filter(table='recipes.tagmodel').update(
+            updated=timezone.now() - timedelta(minutes=1))
+
+    def test_if_modified_since(self):
+        response = self.client.get('/api/tags/')
+        last_modified = response['Last-Modified']
+        response = self.client.get('/api/tags/',
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        TagModel.objects.create(name='Ужин', color='#8775D2', slug='dinner')
+        response = self.client.get('/api/tags/',
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+    def test_no_last_modified_in_the_second_of_a_change(self):
+        TagModel.objects.create(name='Ужин', color='#8775D2', slug='dinner')
+        response = self.client.get('/api/tags/')
+        self.assertNotIn('Last-Modified', response)
+        response = self.client.get('/api/tags/',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class TokenCacheTest(TestCase):
+    """Кеш токенов сбрасывается при выходе и отключении пользователя."""
+
+    def setUp(self):
+        caches['auth_tokens'].clear()
+        self.user = create_user('viewer')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def me(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def test_cached_token(self):
+        self.assertEqual(self.me(), 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.me(), 200)
+
+    def test_deleted_token(self):
+        self.assertEqual(self.me(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        self.assertEqual(self.me(), 401)
+
+    def test_deactivated_user(self):
+        self.assertEqual(self.me(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.me(), 401)
+
+
+class ShoppingListExportTest(TempMediaMixin, TransactionTestCase):
+    """PDF списка покупок отдаётся по частям и сохраняется для повторных
+    загрузок.
+
+    TransactionTestCase: закрытие ответа, как и в WSGI-сервере, закрывает
+    соединение с базой, внутри atomic TestCase это невозможно.
+    """
+
+    url = '/api/recipes/download_shopping_cart/?format=pdf'
+
+    def setUp(self):
+        self.user = create_user('viewer')
+        ingredients = [IngredientModel.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(3)]
+        recipe, = create_recipes(create_user('author'), 1,
+                                 ingredients=ingredients)
+        ShoppingCartRecipes.objects.create(user=self.user, recipe=recipe)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_streamed_pdf_is_stored(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        export = ShoppingListExport.objects.get(user=self.user)
+        self.assertEqual(export.status, ShoppingListExport.PROCESSING)
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF'))
+        export.refresh_from_db()
+        self.assertEqual(export.status, ShoppingListExport.DONE)
+        with export.file.open('rb') as file:
+            self.assertEqual(file.read(), content)
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+    def test_interrupted_download_is_requeued(self):
+        response = self.client.get(self.url)
+        next(iter(response.streaming_content))
+        response.close()
+        export = ShoppingListExport.objects.get(user=self.user)
+        self.assertEqual(export.status, ShoppingListExport.PENDING)
+        self.assertFalse(export.file)
+
+
+class MediaCleanupTest(TempMediaMixin, TestCase):
+    """Файлы удаляются только после фиксации транзакции, sweepmedia
+    убирает старые файлы без ссылок."""
+
+    def setUp(self):
+        self.recipe, = create_recipes(create_user('author'), 1)
+        self.recipe.image = default_storage.save('images/recipe.png',
+                                                 ContentFile(b'image'))
+        self.recipe.save()
+
+    @staticmethod
+    def make_old(name):
+        mtime = (timezone.now() - timedelta(hours=2)).timestamp()
+        os.utime(default_storage.path(name), (mtime, mtime))
+
+    def test_rolled_back_delete_keeps_file(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                RecipeModel.objects.filter(pk=self.recipe.pk).delete()
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertTrue(RecipeModel.objects.filter(
+            pk=self.recipe.pk).exists())
+        self.assertTrue(default_storage.exists(self.recipe.image.name))
+
+    def test_committed_delete_removes_file(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+            self.assertTrue(default_storage.exists(self.recipe.image.name))
+        self.assertFalse(default_storage.exists(self.recipe.image.name))
+
+    def sweep(self, *args):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            call_command('sweepmedia', *args)
+        return output.getvalue()
+
+    def test_sweepmedia(self):
+        old = default_storage.save('images/old.png', ContentFile(b'old'))
+        fresh = default_storage.save('images/fresh.png',
+                                     ContentFile(b'fresh'))
+        self.make_old(old)
+        self.make_old(self.recipe.image.name)
+        output = self.sweep('--dry-run', '--min-age', '0')
+        self.assertIn(old, output)
+        self.assertIn(fresh, output)
+        self.assertNotIn(self.recipe.image.name, output)
+        for name in (old, fresh):
+            self.assertTrue(default_storage.exists(name))
+        self.sweep()
+        self.assertFalse(default_storage.exists(old))
+        self.assertTrue(default_storage.exists(fresh))
+        self.assertTrue(default_storage.exists(self.recipe.image.name))
+
+
+class RunWorkerExportTest(TempMediaMixin, TestCase):
+    """Очередь PDF списков покупок в runworker: обработка, возврат
+    брошенных задач и отмена при смене корзины."""
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        self.user = create_user('viewer')
+        self.ingredients = [IngredientModel.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(2)]
+        self.recipes = create_recipes(create_user('author'), 2,
+                                      ingredients=self.ingredients)
+        RecipeModel.objects.update(image_status=RecipeModel.IMAGE_DONE)
+        ShoppingCartRecipes.objects.create(user=self.user,
+                                           recipe=self.recipes[0])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.worker = RunWorker()
+
+    def enqueue(self):
+        response = self.client.get(self.url,
+                                   {'format': 'pdf', 'async': 'true'})
+        self.assertEqual(response.status_code, 202)
+        return ShoppingListExport.objects.get(pk=response.json()['id'])
+
+    def test_queue(self):
+        export = self.enqueue()
+        self.assertEqual(export.status, ShoppingListExport.PENDING)
+        call_command('runworker', '--once')
+        export.refresh_from_db()
+        self.assertEqual(export.status, ShoppingListExport.DONE)
+        response = self.client.get(f'{self.url}{export.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content)
+                        .startswith(b'%PDF'))
+        # Новая корзина - новая задача, прежний список и его файл удаляются.
+        ShoppingCartRecipes.objects.create(user=self.user,
+                                           recipe=self.recipes[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            new = self.enqueue()
+        self.assertNotEqual(new.pk, export.pk)
+        self.assertEqual(list(ShoppingListExport.objects.filter(
+            user=self.user)), [new])
+        self.assertFalse(default_storage.exists(export.file.name))
+
+    def test_stale_jobs_are_requeued(self):
+        export = self.enqueue()
+        stale = timezone.now() - timedelta(
+            seconds=settings.WORKER_JOB_TIMEOUT + 1)
+        ShoppingListExport.objects.update(
+            status=ShoppingListExport.PROCESSING, started=stale)
+        RecipeModel.objects.filter(pk=self.recipes[0].pk).update(
+            image_status=RecipeModel.IMAGE_PROCESSING, image_started=stale)
+        RecipeModel.objects.filter(pk=self.recipes[1].pk).update(
+            image_status=RecipeModel.IMAGE_PROCESSING,
+            image_started=timezone.now())
+        with self.assertLogs(runworker.logger, 'WARNING'):
+            self.worker.requeue_stale()
+        export.refresh_from_db()
+        self.assertEqual(export.status, ShoppingListExport.PENDING)
+        self.assertEqual(dict(RecipeModel.objects.values_list(
+            'pk', 'image_status')), {
+                self.recipes[0].pk: RecipeModel.IMAGE_PENDING,
+                self.recipes[1].pk: RecipeModel.IMAGE_PROCESSING})
+
+    def test_cancelled_export_is_discarded(self):
+        self.enqueue()
+        export = self.worker.claim_export()
+        self.assertEqual(export.status, ShoppingListExport.PROCESSING)
+        self.assertIsNone(self.worker.claim_export())
+        ShoppingListExport.objects.filter(pk=export.pk).delete()
+        with self.assertLogs(runworker.logger, 'INFO') as logs:
+            self.worker.process_export(export)
+        self.assertIn('отменён', logs.output[0])
+        self.assertEqual(default_storage.listdir('shopping_lists')[1], [])
+
+    def test_failed_export(self):
+        export = self.enqueue()
+        with mock.patch.object(runworker, 'render_shopping_list',
+                               side_effect=ValueError), \
+                self.assertLogs(runworker.logger, 'ERROR'):
+            call_command('runworker', '--once')
+        export.refresh_from_db()
+        self.assertEqual(export.status, ShoppingListExport.FAILED)
+        response = self.client.get(f'{self.url}{export.pk}/')
+        self.assertEqual(response.status_code, 500)
+
+
+class IngredientsImportTest(TestCase):
+    """ingredientsimport читает файл потоком, пропускает дубликаты
+    и некорректные записи."""
+
+    def setUp(self):
+        IngredientModel.objects.create(name='соль', measurement_unit='г')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def run_import(self, name, content, *args):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            file.write(content)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            call_command('ingredientsimport', '-p', path, *args)
+        return output.getvalue()
+
+    def names(self):
+        return set(IngredientModel.objects.values_list('name', flat=True))
+
+    def test_json_is_read_in_chunks(self):
+        items = [{'name': f'ингредиент {number}', 'measurement_unit': 'г'}
+                 for number in range(50)]
+        file = io.StringIO(json.dumps(items, ensure_ascii=False))
+        reader = read_json(file, chunk_size=16)
+        self.assertEqual(next(reader), items[0])
+        self.assertLess(file.tell(), len(file.getvalue()))
+        self.assertEqual([items[0], *reader], items)
+
+    def test_json(self):
+        output = self.run_import('ingredients.json', json.dumps([
+            {'name': 'мука', 'measurement_unit': 'г'},
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'молоко', 'measurement_unit': 'мл'},
+            {'name': 'мука', 'measurement_unit': 'кг'},
+            {'name': 'x' * 201, 'measurement_unit': 'г'},
+        ], ensure_ascii=False), '--batch-size', '1')
+        self.assertIn('Было добавлено 2 ингредиентов.', output)
+        self.assertIn('Произошла ошибка', output)
+        self.assertEqual(self.names(), {'соль', 'мука', 'молоко'})
+        self.assertEqual(IngredientModel.objects.get(name='мука')
+                         .measurement_unit, 'г')
+
+    def test_csv(self):
+        output = self.run_import('ingredients.csv',
+                                 'мука,г\n\nсоль,г\n"яйца, крупные",шт.\n'
+                                 'мука,г\nбез единицы\n')
+        self.assertIn('Было добавлено 2 ингредиентов.', output)
+        self.assertEqual(self.names(), {'соль', 'мука', 'яйца, крупные'})
+
+    def test_dry_run(self):
+        version = TableVersion.get(IngredientModel).version
+        output = self.run_import('ingredients.csv', 'мука,г\nсоль,г\n',
+                                 '--dry-run')
+        self.assertIn('Будет добавлено 1 ингредиентов.', output)
+        self.assertEqual(self.names(), {'соль'})
+        self.assertEqual(TableVersion.get(IngredientModel).version, version)
+
+    def test_not_an_array(self):
+        output = self.run_import('ingredients.json', '{"name": "мука"}')
+        self.assertIn('Ошибка при чтении файла', output)
+        self.assertEqual(self.names(), {'соль'})
+
+
+class RunWorkerImageTest(TempMediaMixin, TestCase):
+    """Копии изображений рецептов в runworker: построение, повторная
+    постановка в очередь при замене изображения и удаление файлов."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.tag = TagModel.objects.create(name='Тег', color='#000000',
+                                           slug='tag')
+        self.flour = IngredientModel.objects.create(name='мука',
+                                                    measurement_unit='г')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        response = self.client.post('/api/recipes/', self.body(),
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.url = f'/api/recipes/{response.data["id"]}/'
+
+    def body(self):
+        return {'name': 'Шарлотка', 'text': 'Испечь.', 'cooking_time': 40,
+                'tags': [self.tag.pk], 'image': image_data_uri(side=1500),
+                'ingredients': [{'id': self.flour.pk, 'amount': 200}]}
+
+    def recipe(self):
+        return RecipeModel.objects.get(pk=self.client.get(self.url)
+                                       .data['id'])
+
+    @staticmethod
+    def variants(recipe):
+        """Копии изображения recipe в хранилище."""
+        names = {variant_name(recipe.image.name, suffix)
+                 for suffix in ('list', 'detail')}
+        return names & set(default_storage.listdir('images/variants')[1])
+
+    def test_pending_recipe_is_processed(self):
+        data = self.client.get(self.url).data
+        self.assertIsNone(data['image_list'])
+        self.assertIsNone(data['image_detail'])
+        self.assertEqual(self.recipe().image_status,
+                         RecipeModel.IMAGE_PENDING)
+        call_command('runworker', '--once')
+        recipe = self.recipe()
+        self.assertEqual(recipe.image_status, RecipeModel.IMAGE_DONE)
+        data = self.client.get(self.url).data
+        for field, size in settings.RECIPE_IMAGE_SIZES.items():
+            file = getattr(recipe, field)
+            self.assertTrue(data[field].endswith(file.url))
+            with Image.open(file.path) as image:
+                self.assertEqual((image.format, image.size),
+                                 ('WEBP', (size, size)))
+        self.assertEqual(len(self.variants(recipe)), 2)
+
+    def test_image_change_requeues_recipe(self):
+        call_command('runworker', '--once')
+        old = self.recipe()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, self.body(),
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+        recipe = self.recipe()
+        self.assertEqual(recipe.image_status, RecipeModel.IMAGE_PENDING)
+        self.assertNotEqual(recipe.image.name, old.image.name)
+        self.assertIsNone(self.client.get(self.url).data['image_list'])
+        for field in ('image', *RecipeModel.IMAGE_VARIANTS):
+            self.assertFalse(default_storage.exists(
+                getattr(old, field).name))
+        call_command('runworker', '--once')
+        self.assertEqual(len(self.variants(recipe)), 2)
+
+    def test_delete_removes_variants(self):
+        call_command('runworker', '--once')
+        recipe = self.recipe()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertEqual(self.variants(recipe), set())
+        self.assertFalse(default_storage.exists(recipe.image.name))
+
+    def test_outdated_variants_are_discarded(self):
+        worker = RunWorker()
+        recipe = worker.claim_recipe_image()
+        # Изображение заменили, пока воркер строил копии.
+        RecipeModel.objects.filter(pk=recipe.pk).update(
+            image='images/other.png')
+        worker.process_recipe_image(recipe)
+        self.assertEqual(self.variants(recipe), set())
+        self.assertEqual(self.recipe().image_status,
+                         RecipeModel.IMAGE_PROCESSING)
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """Выдача, ожидание и вытеснение соединений пула."""
+
+    def test_acquire_waits_for_timeout(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        connection, reused = pool.acquire(FakeConnection)
+        self.assertFalse(reused)
+        self.assertEqual(pool.acquire(FakeConnection), (None, False))
+        pool.release(connection)
+        self.assertEqual(pool.acquire(FakeConnection), (connection, True))
+
+    def test_stale_connections_are_evicted(self):
+        pool = ConnectionPool(max_size=3, max_idle=10)
+        with mock.patch('foodgram_backend.db.pool.time.monotonic') as now:
+            now.return_value = 0
+            old, fresh = (pool.acquire(FakeConnection)[0] for _ in range(2))
+            pool.release(old)
+            now.return_value = 8
+            pool.release(fresh)
+            # Свежее соединение выдаётся первым, а простаивающее дольше
+            # MAX_IDLE закрывается, хотя лежит в начале очереди.
+            now.return_value = 12
+            self.assertEqual(pool.acquire(FakeConnection), (fresh, True))
+            self.assertTrue(old.closed)
+            self.assertEqual(pool.size, 1)
+            self.assertFalse(pool.idle)
+
+
+class PooledConnectionTest(TransactionTestCase):
+    """Соединения Django через пул: ожидание, откат, проверка и закрытие
+    внутри atomic."""
+
+    def wrapper(self, **pool):
+        alias = f'pool-{self._testMethodName}'
+        settings_dict = {**connection.settings_dict,
+                         'CONN_HEALTH_CHECKS': True,
+                         'POOL': {'MAX_SIZE': 1, 'TIMEOUT': 0.05, **pool}}
+        wrapper = connections['default'].__class__(settings_dict, alias)
+        self.addCleanup(wrapper.close)
+        self.addCleanup(POOLS.clear)
+        return wrapper
+
+    def test_timeout_raises_operational_error(self):
+        first, second = self.wrapper(), self.wrapper()
+        first.ensure_connection()
+        with self.assertRaises(OperationalError):
+            second.ensure_connection()
+        raw = first.connection
+        first.close()
+        second.ensure_connection()
+        self.assertIs(second.connection, raw)
+
+    def test_release_rolls_back(self):
+        first, second = self.wrapper(), self.wrapper()
+        first.set_autocommit(False)
+        with first.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {TagModel._meta.db_table} (name, color, slug) '
+                f"VALUES ('Пул', '#000000', 'pool')")
+        first.close()
+        second.ensure_connection()
+        self.assertFalse(TagModel.objects.filter(slug='pool').exists())
+
+    def test_closed_in_atomic_is_discarded(self):
+        wrapper = self.wrapper()
+        connections[wrapper.alias] = wrapper
+        self.addCleanup(delattr, connections._connections, wrapper.alias)
+        with transaction.atomic(using=wrapper.alias):
+            raw = wrapper.connection
+            wrapper.close()
+        pool = wrapper.pool
+        self.assertEqual((pool.size, len(pool.idle)), (0, 0))
+        with self.assertRaises(wrapper.Database.ProgrammingError):
+            raw.execute('SELECT 1')
+
+    def test_unusable_connection_is_replaced(self):
+        first, second = self.wrapper(), self.wrapper()
+        first.ensure_connection()
+        raw = first.connection
+        first.close()
+        raw.close()
+        second.ensure_connection()
+        self.assertIsNot(second.connection, raw)
+        self.assertEqual(second.pool.size, 1)
+
+
+class RecipeSearchTest(TempMediaMixin, TestCase):
+    """Полнотекстовый поиск: порядок по полям, префиксы и обновление
+    индекса (на SQLite - таблица FTS5)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = TagModel.objects.create(name='Тег', color='#000000',
+                                          slug='tag')
+        beet, cls.flour = (
+            IngredientModel.objects.create(name=name, measurement_unit='г')
+            for name in ('свекла', 'мука'))
+        cls.by_name = cls.create(cls.author, 'Свекла печёная', 'Запечь.',
+                                 [cls.flour])
+        cls.by_ingredient = cls.create(cls.author, 'Салат', 'Нарезать.',
+                                       [beet])
+        cls.by_text = cls.create(cls.author, 'Суп', 'Добавить свеклу.',
+                                 [cls.flour])
+
+    @staticmethod
+    def create(author, name, text, ingredients):
+        recipe = RecipeModel.objects.create(
+            author=author, name=name, text=text, image='images/test.png',
+            cooking_time=10)
+        RecipeIngredients.objects.bulk_create(
+            RecipeIngredients(recipe=recipe, ingredients=ingredient,
+                              amount=1) for ingredient in ingredients)
+        update_search_index([recipe.pk])
+        return recipe
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/',
+                                   {'search': query, 'limit': 50})
+        return [recipe['id'] for recipe in response.data['results']]
+
+    @skipUnless(connection.vendor == 'sqlite', 'префиксы и bm25 - FTS5')
+    def test_rank_and_prefix(self):
+        # Название весомее ингредиентов, ингредиенты - описания.
+        self.assertEqual(self.search('СВЕКЛ'), [
+            self.by_name.pk, self.by_ingredient.pk, self.by_text.pk])
+        # Без стемминга «свекла» не совпадает со «свеклу».
+        self.assertEqual(self.search('свекла'),
+                         [self.by_name.pk, self.by_ingredient.pk])
+        self.assertEqual(self.search('свек салат'), [self.by_ingredient.pk])
+        self.assertEqual(self.search('морковь'), [])
+
+    def test_index_follows_api_changes(self):
+        response = self.client.post('/api/recipes/', {
+            'name': 'Шарлотка', 'text': 'Испечь.', 'cooking_time': 40,
+            'tags': [self.tag.pk], 'image': image_data_uri(),
+            'ingredients': [{'id': self.flour.pk, 'amount': 200}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        pk = response.data['id']
+        self.assertEqual(self.search('шарлот'), [pk])
+        response = self.client.patch(f'/api/recipes/{pk}/', {
+            'name': 'Кекс', 'text': 'Испечь.', 'cooking_time': 40,
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.flour.pk, 'amount': 200}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.search('шарлотка'), [])
+        self.assertEqual(self.search('кекс'), [pk])
+        self.assertEqual(self.client.delete(f'/api/recipes/{pk}/')
+                         .status_code, 204)
+        self.assertEqual(self.search('кекс'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'таблица FTS5 - только SQLite')
+    def test_searchrebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+        self.assertEqual(self.search('свекл'), [])
+        with redirect_stdout(io.StringIO()):
+            call_command('searchrebuild')
+        self.assertEqual(len(self.search('свекл')), 3)
+
+
+class SearchMigrationTest(TransactionTestCase):
+    """Миграция 0011 откатывается и заново строит индекс по рецептам."""
+
+    def test_migrate_back_and_forward(self):
+        recipe, = create_recipes(create_user('author'), 1)
+        with redirect_stdout(io.StringIO()):
+            call_command('migrate', 'recipes', '0010', verbosity=0)
+            self.assertNotIn(SQLITE_TABLE,
+                             connection.introspection.table_names())
+            call_command('migrate', 'recipes', verbosity=0)
+        self.assertEqual(search_recipes(RecipeModel.objects.all(),
+                                        'рецепт').get(), recipe)
+
+
+class AsyncURLConf:
+    """api/ с маршрутами api.async_views, как при ASYNC_VIEWS=True."""
+
+    urlpatterns = [path('api/', include(async_urlpatterns() + router.urls))]
+
+
+@override_settings(ASYNC_VIEWS=True)
+class AsyncViewsTest(TempMediaMixin, TransactionTestCase):
+    """Асинхронные представления отвечают так же, как вьюсеты.
+
+    TransactionTestCase: PDF дописывается в потоках пула со своими
+    соединениями с базой.
+    """
+
+    def setUp(self):
+        self.user = create_user('viewer')
+        token = Token.objects.create(user=self.user)
+        tags = [TagModel.objects.create(name=f'Тег {number}',
+                                        color=f'#00000{number}',
+                                        slug=f'tag{number}')
+                for number in range(2)]
+        ingredients = [IngredientModel.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(3)]
+        self.recipes = create_recipes(create_user('author'), 8, tags,
+                                      ingredients)
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipes[0])
+        ShoppingCartRecipes.objects.create(user=self.user,
+                                           recipe=self.recipes[1])
+        self.headers = {'Authorization': f'Token {token.key}'}
+        self.sync_client = Client(headers=self.headers)
+        self.async_client = AsyncClient()
+
+    async def get_async(self, url, **headers):
+        # AsyncClient в Django 4.2 не передаёт заголовки конструктора.
+        with override_settings(ROOT_URLCONF=AsyncURLConf):
+            return await self.async_client.get(
+                url, headers={**self.headers, **headers})
+
+    async def test_responses_match_sync_views(self):
+        recipe = self.recipes[0].pk
+        for url in ('/api/tags/', '/api/tags/1/', '/api/ingredients/',
+                    '/api/ingredients/?name=ингр', '/api/recipes/',
+                    '/api/recipes/?limit=3&page=2',
+                    '/api/recipes/?tags=tag0&is_favorited=1',
+                    f'/api/recipes/{recipe}/', '/api/recipes/999/',
+                    '/api/recipes/?page=99&limit=6'):
+            with self.subTest(url=url):
+                response = await self.get_async(url)
+                expected = await sync_to_async(self.sync_client.get)(url)
+                self.assertEqual(response.status_code,
+                                 expected.status_code)
+                self.assertEqual(response.json(), expected.json())
+
+    async def test_not_modified(self):
+        for url in ('/api/tags/', '/api/ingredients/'):
+            with self.subTest(url=url):
+                response = await self.get_async(url)
+                self.assertEqual(response.status_code, 200)
+                response = await self.get_async(
+                    url, **{'If-None-Match': response['ETag']})
+                self.assertEqual(response.status_code, 304)
+
+    async def test_pdf_is_rendered_in_render_pool(self):
+        threads = set()
+        page = PDFDocument._page
+
+        def record_page(document, lines):
+            threads.add(threading.current_thread().name)
+            return page(document, lines)
+
+        with mock.patch.object(PDFDocument, '_page', record_page):
+            response = await self.get_async(
+                '/api/recipes/download_shopping_cart/?format=pdf')
+            content = b''.join([chunk async for chunk
+                                in response.streaming_content])
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith('render') for name in threads))
+        export = await ShoppingListExport.objects.aget(user=self.user)
+        self.assertEqual(export.status, ShoppingListExport.DONE)
+
+
+class Base64ImageFieldTest(SimpleTestCase):
+    """Проверки изображения в data URI и память при его декодировании."""
+
+    def assert_rejected(self, data, code):
+        with self.assertRaises(ValidationError) as context:
+            Base64ImageField().run_validation(data)
+        self.assertEqual(context.exception.detail[0].code, code)
+
+    def test_valid_image(self):
+        data = image_data_uri(side=8)
+        file = Base64ImageField().run_validation(data)
+        self.assertEqual((file.name, file.content_type),
+                         ('img.png', 'image/png'))
+        self.assertEqual(file.read(),
+                         base64.b64decode(data.split(',', 1)[1]))
+        self.assertEqual(file.size, file.tell())
+
+    def test_not_an_image(self):
+        data = ('data:image/png;base64,'
+                + base64.b64encode(b'<svg></svg>' * 10).decode())
+        self.assert_rejected(data, 'invalid_image')
+
+    def test_truncated_base64(self):
+        data = image_data_uri(side=64)
+        # Обрыв посреди группы base64 и обрыв самого изображения.
+        self.assert_rejected(data[:-3], 'invalid_image')
+        self.assert_rejected(data[:len(data) // 8 * 4], 'invalid_image')
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=64)
+    def test_too_large(self):
+        self.assert_rejected(image_data_uri(side=64), 'too_large')
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100)
+    def test_too_many_pixels(self):
+        self.assert_rejected(image_data_uri(side=11), 'too_many_pixels')
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=256 * 1024)
+    def test_memory_is_bounded_by_spool_size(self):
+        rng = random.Random(0)
+        side = 600
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (side, side),
+                        rng.randbytes(side * side * 3)).save(buffer, 'PNG')
+        size = buffer.tell()
+        data = ('data:image/png;base64,'
+                + base64.b64encode(buffer.getvalue()).decode())
+        del buffer
+        tracemalloc.start()
+        try:
+            Base64ImageField().run_validation(data).close()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # Целиком декодированный файл (около 1 МБ) в памяти не держится.
+        self.assertLess(peak, size // 2)
@@ -1,10 +1,45 @@
+from django.conf import settings
+from django.urls import path
 from rest_framework import routers
 
+from .async_views import async_view
 from .views import IngredientViewSet, RecipeViewSet, TagViewSet
 
 router = routers.DefaultRouter()
 router.register(r'tags', TagViewSet)
 router.register(r'ingredients', IngredientViewSet)
 router.register(r'recipes', RecipeViewSet)
-urlpatterns = []
+
+
+def async_urlpatterns():
+    """Маршруты api.async_views: те же пути и имена, что у роутера,
+    подключаются перед ним."""
+    urlpatterns = []
+    for prefix, viewset, list_actions, detail_actions in (
+        ('tags', TagViewSet, {'get': 'list'}, {'get': 'retrieve'}),
+        ('ingredients', IngredientViewSet, {'get': 'list'},
+         {'get': 'retrieve'}),
+        ('recipes', RecipeViewSet, {'get': 'list', 'post': 'create'},
+         {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+          'delete': 'destroy'}),
+    ):
+        urlpatterns += [
+            path(f'{prefix}/',
+                 async_view(viewset, list_actions, basename=prefix,
+                            detail=False, suffix='List'),
+                 name=f'{prefix}-list'),
+            path(f'{prefix}/<int:pk>/',
+                 async_view(viewset, detail_actions, basename=prefix,
+                            detail=True, suffix='Instance'),
+                 name=f'{prefix}-detail'),
+        ]
+    urlpatterns.append(path(
+        'recipes/download_shopping_cart/',
+        async_view(RecipeViewSet, {'get': 'download_shopping_cart'},
+                   basename='recipes', detail=False),
+        name='recipes-download_shopping_cart'))
+    return urlpatterns
+
+
+urlpatterns = async_urlpatterns() if settings.ASYNC_VIEWS else []
 urlpatterns += router.urls
@@ -1,16 +1,47 @@
-import platform
-from io import BytesIO
-
-import pdfkit
-
-
-def create_pdf(html_page):
-    if platform.system() == 'Windows':
-        path_wkhtmltopdf = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'
-        config = pdfkit.configuration(wkhtmltopdf=path_wkhtmltopdf)
-    else:
-        config = None
-    html = html_page.content.decode()
-    pdf = pdfkit.from_string(html, configuration=config,
-                             options={"enable-local-file-access": ""})
-    return BytesIO(pdf)
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import F
+
+from recipes.models import ShoppingCartIngredient
+
+from .renderers import ShoppingListPDFRenderer
+
+
+def get_cart_ingredients(user):
+    """Суммарное количество ингредиентов в списке покупок пользователя."""
+    return list(ShoppingCartIngredient.objects.filter(user=user).values(
+        'amount',
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+        ).order_by('ingredient__name'))
+
+
+def get_cart_hash(ingredients):
+    """Ключ кеша PDF: одинаковый состав списка - одинаковый хеш."""
+    data = json.dumps(ingredients, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def render_shopping_list(ingredients):
+    return ContentFile(ShoppingListPDFRenderer().render(ingredients))
+
+
+def parse_ids(data):
+    """Список id из {"ids": [...]} без повторов или None, если он некорректен.
+    """
+    ids = data.get('ids') if hasattr(data, 'get') else data
+    if (not isinstance(ids, list) or not ids
+            or len(ids) > settings.RECIPE_BULK_LIMIT):
+        return None
+    result = []
+    for pk in ids:
+        if isinstance(pk, str) and pk.isdigit():
+            pk = int(pk)
+        if isinstance(pk, bool) or not isinstance(pk, int) or pk < 1:
+            return None
+        if pk not in result:
+            result.append(pk)
+    return result
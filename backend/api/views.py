@@ -1,8 +1,12 @@
+import tempfile
 from http import HTTPStatus
 
-from django.db.models import Sum
-from django.http import FileResponse
-from django.shortcuts import get_object_or_404, render
+from django.conf import settings
+from django.core.files import File
+from django.db.models import Exists, OuterRef, Prefetch
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 from rest_framework.decorators import action
@@ -10,124 +14,299 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from recipes.models import (FavoriteRecipe, IngredientModel, RecipeIngredients,
-                            RecipeModel, ShoppingCartRecipes, TagModel)
+                            RecipeModel, ShoppingCartRecipes,
+                            ShoppingListExport, TagModel, add_recipes,
+                            delete_old_exports, get_feed_filter,
+                            remove_recipes)
+from users.models import Follow, User
 
+from .caching import VersionedCacheMixin
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import PageLimitPagination
+from .pagination import RecipeCursorPagination, RecipePagination
 from .permissions import AdminOrOwnerOrReadOnly
+from .profiling import ProfiledSerializerMixin
+from .renderers import (ShoppingListCSVRenderer, ShoppingListPDFRenderer,
+                        ShoppingListTextRenderer)
 from .serializers import (FavoriteRecipeSerializer, IngredientSerializer,
                           PostRecipeSerializer, RecipeSerializer,
                           TagSerializer)
-from .utils import create_pdf
+from .utils import get_cart_hash, get_cart_ingredients, parse_ids
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ProfiledSerializerMixin, VersionedCacheMixin,
+                 viewsets.ReadOnlyModelViewSet):
 
     queryset = TagModel.objects.all()
     serializer_class = TagSerializer
+    query_budget = 3
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ProfiledSerializerMixin, VersionedCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
 
     queryset = IngredientModel.objects.all()
     serializer_class = IngredientSerializer
+    query_budget = 4
     # filterset_fields = ('^name',)
     filter_backends = (DjangoFilterBackend, )
     filterset_class = IngredientFilter
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ProfiledSerializerMixin, viewsets.ModelViewSet):
 
     queryset = RecipeModel.objects.all()
     permission_classes = (AdminOrOwnerOrReadOnly, )
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
-    pagination_class = PageLimitPagination
+    pagination_class = RecipePagination
+    query_budget = {
+        'list': 6,
+        'retrieve': 5,
+        'feed': 5,
+        'download_shopping_cart': 8,
+    }
 
-    def perform_destroy(self, instance):
-        if instance.image is not None:
-            instance.image.delete()
-        return super().perform_destroy(instance)
+    def get_queryset(self):
+        queryset = super().get_queryset().prefetch_related(
+            'tags',
+            Prefetch('recipe_ingredients',
+                     queryset=RecipeIngredients.objects.select_related(
+                         'ingredients')),
+        )
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.select_related('author')
+        # Флаги текущего пользователя считаются одним запросом на страницу,
+        # сериализаторы читают готовые аннотации.
+        authors = User.objects.annotate(is_subscribed=Exists(
+            Follow.objects.filter(follower=user, author=OuterRef('pk'))))
+        return queryset.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCartRecipes.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        ).prefetch_related(Prefetch('author', queryset=authors))
 
     def get_serializer_class(self):
         if self.request.method in ('POST', 'PUT', 'PATCH'):
             return PostRecipeSerializer
         return RecipeSerializer
 
-    def filter_queryset(self, queryset):
-        print(queryset)
-        return super().filter_queryset(queryset)
+    @action(detail=False, methods=['GET'],
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Лента рецептов авторов из подписок, всегда с курсором."""
+        queryset = self.get_queryset().filter(
+            get_feed_filter(request.user))
+        paginator = RecipeCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['POST', 'DELETE'],
             permission_classes=(IsAuthenticated,))
-    def favorite(self, context, pk=None):
-        recipe = get_object_or_404(RecipeModel, pk=pk)
-        in_favorite = FavoriteRecipe.objects.filter(user=context.user,
-                                                    recipe=recipe)
-        if context.method == 'POST':
-            if in_favorite.exists():
-                return Response({'errors': 'рецепт уже в любимых'},
-                                status=HTTPStatus.BAD_REQUEST)
-            FavoriteRecipe.objects.create(user=context.user,
-                                          recipe=recipe)
-            serializer = FavoriteRecipeSerializer(
-                recipe,
-                context={'request': context}
-                )
-            return Response(data=serializer.data, status=HTTPStatus.CREATED)
-        if not in_favorite.exists():
-            return Response(
-                {'errors': 'подписки на рецепт не существует'},
-                status=HTTPStatus.BAD_REQUEST
-                )
-        in_favorite.delete()
-        return Response(status=HTTPStatus.NO_CONTENT)
+    def favorite(self, request, pk=None):
+        if request.method == 'POST':
+            return self._add_relation(FavoriteRecipe, request, pk,
+                                      'рецепт уже в любимых')
+        return self._remove_relation(FavoriteRecipe, request, pk,
+                                     'подписки на рецепт не существует')
 
     @action(detail=True, methods=['POST', 'DELETE'],
             permission_classes=(IsAuthenticated,))
-    def shopping_cart(self, context, pk=None):
-        recipe = get_object_or_404(RecipeModel, pk=pk)
-        in_cart = ShoppingCartRecipes.objects.filter(user=context.user,
-                                                     recipe=recipe)
-        if context.method == 'POST':
-            if in_cart.exists():
-                return Response({'errors': 'рецепт уже в списках покупок'},
-                                status=HTTPStatus.BAD_REQUEST)
-            ShoppingCartRecipes.objects.create(user=context.user,
-                                               recipe=recipe)
-            serializer = FavoriteRecipeSerializer(
-                recipe,
-                context={'request': context}
-                )
-            return Response(data=serializer.data, status=HTTPStatus.CREATED)
-        if not in_cart.exists():
+    def shopping_cart(self, request, pk=None):
+        if request.method == 'POST':
+            return self._add_relation(ShoppingCartRecipes, request, pk,
+                                      'рецепт уже в списках покупок')
+        return self._remove_relation(ShoppingCartRecipes, request, pk,
+                                     'рецепт не в списке покупок')
+
+    @action(detail=False, methods=['POST', 'DELETE'],
+            permission_classes=(IsAuthenticated,),
+            url_path='favorite', url_name='favorite_bulk')
+    def favorite_bulk(self, request):
+        return self._bulk_relation(FavoriteRecipe, request,
+                                   'рецепт уже в любимых',
+                                   'подписки на рецепт не существует')
+
+    @action(detail=False, methods=['POST', 'DELETE'],
+            permission_classes=(IsAuthenticated,),
+            url_path='shopping_cart', url_name='shopping_cart_bulk')
+    def shopping_cart_bulk(self, request):
+        return self._bulk_relation(ShoppingCartRecipes, request,
+                                   'рецепт уже в списках покупок',
+                                   'рецепт не в списке покупок')
+
+    @staticmethod
+    def _bulk_relation(model, request, add_error, remove_error):
+        """Пакетная версия favorite/shopping_cart: {"ids": [1, 2, ...]}.
+
+        Ответ - результат по каждому id в том же порядке, со статусом,
+        который вернул бы одиночный запрос.
+        """
+        ids = parse_ids(request.data)
+        if ids is None:
             return Response(
-                {'errors': 'рецепт не в списке покупок'},
-                status=HTTPStatus.BAD_REQUEST
-                )
-        in_cart.delete()
+                {'errors': 'Передайте в ids список из не более '
+                           f'{settings.RECIPE_BULK_LIMIT} id рецептов'},
+                status=HTTPStatus.BAD_REQUEST)
+        recipes = RecipeModel.objects.in_bulk(ids)
+        if request.method == 'POST':
+            changed = add_recipes(model, request.user, list(recipes))
+            status, error = HTTPStatus.CREATED, add_error
+        else:
+            changed = remove_recipes(model, request.user, list(recipes))
+            status, error = HTTPStatus.NO_CONTENT, remove_error
+        changed = set(changed)
+        results = []
+        for pk in ids:
+            if pk not in recipes:
+                results.append({'id': pk, 'status': HTTPStatus.NOT_FOUND,
+                                'errors': 'Страница не найдена.'})
+            elif pk not in changed:
+                results.append({'id': pk, 'status': HTTPStatus.BAD_REQUEST,
+                                'errors': error})
+            elif status == HTTPStatus.CREATED:
+                results.append({
+                    'id': pk, 'status': status,
+                    'recipe': FavoriteRecipeSerializer(
+                        recipes[pk], context={'request': request}).data})
+            else:
+                results.append({'id': pk, 'status': status})
+        return Response({'results': results})
+
+    @staticmethod
+    def _add_relation(model, request, pk, error):
+        """Одиночная версия add_recipes: 201, если строка добавлена."""
+        recipe = get_object_or_404(RecipeModel, pk=pk)
+        if not add_recipes(model, request.user, [recipe.pk]):
+            return Response({'errors': error},
+                            status=HTTPStatus.BAD_REQUEST)
+        serializer = FavoriteRecipeSerializer(recipe,
+                                              context={'request': request})
+        return Response(data=serializer.data, status=HTTPStatus.CREATED)
+
+    @staticmethod
+    def _remove_relation(model, request, pk, error):
+        """Одиночная версия remove_recipes: 204, если строка удалена."""
+        recipe = get_object_or_404(RecipeModel, pk=pk)
+        if not remove_recipes(model, request.user, [recipe.pk]):
+            return Response({'errors': error},
+                            status=HTTPStatus.BAD_REQUEST)
         return Response(status=HTTPStatus.NO_CONTENT)
 
     @action(detail=False, methods=['GET'],
             permission_classes=(IsAuthenticated,),
+            renderer_classes=(ShoppingListPDFRenderer,
+                              ShoppingListTextRenderer,
+                              ShoppingListCSVRenderer),
             url_name='download_shopping_cart',
             url_path='download_shopping_cart')
-    def download_shopping_cart(self, context, pk=None):
-        template = 'shopping_list.html'
-        ingredients = RecipeIngredients.objects.values(
-            'ingredients__name',
-            'ingredients__measurement_unit'
-            ).annotate(
-                sum_amount=Sum('amount')).filter(
-                    recipe__recipes_in_shopping_card__user=context.user
-                    )
-        context = {
-            'ingredients': ingredients
-        }
-        page = render(request=self.request,
-                      template_name=template,
-                      context=context)
-        file = create_pdf(page)
-        return FileResponse(file,
+    def download_shopping_cart(self, request, pk=None):
+        renderer = request.accepted_renderer
+        ingredients = get_cart_ingredients(request.user)
+        if renderer.format == ShoppingListPDFRenderer.format:
+            export = self._get_export(request.user, ingredients)
+            if export.status == ShoppingListExport.DONE:
+                return self._export_response(export)
+            if request.query_params.get('async') in ('1', 'true'):
+                if export.status == ShoppingListExport.FAILED:
+                    ShoppingListExport.objects.filter(
+                        pk=export.pk, status=ShoppingListExport.FAILED,
+                    ).update(status=ShoppingListExport.PENDING)
+                    export.status = ShoppingListExport.PENDING
+                return JsonResponse({'id': export.id,
+                                     'status': export.status},
+                                    status=HTTPStatus.ACCEPTED)
+            return self._render_export(export)
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        response = StreamingHttpResponse(renderer.stream(ingredients),
+                                         content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"')
+        return response
+
+    @action(detail=False, methods=['GET'],
+            permission_classes=(IsAuthenticated,),
+            url_name='shopping_cart_export',
+            url_path=r'download_shopping_cart/(?P<export_id>\d+)')
+    def shopping_cart_export(self, request, export_id=None):
+        export = get_object_or_404(ShoppingListExport, pk=export_id,
+                                   user=request.user)
+        if export.status == ShoppingListExport.DONE:
+            return self._export_response(export)
+        if export.status == ShoppingListExport.FAILED:
+            return Response(
+                {'errors': 'не удалось сформировать список покупок'},
+                status=HTTPStatus.INTERNAL_SERVER_ERROR
+                )
+        return Response({'id': export.id, 'status': export.status},
+                        status=HTTPStatus.ACCEPTED)
+
+    @staticmethod
+    def _get_export(user, ingredients):
+        """Список покупок под текущую корзину, при новой корзине -
+        новая задача в очереди, прежние списки пользователя удаляются."""
+        cart_hash = get_cart_hash(ingredients)
+        # get_or_create перечитывает строку, если её одновременно создал
+        # параллельный запрос.
+        export, created = ShoppingListExport.objects.get_or_create(
+            user=user, cart_hash=cart_hash,
+            defaults={'ingredients': ingredients})
+        if created:
+            delete_old_exports(user, export)
+        return export
+
+    @classmethod
+    def _render_export(cls, export):
+        """Отдаёт PDF по страницам по мере формирования и одновременно
+        пишет его во временный файл, после последней части сохраняемый
+        для следующих загрузок.
+
+        Задачу, которую уже формирует воркер, запрос только отдаёт.
+        """
+        started = timezone.now()
+        claimed = ShoppingListExport.objects.filter(
+            pk=export.pk, status__in=(ShoppingListExport.PENDING,
+                                      ShoppingListExport.FAILED),
+        ).update(status=ShoppingListExport.PROCESSING, started=started)
+        chunks = ShoppingListPDFRenderer().stream(export.ingredients)
+        if claimed:
+            chunks = cls._tee_export(export, started, chunks)
+        response = StreamingHttpResponse(chunks,
+                                         content_type='application/pdf')
+        response['Content-Disposition'] = (
+            'attachment; filename="shopping_list.pdf"')
+        return response
+
+    @staticmethod
+    def _tee_export(export, started, chunks):
+        processing = ShoppingListExport.objects.filter(
+            pk=export.pk, status=ShoppingListExport.PROCESSING,
+            started=started)
+        with tempfile.TemporaryFile() as buffer:
+            try:
+                for chunk in chunks:
+                    buffer.write(chunk)
+                    yield chunk
+            except GeneratorExit:
+                # Клиент не дочитал ответ - файл сформирует воркер.
+                processing.update(status=ShoppingListExport.PENDING)
+                raise
+            except Exception:
+                processing.update(status=ShoppingListExport.FAILED)
+                raise
+            buffer.seek(0)
+            export.file.save('shopping_list.pdf', File(buffer), save=False)
+        if not processing.update(file=export.file.name,
+                                 status=ShoppingListExport.DONE,
+                                 finished=timezone.now()):
+            export.file.delete(save=False)
+
+    @staticmethod
+    def _export_response(export):
+        return FileResponse(export.file.open('rb'),
                             filename='shopping_list.pdf',
                             content_type='application/pdf')
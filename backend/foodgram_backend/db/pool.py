@@ -0,0 +1,191 @@
+"""Пул соединений с базой и учёт времени на установку соединения.
+
+Django 4.2 открывает соединение в каждом потоке заново (CONN_MAX_AGE=0)
+или держит его за потоком (CONN_MAX_AGE>0). При нескольких потоках
+в процессе (gthread, ASGI) соединения удобнее брать из общего пула:
+ключ POOL в настройках базы, например {'MAX_SIZE': 10, 'TIMEOUT': 10,
+'MAX_IDLE': 300}. Соединение возвращается в пул вместо закрытия,
+при повторной выдаче проверяется, если включён CONN_HEALTH_CHECKS.
+
+Пул не зависит от драйвера и работает и с PostgreSQL, и с SQLite.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, max_size, timeout=10, max_idle=300):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        # Свободные соединения со временем возврата в пул.
+        self.idle = deque()
+        self.size = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, connect):
+        """(соединение, взято ли из пула); connect открывает новое.
+
+        Если открыто MAX_SIZE соединений и свободных нет, ждёт TIMEOUT
+        секунд и возвращает (None, False).
+        """
+        deadline = time.monotonic() + self.timeout
+        stale = []
+        try:
+            with self.condition:
+                while True:
+                    stale += self.evict_stale()
+                    if self.idle:
+                        # Последнее возвращённое: реже простаивающие
+                        # соединения старятся и закрываются.
+                        return self.idle.pop()[0], True
+                    if self.size < self.max_size:
+                        self.size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None, False
+                    self.condition.wait(remaining)
+        finally:
+            for connection in stale:
+                close_quietly(connection)
+        try:
+            return connect(), False
+        except Exception:
+            self.forget()
+            raise
+
+    def evict_stale(self):
+        """Убирает из пула соединения, простаивающие дольше MAX_IDLE,
+        и возвращает их для закрытия вне блокировки.
+
+        Соединения берутся с конца очереди, поэтому самые старые -
+        в начале: проверяются оттуда, пока не встретится свежее.
+        """
+        stale = []
+        now = time.monotonic()
+        while self.idle and now - self.idle[0][1] > self.max_idle:
+            stale.append(self.idle.popleft()[0])
+            self.size -= 1
+        return stale
+
+    def release(self, connection):
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            stale = self.evict_stale()
+            # Место закрытых соединений тоже могут занять ожидающие.
+            self.condition.notify(len(stale) + 1)
+        for old in stale:
+            close_quietly(old)
+
+    def discard(self, connection):
+        close_quietly(connection)
+        self.forget()
+
+    def forget(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def get_pool(alias, options):
+    # Пул на процесс: после fork соединения родителя не используются.
+    key = (alias, os.getpid())
+    with POOLS_LOCK:
+        if key not in POOLS:
+            POOLS[key] = ConnectionPool(
+                max_size=options['MAX_SIZE'],
+                timeout=options.get('TIMEOUT', 10),
+                max_idle=options.get('MAX_IDLE', 300))
+        return POOLS[key]
+
+
+class PooledDatabaseWrapperMixin:
+    """Пул соединений по ключу POOL и счётчики установки соединений.
+
+    connect_count и connect_time копятся за всё время жизни обёртки
+    соединения, SQLProfilingMiddleware показывает их прирост за запрос.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connect_count = 0
+        self.connect_time = 0.0
+
+    @property
+    def pool(self):
+        options = self.settings_dict.get('POOL')
+        if not options or not options.get('MAX_SIZE'):
+            return None
+        return get_pool(self.alias, options)
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            self.connect_count += 1
+            self.connect_time += time.perf_counter() - started
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        while True:
+            connection, reused = pool.acquire(
+                lambda: super(PooledDatabaseWrapperMixin,
+                              self).get_new_connection(conn_params))
+            if connection is None:
+                raise self.Database.OperationalError(
+                    f'Нет свободных соединений в пуле {self.alias} '
+                    f'за {pool.timeout} с.')
+            if (not reused or not self.settings_dict['CONN_HEALTH_CHECKS']
+                    or self.is_raw_usable(connection)):
+                return connection
+            pool.discard(connection)
+
+    def is_raw_usable(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except self.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            super()._close()
+            return
+        connection = self.connection
+        if self.in_atomic_block:
+            # Внутри atomic Django оставляет ссылку на закрытое
+            # соединение, вернуть его в пул нельзя.
+            pool.discard(connection)
+            return
+        # Незавершённая транзакция не должна достаться следующему
+        # владельцу соединения.
+        try:
+            connection.rollback()
+        except self.Database.Error:
+            pool.discard(connection)
+            return
+        if getattr(connection, 'closed', False):
+            pool.discard(connection)
+        else:
+            pool.release(connection)
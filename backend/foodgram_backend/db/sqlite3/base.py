@@ -0,0 +1,24 @@
+from django.db.backends.sqlite3 import base
+
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """SQLite с OPTIONS['transaction_mode'], как в Django 5.1.
+
+    При 'IMMEDIATE' транзакция сразу берёт блокировку на запись: пишущие
+    транзакции ждут друг друга (timeout), а не падают с
+    «database is locked», когда обе успели прочитать до записи.
+    """
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('transaction_mode', None)
+        return params
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f'BEGIN {mode}')
@@ -60,6 +60,7 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'users.User'
 
 MIDDLEWARE = [
+    'api.profiling.SQLProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -89,21 +90,29 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram_backend.wsgi.application'
+ASGI_APPLICATION = 'foodgram_backend.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
-if DEBUG:
+# DB_ENGINE: sqlite3 или postgresql, по умолчанию sqlite3 при DEBUG
+DB_ENGINE = os.getenv('DB_ENGINE', default='sqlite3' if DEBUG
+                      else 'postgresql')
+if DB_ENGINE == 'sqlite3':
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.sqlite3',
+            'ENGINE': 'foodgram_backend.db.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+            # Тестовая база в файле, а не в памяти: тесты с потоками
+            # работают с ней через отдельные соединения.
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
 else:
     DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "foodgram_backend.db.postgresql",
         #'ENGINE': 'django.db.backends.postgresql_psycopg2', # или psycopg2
         'NAME': os.getenv('DB_NAME', default='postgres'),
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
@@ -113,19 +122,127 @@ else:
         'PORT': os.getenv('DB_PORT', default='5432'),
     }
 }
-
+# Соединения с базой (foodgram_backend.db.pool): сколько секунд поток
+# держит соединение (0 - закрывать после запроса, пусто - бессрочно),
+# проверка соединения перед повторным использованием и пул на процесс
+# для многопоточных и асинхронных воркеров (DB_POOL_SIZE=0 - без пула)
+DB_CONN_MAX_AGE = os.getenv('DB_CONN_MAX_AGE', default='60')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', default=0))
+DATABASES['default'].update({
+    'CONN_MAX_AGE': int(DB_CONN_MAX_AGE) if DB_CONN_MAX_AGE else None,
+    'CONN_HEALTH_CHECKS': (
+        os.getenv('DB_CONN_HEALTH_CHECKS', default='True') == 'True'),
+    'POOL': {
+        'MAX_SIZE': DB_POOL_SIZE,
+        'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default=10)),
+        'MAX_IDLE': float(os.getenv('DB_POOL_MAX_IDLE', default=300)),
+    },
+})
+
+
+# Кеш токен -> пользователь (users.authentication): время жизни записи
+# в секундах (0 - без кеша) и число записей в памяти процесса. С общим
+# кешем (AUTH_TOKEN_CACHE_BACKEND, например
+# django.core.cache.backends.redis.RedisCache, и AUTH_TOKEN_CACHE_LOCATION)
+# удалённый токен перестаёт действовать сразу во всех процессах, с кешем
+# в памяти процесса - в остальных процессах не позже чем через TTL
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', default=5))
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_BACKEND = os.getenv(
+    'AUTH_TOKEN_CACHE_BACKEND',
+    default='django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'auth_tokens': {
+        'BACKEND': AUTH_TOKEN_CACHE_BACKEND,
+        'LOCATION': os.getenv('AUTH_TOKEN_CACHE_LOCATION',
+                              default='auth_tokens'),
+        'TIMEOUT': AUTH_TOKEN_CACHE_TTL,
+        'KEY_PREFIX': 'auth-token',
+    },
+}
+if AUTH_TOKEN_CACHE_BACKEND.endswith('LocMemCache'):
+    CACHES['auth_tokens']['OPTIONS'] = {
+        'MAX_ENTRIES': AUTH_TOKEN_CACHE_SIZE}
+# Basic-аутентификация считает хеш пароля на каждый запрос: её можно
+# отключить, а попытки входа ограничены по IP (пустое значение - без
+# ограничения)
+BASIC_AUTH_ENABLED = (
+    os.getenv('BASIC_AUTH_ENABLED', default='True') == 'True')
+BASIC_AUTH_RATE = os.getenv('BASIC_AUTH_RATE', default='20/min') or None
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        *(['users.authentication.ThrottledBasicAuthentication']
+          if BASIC_AUTH_ENABLED else []),
         # 'rest_framework.authentication.SessionAuthentication', -- Ломает CSRF политику
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
-    ]
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'basic_auth': BASIC_AUTH_RATE,
+    },
 }
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
+# Ограничения на изображение рецепта после декодирования base64
+IMAGE_UPLOAD_MAX_SIZE = 4 * 1024 * 1024
+IMAGE_UPLOAD_MAX_PIXELS = 25_000_000
+# Максимум подсказок в поиске ингредиентов по названию
+INGREDIENT_SEARCH_LIMIT = 50
+# Максимум id рецептов в одном пакетном запросе к избранному/покупкам
+RECIPE_BULK_LIMIT = 100
+# Лента подписок: рецепты авторов, у которых подписчиков больше
+# FEED_FANOUT_LIMIT, не раскладываются по лентам, а читаются при запросе.
+# При подписке в ленту добавляются FEED_BACKFILL_SIZE последних рецептов.
+FEED_FANOUT_LIMIT = 1000
+FEED_BACKFILL_SIZE = 100
+# Задачи runworker, которые обрабатываются дольше WORKER_JOB_TIMEOUT секунд
+# (воркер упал или был перезапущен), возвращаются в очередь
+WORKER_JOB_TIMEOUT = int(os.getenv('WORKER_JOB_TIMEOUT', default=600))
+# Размер (по длинной стороне) WebP-копий изображений рецептов
+RECIPE_IMAGE_SIZES = {
+    'image_list': 480,
+    'image_detail': 1200,
+}
+# Асинхронные представления чтения рецептов, тегов и ингредиентов
+# (api.async_views) - для запуска под ASGI; потоковые ответы (PDF списка
+# покупок) формируются в пуле из ASYNC_RENDER_WORKERS потоков
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', default='False') == 'True'
+ASYNC_RENDER_WORKERS = int(os.getenv('ASYNC_RENDER_WORKERS', default=4))
+# Профилирование SQL по запросам (api.profiling): заголовок Server-Timing
+# и лог api.profiling; в строгом режиме превышение query_budget вьюсета -
+# исключение (для тестов)
+SQL_PROFILING = os.getenv('SQL_PROFILING', default='False') == 'True'
+SQL_PROFILING_STRICT = (
+    os.getenv('SQL_PROFILING_STRICT', default='False') == 'True')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'api.management.commands.runworker': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+# TrueType-шрифт с кириллицей для PDF списка покупок
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+    )
 DJOSER = {
     'TOKEN_MODEL': 'rest_framework.authtoken.models.Token',
     'PERMISSIONS': {
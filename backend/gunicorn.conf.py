@@ -0,0 +1,21 @@
+"""Настройки gunicorn, читаются из текущего каталога при запуске.
+
+GUNICORN_THREADS > 1 включает многопоточные воркеры (gthread): тогда
+соединения с базой лучше брать из пула, DB_POOL_SIZE - не меньше
+числа потоков воркера.
+
+GUNICORN_ASGI=True запускает ASGI-приложение в воркерах uvicorn, обычно
+вместе с ASYNC_VIEWS=True (асинхронные представления api.async_views).
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', default='0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', default=2))
+threads = int(os.getenv('GUNICORN_THREADS', default=1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', default=30))
+
+if os.getenv('GUNICORN_ASGI', default='False') == 'True':
+    wsgi_app = 'foodgram_backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram_backend.wsgi:application'
@@ -1,7 +1,10 @@
 from django.contrib import admin
 
 from .models import (FavoriteRecipe, IngredientModel, RecipeIngredients,
-                     RecipeModel, ShoppingCartRecipes, TagModel)
+                     RecipeModel, ShoppingCartIngredient, ShoppingCartRecipes,
+                     ShoppingListExport, TableVersion, TagModel,
+                     get_recipe_amounts, update_carts_with_recipe)
+from .search import search_recipes, update_search_index
 
 
 class RecipeIngredientsInline(admin.TabularInline):
@@ -19,6 +22,17 @@ class RecipeModelAdmin(admin.ModelAdmin):
     filter_horizontal = ('tags',)
     inlines = (RecipeIngredientsInline,)
 
+    def save_related(self, request, form, formsets, change):
+        old_amounts = get_recipe_amounts(form.instance) if change else {}
+        super().save_related(request, form, formsets, change)
+        update_carts_with_recipe(form.instance, old_amounts)
+        update_search_index([form.instance.pk])
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_recipes(queryset, search_term), False
+
     @admin.display(description='Список ингредиентов')
     def ingredients_list(self, obj):
         return [x.ingredients for x in
@@ -29,9 +43,10 @@ class RecipeModelAdmin(admin.ModelAdmin):
     def tags_list(self, obj):
         return [x.name for x in obj.tags.all()]
 
-    @admin.display(description='В избранном, раз')
+    @admin.display(description='В избранном, раз',
+                   ordering='favorites_count')
     def favoriting_count(self, obj):
-        return obj.favoring_users.all().count()
+        return obj.favorites_count
 
 # Работает, только если зайти на страницу рецепта в админке
 # Не работает из под Admin Actions
@@ -64,9 +79,25 @@ class ShoppingCartRecipesAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
 
 
+class ShoppingCartIngredientAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+
+
+class ShoppingListExportAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'created', 'finished')
+    list_filter = ('status',)
+
+
+class TableVersionAdmin(admin.ModelAdmin):
+    list_display = ('table', 'version', 'updated')
+
+
 admin.site.register(RecipeModel, RecipeModelAdmin)
 admin.site.register(TagModel, TagModelAdmin)
 admin.site.register(IngredientModel, IngredientAdmin)
 admin.site.register(RecipeIngredients, RecipeIngredientsAdmin)
 admin.site.register(FavoriteRecipe, FavoriteRecipeAdmin)
 admin.site.register(ShoppingCartRecipes, ShoppingCartRecipesAdmin)
+admin.site.register(ShoppingCartIngredient, ShoppingCartIngredientAdmin)
+admin.site.register(ShoppingListExport, ShoppingListExportAdmin)
+admin.site.register(TableVersion, TableVersionAdmin)
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import FeedEntry, RecipeModel
+from users.models import Follow, User
+
+
+class Command(BaseCommand):
+    help = ('Заново раскладывает рецепты по лентам подписок: '
+            'по FEED_BACKFILL_SIZE последних рецептов каждого автора, '
+            'у которого не больше FEED_FANOUT_LIMIT подписчиков; рецепты '
+            'остальных авторов читаются при запросе ленты.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        follows = Follow.objects.order_by('author_id').values_list(
+            'author_id', 'follower_id')
+        created = 0
+        with transaction.atomic():
+            FeedEntry.objects.all().delete()
+            popular = User.objects.filter(
+                followers_count__gt=settings.FEED_FANOUT_LIMIT)
+            RecipeModel.objects.filter(author__in=popular).update(
+                fanned_out=False)
+            RecipeModel.objects.exclude(author__in=popular).update(
+                fanned_out=True)
+            batch = []
+            recipes = []
+            current = None
+            for author_id, follower_id in follows.iterator():
+                if author_id != current:
+                    current = author_id
+                    recipes = list(RecipeModel.objects.filter(
+                        author_id=author_id, fanned_out=True,
+                    ).values_list('id', flat=True)[
+                        :settings.FEED_BACKFILL_SIZE])
+                batch.extend(FeedEntry(user_id=follower_id,
+                                       recipe_id=recipe_id,
+                                       author_id=author_id)
+                             for recipe_id in recipes)
+                if len(batch) >= batch_size:
+                    FeedEntry.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            FeedEntry.objects.bulk_create(batch)
+            created += len(batch)
+        print(f'В ленты подписок добавлено {created} записей.')
@@ -1,16 +1,54 @@
+import csv
 import json
+import time
 from pathlib import Path
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
-from recipes.models import IngredientModel
+from recipes.models import IngredientModel, TableVersion
+
+NAME_LENGTH = IngredientModel._meta.get_field('name').max_length
+UNIT_LENGTH = IngredientModel._meta.get_field('measurement_unit').max_length
+
+
+def read_json(file, chunk_size=64 * 1024):
+    """Читает JSON-массив по одному объекту, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Ожидается JSON-массив ингредиентов')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def read_csv(file):
+    """Строки CSV без заголовка: название, единица измерения."""
+    for row in csv.reader(file):
+        if row:
+            yield dict(zip(('name', 'measurement_unit'), row))
 
 
 class Command(BaseCommand):
-    help = 'Импортирует модели ингредиентов из JSON-файла.'
+    help = 'Импортирует модели ингредиентов из JSON- или CSV-файла.'
     """Путь к файлу указывается относительно manage.py"""
     """Либо указвается абсолютный путь до файла."""
 
+    readers = {'.json': read_json, '.csv': read_csv}
+
     def handle(self, *args, **options):
         if not options['path']:
             print('Укажите путь до файла в формате "-p <Путь_к_файлу>"')
@@ -19,9 +57,10 @@ class Command(BaseCommand):
         if not path.exists():
             print('Указан неверный путь к файлу')
             return
-        if path.suffix != '.json':
+        if path.suffix not in self.readers:
             print(f'Предупреждение: файл {path} имеет некорректное ' +
-                  'расширение.\nПродолжить? [Y/n]')
+                  'расширение и будет прочитан как JSON.\n' +
+                  'Продолжить? [Y/n]')
             answer = input().lower()
             while answer not in ('y', 'n'):
                 print('Некорректный ответ.\nПродолжить? [Y/n]')
@@ -29,19 +68,69 @@ class Command(BaseCommand):
             if answer == 'n':
                 print('Выполнение прервано.')
                 return
-        with open(path, mode='r', encoding='utf-8') as file:
-            data = json.load(file)
-        count = IngredientModel.objects.all().count()
-        for ingredient in data:
+        reader = self.readers.get(path.suffix, read_json)
+        with open(path, mode='r', encoding='utf-8', newline='') as file:
             try:
-                IngredientModel.objects.get_or_create(**ingredient)
-            except Exception:
+                with transaction.atomic():
+                    new = self.import_ingredients(reader(file), options)
+            except ValueError as error:
+                print('Ошибка при чтении файла:', error)
+                return
+        if options['dry_run']:
+            print(f'Будет добавлено {new} ингредиентов.')
+            return
+        if new:
+            TableVersion.bump(IngredientModel)
+        print(f'Было добавлено {new} ингредиентов.')
+
+    def import_ingredients(self, ingredients, options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        names = set(IngredientModel.objects.values_list('name', flat=True))
+        batch = []
+        processed = new = reported = 0
+        started = time.monotonic()
+        for ingredient in ingredients:
+            processed += 1
+            name = str(ingredient.get('name', '')).strip()
+            unit = str(ingredient.get('measurement_unit', '')).strip()
+            if (not name or not unit or len(name) > NAME_LENGTH
+                    or len(unit) > UNIT_LENGTH):
                 print('Произошла ошибка при добавлении ингредиента:',
                       ingredient)
                 continue
-        new = IngredientModel.objects.all().count() - count
-        print(f'Было добавлено {new} ингредиентов.')
+            if name in names:
+                continue
+            names.add(name)
+            batch.append(IngredientModel(name=name, measurement_unit=unit,
+                                         name_lower=name.lower()))
+            if len(batch) >= batch_size:
+                new += self.write(batch, dry_run)
+                batch = []
+                reported = processed
+                self.report(processed, new, started)
+        new += self.write(batch, dry_run)
+        if processed != reported:
+            self.report(processed, new, started)
+        return new
+
+    @staticmethod
+    def write(batch, dry_run):
+        if batch and not dry_run:
+            IngredientModel.objects.bulk_create(batch, ignore_conflicts=True)
+        return len(batch)
+
+    @staticmethod
+    def report(processed, new, started):
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed else processed
+        print(f'Обработано {processed} записей, новых {new} '
+              f'({rate:.0f} записей/с).')
 
     def add_arguments(self, parser):
         parser.add_argument('-p', '--path', action='store')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Размер пачки для bulk_create.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Проверить файл без записи в базу.')
         return super().add_arguments(parser)
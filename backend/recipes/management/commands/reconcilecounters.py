@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavoriteRecipe, RecipeModel, ShoppingCartRecipes
+from users.models import Follow, User
+
+# (модель, поле-счётчик, связанная модель, внешний ключ на модель)
+COUNTERS = (
+    (RecipeModel, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (RecipeModel, 'shopping_cart_count', ShoppingCartRecipes, 'recipe'),
+    (User, 'recipes_count', RecipeModel, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def actual_count(related, field):
+    return Coalesce(Subquery(
+        related.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')), 0)
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счётчики избранного, списков покупок, рецептов '
+            'и подписчиков с данными и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Только показать расхождения.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, field, related, related_field in COUNTERS:
+            actual = actual_count(related, related_field)
+            drifted = list(model.objects.annotate(actual=actual).exclude(
+                **{field: F('actual')}).values_list('pk', flat=True))
+            print(f'{model.__name__}.{field}: расхождений {len(drifted)}.')
+            if options['verify']:
+                continue
+            for start in range(0, len(drifted), batch_size):
+                model.objects.filter(
+                    pk__in=drifted[start:start + batch_size]
+                ).update(**{field: actual})
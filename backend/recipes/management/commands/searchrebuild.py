@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_search_index(batch_size=options['batch_size'])
+        print(f'Поисковый индекс пересобран для {count} рецептов.')
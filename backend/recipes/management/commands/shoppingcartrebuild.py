@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+
+from recipes.models import RecipeIngredients, ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает суммарные ингредиенты списков покупок '
+            'или проверяет их расхождение с корзинами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Только показать расхождения.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        expected = {
+            (row['user'], row['ingredients']): row['total']
+            for row in RecipeIngredients.objects.filter(
+                recipe__recipes_in_shopping_card__isnull=False
+            ).values(
+                'ingredients', user=F('recipe__recipes_in_shopping_card__user')
+            ).annotate(total=Sum('amount')).order_by()
+        }
+        actual = dict(
+            ((user_id, ingredient_id), amount)
+            for user_id, ingredient_id, amount in
+            ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount').iterator())
+        mismatched = {key for key in expected.keys() | actual.keys()
+                      if expected.get(key) != actual.get(key)}
+        print(f'Расхождений в списках покупок: {len(mismatched)}.')
+        if options['verify'] or not mismatched:
+            return
+        users = {user_id for user_id, _ in mismatched}
+        with transaction.atomic():
+            ShoppingCartIngredient.objects.filter(user_id__in=users).delete()
+            ShoppingCartIngredient.objects.bulk_create(
+                (ShoppingCartIngredient(user_id=user_id,
+                                        ingredient_id=ingredient_id,
+                                        amount=amount)
+                 for (user_id, ingredient_id), amount in expected.items()
+                 if user_id in users),
+                batch_size=options['batch_size'])
+        print(f'Пересчитаны списки покупок {len(users)} пользователей.')
@@ -0,0 +1,94 @@
+from datetime import timedelta
+from posixpath import join
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.utils import timezone
+
+
+def get_file_fields():
+    """Все FileField/ImageField моделей проекта: (модель, имя поля)."""
+    return [(model, field.name)
+            for model in apps.get_models()
+            for field in model._meta.get_fields()
+            if isinstance(field, models.FileField)]
+
+
+def walk(storage, path=''):
+    directories, files = storage.listdir(path)
+    for name in files:
+        if not name.startswith('.'):
+            yield join(path, name) if path else name
+    for directory in directories:
+        yield from walk(storage, join(path, directory) if path else directory)
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_referenced(names, file_fields):
+    referenced = set()
+    for model, field in file_fields:
+        referenced.update(model.objects.filter(
+            **{f'{field}__in': names}).values_list(field, flat=True))
+    return referenced
+
+
+class Command(BaseCommand):
+    help = ('Удаляет из MEDIA_ROOT файлы, на которые не ссылается '
+            'ни одна модель.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать файлы-сироты.')
+        parser.add_argument('--min-age', type=int, default=60,
+                            help='Не трогать файлы моложе N минут: они '
+                                 'могут принадлежать незавершённому '
+                                 'запросу или воркеру.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        if not storage.exists(''):
+            print('Каталог с медиафайлами не найден.')
+            return
+        file_fields = get_file_fields()
+        threshold = timezone.now() - timedelta(minutes=options['min_age'])
+        checked = orphans = reclaimed = 0
+        for batch in batches(walk(storage), options['batch_size']):
+            found, size = self.sweep(storage, batch, file_fields,
+                                     threshold, options['dry_run'])
+            checked += len(batch)
+            orphans += found
+            reclaimed += size
+        action = ('можно освободить' if options['dry_run']
+                  else 'освобождено')
+        print(f'Проверено файлов: {checked}, без ссылок: {orphans}, '
+              f'{action} {reclaimed} байт.')
+
+    @staticmethod
+    def sweep(storage, names, file_fields, threshold, dry_run):
+        referenced = get_referenced(names, file_fields)
+        found = reclaimed = 0
+        for name in names:
+            if (name in referenced
+                    or storage.get_modified_time(name) > threshold):
+                continue
+            found += 1
+            reclaimed += storage.size(name)
+            if dry_run:
+                print(name)
+            else:
+                storage.delete(name)
+        return found, reclaimed
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+def fill_name_lower(apps, schema_editor):
+    IngredientModel = apps.get_model('recipes', 'IngredientModel')
+    ingredients = list(IngredientModel.objects.only('id', 'name'))
+    for ingredient in ingredients:
+        ingredient.name_lower = ingredient.name.lower()
+    IngredientModel.objects.bulk_update(ingredients, ['name_lower'],
+                                        batch_size=1000)
+
+
+def create_trigram_index(apps, schema_editor):
+    # Индекс для поиска по вхождению (LIKE '%...%') есть только в PostgreSQL.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_lower_trgm '
+        'ON recipes_ingredientmodel USING gin (name_lower gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'DROP INDEX IF EXISTS recipes_ingredient_name_lower_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredientmodel',
+            name='name_lower',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=80),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_name_lower, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
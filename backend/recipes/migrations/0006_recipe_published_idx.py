@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_tableversion'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipemodel',
+            options={'ordering': ['-published', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='recipemodel',
+            index=models.Index(fields=['-published', '-id'], name='recipe_published_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:03
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    counters = (
+        ('recipes.RecipeModel', 'favorites_count',
+         'recipes.FavoriteRecipe', 'recipe'),
+        ('recipes.RecipeModel', 'shopping_cart_count',
+         'recipes.ShoppingCartRecipes', 'recipe'),
+        ('users.User', 'recipes_count', 'recipes.RecipeModel', 'author'),
+        ('users.User', 'followers_count', 'users.Follow', 'author'),
+    )
+    for model, field, related, related_field in counters:
+        related = apps.get_model(related)
+        apps.get_model(model).objects.update(**{field: Coalesce(Subquery(
+            related.objects.filter(**{related_field: OuterRef('pk')})
+            .order_by().values(related_field)
+            .annotate(total=Count('pk')).values('total')), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_published_idx'),
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipemodel',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном, раз'),
+        ),
+        migrations.AddField(
+            model_name='recipemodel',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок, раз'),
+        ),
+        migrations.AddIndex(
+            model_name='recipemodel',
+            index=models.Index(fields=['-favorites_count', '-published'], name='recipe_popularity_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
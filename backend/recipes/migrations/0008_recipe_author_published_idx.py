@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipemodel',
+            index=models.Index(fields=['author', '-published', '-id'], name='recipe_author_published_idx'),
+        ),
+    ]
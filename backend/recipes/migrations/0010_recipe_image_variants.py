@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipemodel',
+            name='image_detail',
+            field=models.ImageField(blank=True, editable=False, upload_to='images/variants/', verbose_name='Изображение для страницы рецепта'),
+        ),
+        migrations.AddField(
+            model_name='recipemodel',
+            name='image_list',
+            field=models.ImageField(blank=True, editable=False, upload_to='images/variants/', verbose_name='Изображение для списка'),
+        ),
+        migrations.AddField(
+            model_name='recipemodel',
+            name='image_status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('processing', 'Обрабатывается'), ('done', 'Готово'), ('failed', 'Ошибка')], db_index=True, default='pending', editable=False, max_length=10, verbose_name='Копии изображения'),
+        ),
+    ]
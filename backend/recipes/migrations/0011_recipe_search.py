@@ -0,0 +1,60 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:16
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# SQL на момент миграции, без импорта recipes.search: изменения модуля
+# не должны менять уже применённую схему.
+INGREDIENT_NAMES = (
+    "SELECT {agg} FROM recipes_recipeingredients ri "
+    "JOIN recipes_ingredientmodel i ON i.id = ri.ingredients_id "
+    "WHERE ri.recipe_id = r.id")
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS recipe_search_idx '
+            'ON recipes_recipemodel USING gin (search_vector)')
+        names = INGREDIENT_NAMES.format(agg="string_agg(i.name, ' ')")
+        schema_editor.execute(
+            "UPDATE recipes_recipemodel r SET search_vector = "
+            "setweight(to_tsvector('russian', coalesce(r.name, '')), 'A') "
+            "|| setweight(to_tsvector('russian', "
+            f"coalesce(({names}), '')), 'B') "
+            "|| setweight(to_tsvector('russian', coalesce(r.text, '')), 'C')")
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipesearch '
+            'USING fts5(name, ingredients, text, '
+            "tokenize='unicode61 remove_diacritics 0')")
+        names = INGREDIENT_NAMES.format(agg="group_concat(i.name, ' ')")
+        schema_editor.execute(
+            'INSERT INTO recipes_recipesearch (rowid, name, ingredients, '
+            f'text) SELECT r.id, r.name, ({names}), r.text '
+            'FROM recipes_recipemodel r')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS recipe_search_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipesearch')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipemodel',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
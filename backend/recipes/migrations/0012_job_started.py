@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipemodel',
+            name='image_started',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Начало обработки изображения'),
+        ),
+        migrations.AddField(
+            model_name='shoppinglistexport',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Начало формирования'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pulled_recipes(apps, schema_editor):
+    """Рецепты популярных авторов не были разложены по лентам."""
+    RecipeModel = apps.get_model('recipes', 'RecipeModel')
+    RecipeModel.objects.filter(
+        author__followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).update(fanned_out=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_job_started'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipemodel',
+            name='fanned_out',
+            field=models.BooleanField(default=True, editable=False, verbose_name='Разложен по лентам'),
+        ),
+        migrations.RunPython(mark_pulled_recipes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipemodel',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['author', '-published', '-id'], name='recipe_pulled_idx'),
+        ),
+    ]
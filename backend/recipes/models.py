@@ -1,11 +1,19 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Q, Sum, Value, When
 from django.db.models.constraints import UniqueConstraint
-from django.db.models.signals import pre_delete
+from django.db.models.functions import Greatest
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
 from django.dispatch import receiver
+from django.utils import timezone
 
-from users.models import User
+from users.models import Follow, User, update_counter
+
+from .search import delete_from_search_index
 
 
 class TagModel(models.Model):
@@ -30,12 +38,72 @@ class IngredientModel(models.Model):
                             unique=True,
                             db_index=True)
     measurement_unit = models.CharField(max_length=30)
+    # Название в нижнем регистре для поиска по префиксу: istartswith
+    # не использует индекс, а startswith по этому полю - использует.
+    name_lower = models.CharField(max_length=80,
+                                  db_index=True,
+                                  editable=False)
 
     def __str__(self) -> str:
         return self.name[:30]
 
+    def save(self, *args, **kwargs):
+        self.name_lower = self.name.lower()
+        return super().save(*args, **kwargs)
+
+
+class TableVersion(models.Model):
+    """Версия содержимого таблицы, общая для всех процессов приложения.
+
+    Увеличивается при каждом изменении справочников и используется
+    для ETag/Last-Modified и проверки кеша ответов.
+    """
+
+    table = models.CharField(max_length=100, unique=True,
+                             verbose_name='Таблица')
+    version = models.PositiveBigIntegerField(default=0,
+                                             verbose_name='Версия')
+    updated = models.DateTimeField(default=timezone.now,
+                                   verbose_name='Дата изменения')
+
+    def __str__(self) -> str:
+        return f'{self.table} v{self.version}'
+
+    @classmethod
+    def get(cls, model):
+        version, _ = cls.objects.get_or_create(table=model._meta.label_lower)
+        return version
+
+    @classmethod
+    def bump(cls, model):
+        label = model._meta.label_lower
+        updated = cls.objects.filter(table=label).update(
+            version=F('version') + 1, updated=timezone.now())
+        if not updated:
+            cls.objects.get_or_create(table=label, defaults={'version': 1})
+
+
+@receiver(post_save, sender=TagModel)
+@receiver(post_delete, sender=TagModel)
+@receiver(post_save, sender=IngredientModel)
+@receiver(post_delete, sender=IngredientModel)
+def bump_table_version_hook(sender, **kwargs):
+    TableVersion.bump(sender)
+
 
 class RecipeModel(models.Model):
+    IMAGE_PENDING = 'pending'
+    IMAGE_PROCESSING = 'processing'
+    IMAGE_DONE = 'done'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUS_CHOICES = (
+        (IMAGE_PENDING, 'В очереди'),
+        (IMAGE_PROCESSING, 'Обрабатывается'),
+        (IMAGE_DONE, 'Готово'),
+        (IMAGE_FAILED, 'Ошибка'),
+    )
+    IMAGE_VARIANTS = ('image_list', 'image_detail')
+
     author = models.ForeignKey(User, on_delete=models.PROTECT,
                                verbose_name='Автор',
                                related_name='recipes')
@@ -50,26 +118,176 @@ class RecipeModel(models.Model):
     text = models.TextField(blank=False)
     image = models.ImageField(upload_to='images/',
                               verbose_name='Изображение')
+    image_list = models.ImageField(
+        upload_to='images/variants/', blank=True, editable=False,
+        verbose_name='Изображение для списка')
+    image_detail = models.ImageField(
+        upload_to='images/variants/', blank=True, editable=False,
+        verbose_name='Изображение для страницы рецепта')
+    search_vector = SearchVectorField(null=True, editable=False)
+    image_status = models.CharField(
+        max_length=10, choices=IMAGE_STATUS_CHOICES, default=IMAGE_PENDING,
+        db_index=True, editable=False, verbose_name='Копии изображения')
+    image_started = models.DateTimeField(
+        null=True, blank=True, editable=False,
+        verbose_name='Начало обработки изображения')
     cooking_time = models.PositiveIntegerField(
         blank=False,
         validators=[MinValueValidator(1),
                     MaxValueValidator(4320)])
     published = models.DateTimeField(auto_now_add=True,
                                      verbose_name='Дата публикации')
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В избранном, раз')
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В списках покупок, раз')
+    fanned_out = models.BooleanField(
+        default=True, editable=False, verbose_name='Разложен по лентам')
 
     def __str__(self) -> str:
         return self.name[:30]
 
     class Meta:
-        ordering = ['-published']
+        ordering = ['-published', '-id']
+        indexes = [
+            models.Index(fields=['-published', '-id'],
+                         name='recipe_published_idx'),
+            models.Index(fields=['-favorites_count', '-published'],
+                         name='recipe_popularity_idx'),
+            models.Index(fields=['author', '-published', '-id'],
+                         name='recipe_author_published_idx'),
+            models.Index(fields=['author', '-published', '-id'],
+                         condition=Q(fanned_out=False),
+                         name='recipe_pulled_idx'),
+        ]
+
+
+def delete_file_on_commit(storage, name):
+    """Удаляет файл после фиксации транзакции: при откате строка
+    по-прежнему ссылается на файл, и он должен остаться на месте."""
+    if name:
+        transaction.on_commit(lambda: storage.delete(name))
 
 
-# предпочтительный способ удаления изображения через сигналы
-# или переопределение в админке
 @receiver(pre_delete, sender=RecipeModel)
 def delete_image_hook(sender, instance, using, **kwargs):
-    if instance.image is not None:
-        instance.image.delete()
+    for field in ('image', *RecipeModel.IMAGE_VARIANTS):
+        file = getattr(instance, field)
+        delete_file_on_commit(file.storage, file.name)
+
+
+@receiver(pre_save, sender=RecipeModel)
+def image_changed_hook(sender, instance, update_fields=None, **kwargs):
+    """Старые файлы заменённого изображения удаляются, рецепт снова
+    ставится в очередь runworker."""
+    if instance.pk is None or update_fields is not None:
+        return
+    old = RecipeModel.objects.filter(pk=instance.pk).values(
+        'image', *RecipeModel.IMAGE_VARIANTS).first()
+    if old is None or old['image'] == (instance.image.name or ''):
+        return
+    for field in ('image', *RecipeModel.IMAGE_VARIANTS):
+        delete_file_on_commit(getattr(instance, field).storage, old[field])
+    for field in RecipeModel.IMAGE_VARIANTS:
+        setattr(instance, field, '')
+    instance.image_status = RecipeModel.IMAGE_PENDING
+
+
+@receiver(post_save, sender=RecipeModel)
+def recipe_created_hook(sender, instance, created, **kwargs):
+    if created:
+        update_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=RecipeModel)
+def recipe_deleted_hook(sender, instance, **kwargs):
+    update_counter(User, instance.author_id, 'recipes_count', -1)
+    delete_from_search_index([instance.pk])
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписок пользователя.
+
+    Записи раскладываются подписчикам при публикации рецепта (fan-out
+    on write). Рецепты авторов, у которых при публикации больше
+    FEED_FANOUT_LIMIT подписчиков, не раскладываются (fanned_out=False)
+    и подмешиваются в ленту при чтении.
+    """
+
+    user = models.ForeignKey(User, related_name='feed_entries',
+                             on_delete=models.CASCADE)
+    recipe = models.ForeignKey(RecipeModel, related_name='feed_entries',
+                               on_delete=models.CASCADE)
+    author = models.ForeignKey(User, related_name='+',
+                               on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+          UniqueConstraint(fields=['user', 'recipe'],
+                           name='unique_feed_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'author'],
+                         name='feed_entry_author_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'"{self.recipe}" в ленте {self.user}'
+
+
+def get_feed_filter(user):
+    """Условие на рецепты из ленты подписок user: разложенные заранее
+    и неразложенные рецепты авторов из подписок.
+
+    Режим берётся из рецепта, а не из текущего числа подписчиков автора:
+    когда оно переходит через FEED_FANOUT_LIMIT, рецепты не пропадают
+    из ленты и не попадают в оба условия.
+    """
+    return (
+        Q(pk__in=FeedEntry.objects.filter(user=user).values('recipe_id'))
+        | Q(fanned_out=False, author__in=Follow.objects.filter(
+            follower=user).values('author_id')))
+
+
+@receiver(pre_save, sender=RecipeModel)
+def fan_out_mode_hook(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance.fanned_out = User.objects.filter(
+            pk=instance.author_id,
+            followers_count__lte=settings.FEED_FANOUT_LIMIT).exists()
+
+
+@receiver(post_save, sender=RecipeModel)
+def fan_out_hook(sender, instance, created, **kwargs):
+    if not created or not instance.fanned_out:
+        return
+    followers = Follow.objects.filter(
+        author_id=instance.author_id).values_list('follower_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=follower_id, recipe=instance,
+                   author_id=instance.author_id)
+         for follower_id in followers.iterator()),
+        batch_size=500, ignore_conflicts=True)
+
+
+@receiver(post_save, sender=Follow)
+def feed_backfill_hook(sender, instance, created, **kwargs):
+    if not created:
+        return
+    recipes = RecipeModel.objects.filter(
+        author_id=instance.author_id, fanned_out=True,
+    ).values_list('id', flat=True)
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=instance.follower_id, recipe_id=recipe_id,
+                   author_id=instance.author_id)
+         for recipe_id in recipes[:settings.FEED_BACKFILL_SIZE]),
+        ignore_conflicts=True)
+
+
+@receiver(post_delete, sender=Follow)
+def feed_unfollow_hook(sender, instance, **kwargs):
+    FeedEntry.objects.filter(user_id=instance.follower_id,
+                             author_id=instance.author_id).delete()
 
 
 class RecipeIngredients(models.Model):
@@ -112,6 +330,17 @@ class FavoriteRecipe(models.Model):
         ]
 
 
+@receiver(post_save, sender=FavoriteRecipe)
+def favorite_hook(sender, instance, created, **kwargs):
+    if created:
+        recipes_changed(sender, instance.user_id, [instance.recipe_id], 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+def unfavorite_hook(sender, instance, **kwargs):
+    recipes_changed(sender, instance.user_id, [instance.recipe_id], -1)
+
+
 class ShoppingCartRecipes(models.Model):
     user = models.ForeignKey(User, related_name='in_user_cards',
                              on_delete=models.CASCADE)
@@ -124,3 +353,257 @@ class ShoppingCartRecipes(models.Model):
           UniqueConstraint(fields=['recipe', 'user'],
                            name='unique_shopping_cart'),
         ]
+
+
+class ShoppingCartIngredient(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Поддерживается инкрементально при изменении списка покупок и состава
+    рецептов, пересчитывается командой shoppingcartrebuild.
+    """
+
+    user = models.ForeignKey(User, related_name='cart_ingredients',
+                             on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(IngredientModel,
+                                   related_name='in_user_carts',
+                                   on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        constraints = [
+          UniqueConstraint(fields=['user', 'ingredient'],
+                           name='unique_cart_ingredient'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.ingredient} в списке покупок {self.user}'
+
+
+def get_recipe_amounts(recipe):
+    return dict(RecipeIngredients.objects.filter(recipe=recipe).values_list(
+        'ingredients_id', 'amount'))
+
+
+# Строк (пользователь, ингредиент) в одном INSERT списка покупок
+CART_UPSERT_BATCH = 1000
+
+
+def update_cart_ingredients(user_ids, deltas):
+    """Прибавляет deltas {id ингредиента: количество} к спискам покупок.
+
+    Прибавки пишутся одним INSERT ... ON CONFLICT DO UPDATE на пачку
+    строк, вычитания - одним UPDATE, обнулённые строки удаляются одним
+    DELETE. Строк заранее не читает, поэтому параллельные изменения
+    одного списка не упираются в unique_cart_ingredient.
+    """
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not user_ids or not deltas:
+        return
+    added = [(user_id, ingredient_id, delta) for user_id in user_ids
+             for ingredient_id, delta in deltas.items() if delta > 0]
+    table = connection.ops.quote_name(ShoppingCartIngredient._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(added), CART_UPSERT_BATCH):
+            batch = added[start:start + CART_UPSERT_BATCH]
+            values = ', '.join(['(%s, %s, %s)'] * len(batch))
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+                f'VALUES {values} ON CONFLICT (user_id, ingredient_id) '
+                f'DO UPDATE SET amount = {table}.amount + excluded.amount',
+                [value for row in batch for value in row])
+    removed = {key: -value for key, value in deltas.items() if value < 0}
+    if removed:
+        rows = ShoppingCartIngredient.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=removed)
+        rows.update(amount=Greatest(F('amount') - Case(
+            *(When(ingredient_id=key, then=Value(value))
+              for key, value in removed.items()),
+            output_field=models.PositiveIntegerField()), 0))
+        rows.filter(amount=0).delete()
+
+
+def recipes_changed(model, user_id, recipe_ids, sign):
+    """Счётчик рецептов и, для списка покупок, его суммы по ингредиентам
+    после добавления (sign=1) или удаления (sign=-1) строк model.
+
+    Вызывается сигналами FavoriteRecipe/ShoppingCartRecipes,
+    add_recipes и remove_recipes (их SQL сигналы не вызывает).
+    """
+    if not recipe_ids:
+        return
+    field = ('shopping_cart_count' if model is ShoppingCartRecipes
+             else 'favorites_count')
+    RecipeModel.objects.filter(pk__in=recipe_ids).update(
+        **{field: Greatest(F(field) + sign, 0)})
+    if model is ShoppingCartRecipes:
+        amounts = RecipeIngredients.objects.filter(
+            recipe_id__in=recipe_ids).values('ingredients_id').annotate(
+                total=Sum('amount')).order_by()
+        update_cart_ingredients(
+            [user_id],
+            {row['ingredients_id']: sign * row['total'] for row in amounts})
+
+
+@receiver(post_save, sender=ShoppingCartRecipes)
+def add_to_cart_hook(sender, instance, created, **kwargs):
+    if created:
+        recipes_changed(sender, instance.user_id, [instance.recipe_id], 1)
+
+
+@receiver(pre_delete, sender=ShoppingCartRecipes)
+def remove_from_cart_hook(sender, instance, using, **kwargs):
+    # До удаления: при удалении рецепта его состав удаляется следом.
+    recipes_changed(sender, instance.user_id, [instance.recipe_id], -1)
+
+
+def update_carts_with_recipe(recipe, old_amounts, new_amounts=None):
+    """Переносит изменение состава рецепта в списки покупок с ним."""
+    if new_amounts is None:
+        new_amounts = get_recipe_amounts(recipe)
+    deltas = {key: new_amounts.get(key, 0) - old_amounts.get(key, 0)
+              for key in old_amounts.keys() | new_amounts.keys()}
+    if not any(deltas.values()):
+        return
+    user_ids = list(ShoppingCartRecipes.objects.filter(
+        recipe=recipe).values_list('user_id', flat=True))
+    update_cart_ingredients(user_ids, deltas)
+
+
+def set_recipe_amounts(recipe, amounts):
+    """Приводит состав рецепта к amounts {id ингредиента: количество}.
+
+    Меняются только отличающиеся строки: новые - одним bulk_create,
+    изменённые - bulk_update, лишние - одним DELETE. Изменения
+    переносятся в списки покупок с этим рецептом.
+    """
+    # Строка рецепта блокируется до чтения состава. Добавление рецепта
+    # в список покупок (recipes_changed) меняет её счётчик до чтения
+    # состава и ждёт конца правки: иначе каждая сторона могла не увидеть
+    # изменений другой, и сумма в списке покупок разошлась бы с составом.
+    list(RecipeModel.objects.select_for_update().filter(
+        pk=recipe.pk).values_list('pk', flat=True))
+    rows = {row.ingredients_id: row
+            for row in RecipeIngredients.objects.filter(recipe=recipe).only(
+                'id', 'ingredients_id', 'amount')}
+    old_amounts = {key: row.amount for key, row in rows.items()}
+    removed = old_amounts.keys() - amounts.keys()
+    changed = []
+    for key, row in rows.items():
+        if key in amounts and row.amount != amounts[key]:
+            row.amount = amounts[key]
+            changed.append(row)
+    added = [RecipeIngredients(recipe=recipe, ingredients_id=key,
+                               amount=amount)
+             for key, amount in amounts.items() if key not in rows]
+    if removed:
+        RecipeIngredients.objects.filter(
+            recipe=recipe, ingredients_id__in=removed).delete()
+    if changed:
+        RecipeIngredients.objects.bulk_update(changed, ['amount'])
+    if added:
+        RecipeIngredients.objects.bulk_create(added)
+    update_carts_with_recipe(recipe, old_amounts, amounts)
+
+
+def add_recipes(model, user, recipe_ids):
+    """Добавляет рецепты в избранное или список покупок одним
+    INSERT ... ON CONFLICT DO NOTHING RETURNING.
+
+    Возвращает id добавленных рецептов; уже добавленные и удалённые
+    рецепты пропускаются. Строки заранее не читаются: из параллельных
+    добавлений одного рецепта строку вернёт только одно.
+    """
+    if not recipe_ids:
+        return []
+    table = connection.ops.quote_name(model._meta.db_table)
+    recipes = connection.ops.quote_name(RecipeModel._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, recipe_id) '
+            f'SELECT %s, id FROM {recipes} WHERE id IN ({placeholders}) '
+            f'ORDER BY id ON CONFLICT (user_id, recipe_id) DO NOTHING '
+            f'RETURNING recipe_id', [user.pk, *recipe_ids])
+        added = {row[0] for row in cursor.fetchall()}
+        recipes_changed(model, user.pk, added, 1)
+    return [pk for pk in recipe_ids if pk in added]
+
+
+def remove_recipes(model, user, recipe_ids):
+    """Удаляет рецепты из избранного или списка покупок одним
+    DELETE ... RETURNING и возвращает id удалённых.
+
+    Сигналы удаления не вызываются: счётчики и список покупок
+    обновляются одним вызовом recipes_changed на все удалённые рецепты.
+    """
+    if not recipe_ids:
+        return []
+    table = connection.ops.quote_name(model._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE user_id = %s '
+            f'AND recipe_id IN ({placeholders}) RETURNING recipe_id',
+            [user.pk, *recipe_ids])
+        removed = {row[0] for row in cursor.fetchall()}
+        recipes_changed(model, user.pk, removed, -1)
+    return [pk for pk in recipe_ids if pk in removed]
+
+
+class ShoppingListExport(models.Model):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'В очереди'),
+        (PROCESSING, 'Формируется'),
+        (DONE, 'Готов'),
+        (FAILED, 'Ошибка'),
+    )
+
+    user = models.ForeignKey(User, related_name='shopping_list_exports',
+                             on_delete=models.CASCADE)
+    cart_hash = models.CharField(max_length=64,
+                                 verbose_name='Хеш списка покупок')
+    ingredients = models.JSONField(verbose_name='Состав списка покупок')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING, db_index=True,
+                              verbose_name='Статус')
+    file = models.FileField(upload_to='shopping_lists/', blank=True,
+                            verbose_name='PDF-файл')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Дата создания')
+    started = models.DateTimeField(null=True, blank=True,
+                                   verbose_name='Начало формирования')
+    finished = models.DateTimeField(null=True, blank=True,
+                                    verbose_name='Дата формирования')
+
+    class Meta:
+        constraints = [
+          UniqueConstraint(fields=['user', 'cart_hash'],
+                           name='unique_shopping_list_export'),
+        ]
+        ordering = ['created']
+
+    def __str__(self) -> str:
+        return f'Список покупок {self.user} ({self.status})'
+
+
+@receiver(pre_delete, sender=ShoppingListExport)
+def delete_export_file_hook(sender, instance, using, **kwargs):
+    delete_file_on_commit(instance.file.storage, instance.file.name)
+
+
+def delete_old_exports(user, keep):
+    """Удаляет прежние списки покупок пользователя, кроме keep, одним
+    DELETE ... RETURNING; их файлы удаляются после фиксации транзакции,
+    как в delete_export_file_hook. Один запрос атомарен и без atomic."""
+    table = connection.ops.quote_name(ShoppingListExport._meta.db_table)
+    storage = ShoppingListExport._meta.get_field('file').storage
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE user_id = %s AND id <> %s '
+            f'RETURNING file', [user.pk, keep.pk])
+        for name, in cursor.fetchall():
+            delete_file_on_commit(storage, name)
@@ -0,0 +1,113 @@
+"""Полнотекстовый поиск рецептов по названию, ингредиентам и описанию.
+
+PostgreSQL: столбец search_vector (tsvector) с GIN-индексом, порядок -
+по ts_rank. SQLite: виртуальная таблица FTS5, порядок - по bm25.
+В остальных СУБД поиск идёт по вхождению в название рецепта.
+
+Индекс создаётся миграцией 0011_recipe_search, обновляется при сохранении
+рецепта через API и админку, пересобирается командой searchrebuild.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+SQLITE_TABLE = 'recipes_recipesearch'
+# Вес полей в bm25 для SQLite, в порядке столбцов таблицы FTS5
+SQLITE_WEIGHTS = (10.0, 5.0, 1.0)
+INGREDIENT_NAMES = (
+    "SELECT {agg} FROM recipes_recipeingredients ri "
+    "JOIN recipes_ingredientmodel i ON i.id = ri.ingredients_id "
+    "WHERE ri.recipe_id = r.id")
+POSTGRES_VECTOR = (
+    "setweight(to_tsvector('{config}', coalesce(r.name, '')), 'A') || "
+    "setweight(to_tsvector('{config}', coalesce(({names}), '')), 'B') || "
+    "setweight(to_tsvector('{config}', coalesce(r.text, '')), 'C')"
+).format(config=SEARCH_CONFIG,
+         names=INGREDIENT_NAMES.format(agg="string_agg(i.name, ' ')"))
+
+
+def update_search_index(recipe_ids, using=None):
+    """Пересчитывает поисковый индекс рецептов recipe_ids."""
+    using = using or connection
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with using.cursor() as cursor:
+        if using.vendor == 'postgresql':
+            cursor.execute(
+                f'UPDATE recipes_recipemodel r SET search_vector = '
+                f'{POSTGRES_VECTOR} WHERE r.id IN ({placeholders})',
+                recipe_ids)
+        elif using.vendor == 'sqlite':
+            cursor.execute(
+                f'DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})',
+                recipe_ids)
+            names = INGREDIENT_NAMES.format(agg="group_concat(i.name, ' ')")
+            cursor.execute(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, name, ingredients, text) '
+                f'SELECT r.id, r.name, ({names}), r.text '
+                f'FROM recipes_recipemodel r WHERE r.id IN ({placeholders})',
+                recipe_ids)
+
+
+def delete_from_search_index(recipe_ids, using=None):
+    using = using or connection
+    recipe_ids = list(recipe_ids)
+    if using.vendor != 'sqlite' or not recipe_ids:
+        # В PostgreSQL вектор хранится в самой строке рецепта.
+        return
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with using.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})',
+            recipe_ids)
+
+
+def rebuild_search_index(using=None, batch_size=1000):
+    """Пересобирает индекс всех рецептов, возвращает их количество."""
+    using = using or connection
+    with using.cursor() as cursor:
+        if using.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+        cursor.execute('SELECT id FROM recipes_recipemodel ORDER BY id')
+        recipe_ids = [row[0] for row in cursor.fetchall()]
+    for start in range(0, len(recipe_ids), batch_size):
+        update_search_index(recipe_ids[start:start + batch_size], using)
+    return len(recipe_ids)
+
+
+def sqlite_match(query):
+    """Запрос FTS5 из слов поиска: все слова, каждое как префикс."""
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_recipes(queryset, query):
+    """Рецепты queryset, найденные по query, от более релевантных."""
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG,
+                                   search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query),
+        ).order_by('-search_rank', '-published', '-id')
+    if vendor == 'sqlite':
+        match = sqlite_match(query)
+        if not match:
+            return queryset.none()
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s',
+            (match,),
+        )).annotate(search_rank=RawSQL(
+            f'SELECT bm25({SQLITE_TABLE}, {weights}) FROM {SQLITE_TABLE} '
+            f'WHERE {SQLITE_TABLE} MATCH %s '
+            f'AND rowid = recipes_recipemodel.id',
+            (match,),
+        )).order_by('search_rank', '-published', '-id')
+    return queryset.filter(name__icontains=query)
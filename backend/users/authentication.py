@@ -0,0 +1,103 @@
+"""Аутентификация по токену с кешем токен -> пользователь.
+
+TokenAuthentication на каждый запрос читает authtoken_token вместе
+с users_user. CachedTokenAuthentication запоминает снимок строки
+пользователя на AUTH_TOKEN_CACHE_TTL секунд в кеше auth_tokens и на каждый
+запрос собирает из него новый объект User без обращения к базе.
+
+Запись удаляется при удалении токена (выход через djoser token_destroy)
+и при изменении (в том числе is_active) или удалении пользователя.
+С общим кешем (Redis, Memcached) это действует сразу во всех процессах;
+с кешем в памяти процесса (по умолчанию) в остальных процессах удалённый
+токен и отключённый пользователь действуют до истечения TTL.
+
+BasicAuthentication считает PBKDF2-хеш пароля на каждый запрос, поэтому
+попытки входа по Basic ограничены по IP (BASIC_AUTH_RATE), а настройкой
+BASIC_AUTH_ENABLED его можно отключить совсем.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import (BasicAuthentication,
+                                           TokenAuthentication,
+                                           get_authorization_header)
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import SimpleRateThrottle
+
+User = get_user_model()
+
+
+def snapshot_fields(model):
+    # Счётчики меняются через update() без сигналов, поэтому в снимок
+    # не входят и при обращении читаются из базы.
+    return [field.attname for field in model._meta.concrete_fields
+            if field.editable or field.primary_key]
+
+
+token_cache = caches['auth_tokens']
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    user_fields = snapshot_fields(User)
+    token_fields = snapshot_fields(Token)
+
+    def authenticate_credentials(self, key):
+        if settings.AUTH_TOKEN_CACHE_TTL <= 0:
+            return super().authenticate_credentials(key)
+        cached = token_cache.get(key)
+        if cached is not None:
+            user_values, token_values = cached
+            user = User.from_db(DEFAULT_DB_ALIAS, self.user_fields,
+                                user_values)
+            token = Token.from_db(DEFAULT_DB_ALIAS, self.token_fields,
+                                  token_values)
+            token.user = user
+            return user, token
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, (
+            [getattr(user, field) for field in self.user_fields],
+            [getattr(token, field) for field in self.token_fields],
+        ))
+        return user, token
+
+
+class BasicAuthThrottle(SimpleRateThrottle):
+    scope = 'basic_auth'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope,
+                                    'ident': self.get_ident(request)}
+
+
+class ThrottledBasicAuthentication(BasicAuthentication):
+    """Basic с ограничением частоты попыток до проверки пароля."""
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != b'basic':
+            return None
+        throttle = BasicAuthThrottle()
+        if not throttle.allow_request(request, None):
+            raise Throttled(throttle.wait())
+        return super().authenticate(request)
+
+
+# Запись удаляется после фиксации: иначе параллельный запрос мог бы
+# снова закешировать ещё не изменённую строку.
+@receiver(post_delete, sender=Token)
+def token_deleted_hook(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: token_cache.delete(key))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed_hook(sender, instance, **kwargs):
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list(
+        'key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: token_cache.delete_many(keys))
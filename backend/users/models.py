@@ -2,6 +2,15 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.db.models import F, Q
 from django.db.models.constraints import CheckConstraint, UniqueConstraint
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+def update_counter(model, pk, field, delta):
+    """Атомарно меняет счётчик field у объекта pk, не опуская его ниже 0."""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)})
 
 
 class User(AbstractUser):
@@ -11,6 +20,10 @@ class User(AbstractUser):
     first_name = models.CharField(max_length=150)
     last_name = models.CharField(max_length=150)
     is_staff = models.BooleanField(default=False)
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Количество рецептов')
+    followers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Количество подписчиков')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -48,3 +61,14 @@ class Follow(models.Model):
 
     def __str__(self) -> str:
         return f'{self.follower} подписан на "{self.author}"'
+
+
+@receiver(post_save, sender=Follow)
+def follow_hook(sender, instance, created, **kwargs):
+    if created:
+        update_counter(User, instance.author_id, 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def unfollow_hook(sender, instance, **kwargs):
+    update_counter(User, instance.author_id, 'followers_count', -1)
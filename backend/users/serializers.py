@@ -2,7 +2,6 @@ from rest_framework import serializers
 from rest_framework.serializers import SerializerMethodField
 
 from api.serializers import FavoriteRecipeSerializer
-from recipes.models import RecipeModel
 
 from .models import Follow, User
 
@@ -36,6 +35,8 @@ class SubscribitionSerializer(serializers.ModelSerializer):
     def get_is_subscribed(self, obj):
         if self.context['request'].user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return Follow.objects.filter(follower=self.context['request'].user,
                                      author=obj).exists()
 
@@ -52,4 +53,4 @@ class SubscribitionSerializer(serializers.ModelSerializer):
     #     return []
 
     def get_recipes_count(self, obj):
-        return RecipeModel.objects.filter(author=obj).count()
+        return obj.recipes_count
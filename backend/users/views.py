@@ -1,13 +1,17 @@
 from http import HTTPStatus
 
 from django.contrib.auth import get_user_model
-from django.db.models import OuterRef, Prefetch
+from django.db import IntegrityError, transaction
+from django.db.models import F, Prefetch, Value, Window
+from django.db.models.functions import RowNumber
+from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from api.profiling import ProfiledSerializerMixin
 from recipes.models import RecipeModel
 
 from .models import Follow
@@ -16,6 +20,8 @@ from .serializers import SubscribitionSerializer
 
 User = get_user_model()
 
+RECIPES_LIMIT = 3
+
 
 class UserViewSet(UserViewSet):
 
@@ -30,53 +36,55 @@ class UserViewSet(UserViewSet):
             url_name='subscribe',
             permission_classes=(IsAuthenticated,))
     def subscribe(self, request, id=None):
-        following_qs = User.objects.filter(pk=id)
-        if following_qs.exists():
-            following = following_qs.first()
-            follow = Follow.objects.filter(follower=request.user,
-                                           author=following)
-            if request.method == 'DELETE':
-                if not follow.exists():
-                    data = {'errors': 'Подписка не найдена'}
-                    status = HTTPStatus.BAD_REQUEST
-                else:
+        following = get_object_or_404(User, pk=id)
+        if request.method == 'DELETE':
+            with transaction.atomic():
+                follows = list(Follow.objects.select_for_update().filter(
+                    follower=request.user, author=following))
+                for follow in follows:
                     follow.delete()
-                    status = HTTPStatus.NO_CONTENT
-                    data = {'detail': 'Подписка отменена'}
-            else:
-                if request.user == following:
-                    data = {'errors': 'Невозможно подписаться на самого себя.'}
-                    status = HTTPStatus.BAD_REQUEST
-                elif follow.exists():
-                    data = {'errors': 'Подписка на автора уже существует.'}
-                    status = HTTPStatus.BAD_REQUEST
-                else:
-                    Follow.objects.create(follower=request.user,
-                                          author=following)
-                    data = SubscribitionSerializer(
-                        following,  # data = AuthorSerializer(following,
-                        context={'request': request}).data
-                    status = HTTPStatus.CREATED
-        else:
-            data = {'detail': 'Страница не найдена.'}
-            status = HTTPStatus.NOT_FOUND
-        return Response(data=data, status=status)
+            if not follows:
+                return Response({'errors': 'Подписка не найдена'},
+                                status=HTTPStatus.BAD_REQUEST)
+            return Response({'detail': 'Подписка отменена'},
+                            status=HTTPStatus.NO_CONTENT)
+        if request.user.pk == following.pk:
+            return Response(
+                {'errors': 'Невозможно подписаться на самого себя.'},
+                status=HTTPStatus.BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                Follow.objects.create(follower=request.user, author=following)
+        except IntegrityError:
+            return Response({'errors': 'Подписка на автора уже существует.'},
+                            status=HTTPStatus.BAD_REQUEST)
+        data = SubscribitionSerializer(following,
+                                       context={'request': request}).data
+        return Response(data=data, status=HTTPStatus.CREATED)
 
 
-class SubscribitionViewSet(viewsets.GenericViewSet,
+class SubscribitionViewSet(ProfiledSerializerMixin,
+                           viewsets.GenericViewSet,
                            mixins.ListModelMixin,):
 
     serializer_class = SubscribitionSerializer
     permission_classes = (IsAuthenticated, )
     pagination_class = PageLimitPagination
+    query_budget = 4
 
     def get_queryset(self):
-        recipes_limit = self.request.GET.get('recipes_limit', default=3)
-        recipes_limit = int(recipes_limit)
-        recipes = RecipeModel.objects.filter(author_id=OuterRef("author_id")
-                                             )[:recipes_limit]
-        return User.objects.filter(followed_by__follower=self.request.user
-                                   ).prefetch_related(
-             Prefetch("recipes",
-                      queryset=RecipeModel.objects.filter(id__in=recipes)))
-        # return User.objects.filter(followed_by__follower=self.request.user)
+        recipes_limit = self.request.GET.get('recipes_limit', '')
+        recipes_limit = (int(recipes_limit) if recipes_limit.isdigit()
+                         else RECIPES_LIMIT)
+        # Ограничение на автора считается в том же запросе, что и
+        # prefetch рецептов, без выборки всех рецептов в память.
+        recipes = RecipeModel.objects.annotate(row_number=Window(
+            RowNumber(), partition_by=F('author_id'),
+            order_by=(F('published').desc(), F('id').desc()),
+        )).filter(row_number__lte=recipes_limit).order_by('-published', '-id')
+        return User.objects.filter(
+            followed_by__follower=self.request.user
+        ).annotate(
+            is_subscribed=Value(True)
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes))